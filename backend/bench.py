@@ -0,0 +1,251 @@
+"""Offline benchmark for the register / mark-attendance hot paths.
+
+Runs in a scratch directory with its own SQLite database and a local NumPy
+vector index, so it never touches production data or the network::
+
+    python -m backend.bench --samples 200 --gallery 5000 --concurrency 16 --output bench.json
+    python -m backend.bench --faces ./photos --compare bench.json
+
+Per-stage latencies and the load-test results are written as JSON so runs
+can be diffed after an upgrade.
+"""
+import argparse
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+STAGES = ["decode", "detect", "embed", "query", "db_lookup", "log_attendance"]
+
+
+def synthetic_face(rng, size=480):
+    """A crude frontal face on a noisy background; enough to exercise every stage."""
+    image = rng.integers(0, 60, size=(size, size, 3), dtype=np.uint8)
+    center = (size // 2 + int(rng.integers(-20, 20)), size // 2 + int(rng.integers(-20, 20)))
+    skin = tuple(int(c) for c in rng.integers(120, 230, size=3))
+    cv2.ellipse(image, center, (size // 5, size // 4), 0, 0, 360, skin, -1)
+    eye_y = center[1] - size // 14
+    for dx in (-size // 12, size // 12):
+        cv2.ellipse(image, (center[0] + dx, eye_y), (size // 36, size // 60), 0, 0, 360, (30, 30, 30), -1)
+    cv2.line(image, (center[0], eye_y + 10), (center[0] - 6, center[1] + size // 30), (90, 70, 60), 3)
+    cv2.ellipse(image, (center[0], center[1] + size // 10), (size // 18, size // 60), 0, 0, 180, (80, 40, 40), 3)
+    return image
+
+
+def load_samples(args):
+    if args.faces:
+        paths = sorted(
+            os.path.join(args.faces, name) for name in os.listdir(args.faces)
+            if name.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
+        samples = []
+        for path in paths[:args.samples]:
+            with open(path, "rb") as f:
+                samples.append(f.read())
+        return samples
+    rng = np.random.default_rng(args.seed)
+    return [cv2.imencode(".jpg", cv2.cvtColor(synthetic_face(rng), cv2.COLOR_RGB2BGR))[1].tobytes() for _ in range(args.samples)]
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values) * 1000.0
+    return {
+        "count": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def isolate(workdir):
+    """Point the database, outbox, index, archive and enrollment jobs at ``workdir``.
+
+    Overrides rather than defaults, so exported production settings cannot
+    leak in. The backend reads them at import time, so this must run first.
+    """
+    if f"{__package__}.database" in sys.modules:
+        raise RuntimeError("isolate() must run before any backend module is imported")
+    os.environ.update({
+        "VECTOR_BACKEND": "numpy",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "OUTBOX_PATH": os.path.join(workdir, "outbox.db"),
+        "VECTOR_INDEX_PATH": os.path.join(workdir, "vector_index", "face-recognition"),
+        "EMBEDDING_ARCHIVE_DIR": os.path.join(workdir, "embedding_archive"),
+        "ENROLLMENT_DIR": os.path.join(workdir, "enrollment_jobs"),
+    })
+
+
+def seed_gallery(size, seed):
+    from .database import SessionLocal, User
+    from .utils.attendance_utils import index
+
+    rng = np.random.default_rng(seed)
+    db = SessionLocal()
+    try:
+        users = [User(username=f"bench-user-{i}", ip="bench") for i in range(size)]
+        db.add_all(users)
+        db.flush()
+        ids = [str(user.id) for user in users]
+        db.commit()
+    finally:
+        db.close()
+    index.upsert(list(zip(ids, rng.standard_normal((size, 512)).astype(np.float32))))
+    return ids
+
+
+async def bench_stages(samples, gallery_ids):
+    from fastapi import UploadFile
+    from .utils import attendance_utils
+
+    timings = {stage: [] for stage in STAGES}
+    misses = 0
+    for i, payload in enumerate(samples):
+        start = time.perf_counter()
+        image = await attendance_utils.read_image_data(UploadFile(file=io.BytesIO(payload), filename="bench.jpg"))
+        start = record(timings, "decode", start)
+
+        try:
+            face = attendance_utils.detect_face(image)
+        except ValueError:
+            # Synthetic faces are not always found; carry on with a centre crop.
+            misses += 1
+            height, width = image.shape[:2]
+            face = image[height // 4:3 * height // 4, width // 4:3 * width // 4]
+        start = record(timings, "detect", start)
+
+        embedding = attendance_utils.get_embedding(face)
+        start = record(timings, "embed", start)
+
+        attendance_utils.index.query(embedding, top_k=1)
+        start = record(timings, "query", start)
+
+        user_id = gallery_ids[i % len(gallery_ids)]
+        username = attendance_utils.get_username_by_id(user_id)
+        start = record(timings, "db_lookup", start)
+
+        attendance_utils.log_attendance(user_id, username)
+        record(timings, "log_attendance", start)
+    return {stage: percentiles(values) for stage, values in timings.items()}, misses
+
+
+def record(timings, stage, start):
+    now = time.perf_counter()
+    timings[stage].append(now - start)
+    return now
+
+
+async def load_test(samples, requests, concurrency):
+    import httpx
+    from .main import app
+
+    latencies, statuses = [], {}
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(samples[i % len(samples)])
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            async def worker():
+                while True:
+                    try:
+                        payload = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    start = time.perf_counter()
+                    response = await client.post("/mark-attendance", files={"image_data": ("bench.jpg", payload, "image/jpeg")})
+                    latencies.append(time.perf_counter() - start)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "throughput_rps": requests / elapsed if elapsed else 0.0,
+        "status_codes": {str(code): count for code, count in statuses.items()},
+        "latency": percentiles(latencies),
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"{'stage':<16}{'baseline p50':>14}{'current p50':>14}{'delta':>10}")
+    for stage in STAGES:
+        before = baseline.get("stages", {}).get(stage, {}).get("p50_ms")
+        after = current["stages"].get(stage, {}).get("p50_ms")
+        if before and after:
+            print(f"{stage:<16}{before:>12.2f}ms{after:>12.2f}ms{(after - before) / before:>+10.1%}")
+    before = baseline.get("load", {}).get("throughput_rps")
+    after = current.get("load", {}).get("throughput_rps")
+    if before and after:
+        print(f"{'throughput':<16}{before:>11.1f}rps{after:>11.1f}rps{(after - before) / before:>+10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--faces", help="Directory of real face photos; synthetic faces are generated if omitted")
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--gallery", type=int, default=1000, help="Number of enrolled identities in the stand-in index")
+    parser.add_argument("--requests", type=int, default=200, help="Requests for the concurrent load test (0 to skip)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="Previous results file to diff against")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    faces = os.path.abspath(args.faces) if args.faces else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    args.faces = faces
+
+    if args.requests and importlib.util.find_spec("httpx") is None:
+        sys.exit("The load test needs httpx (pip install -r backend/requirements-dev.txt); pass --requests 0 to skip it")
+
+    with tempfile.TemporaryDirectory(prefix="attendance-bench-") as workdir:
+        isolate(workdir)
+        # Anything else the backend resolves against the working directory lands here too.
+        os.chdir(workdir)
+        samples = load_samples(args)
+        if not samples:
+            sys.exit("No samples to benchmark")
+        gallery_ids = seed_gallery(args.gallery, args.seed)
+        stages, misses = asyncio.run(bench_stages(samples, gallery_ids))
+        results = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "detect_misses": misses,
+            "stages": stages,
+        }
+        if args.requests:
+            results["load"] = asyncio.run(load_test(samples, args.requests, args.concurrency))
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Recall benchmark for the quantised NumPy index.
+
+Builds a synthetic gallery of identities with several noisy photos each and
+compares every quantisation mode against exact float32 cosine search::
+
+    python -m backend.bench_quantization --identities 20000 --photos 3 --probes 1000
+
+Reports recall@1, how often the accept/reject decision at the similarity
+threshold agrees with float32, per-query latency and bytes per vector.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from .utils.vector_store import EMBEDDING_DIM, NumpyIndex, normalize
+
+MODES = ["none", "float16", "int8", "pq"]
+
+
+def synthetic_gallery(identities, photos, noise, seed):
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.normal(size=(identities, EMBEDDING_DIM)))
+    samples = normalize(np.repeat(centers, photos, axis=0) + rng.normal(scale=noise, size=(identities * photos, EMBEDDING_DIM)))
+    ids = [f"{i}:{k}" for i in range(identities) for k in range(photos)]
+    return centers, ids, samples.astype(np.float32)
+
+
+def run_mode(mode, ids, samples, probes, truth, top_k, threshold, workdir):
+    index = NumpyIndex(path=os.path.join(workdir, mode), quantization=mode)
+    start = time.perf_counter()
+    index.upsert(list(zip(ids, samples)))
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = index.query_batch(probes, top_k=top_k)
+    elapsed = time.perf_counter() - start
+
+    top = [r["matches"][0] for r in results]
+    return {
+        "build_s": build,
+        "query_ms": elapsed * 1000.0 / len(probes),
+        "bytes_per_vector": index.memory_bytes() / len(ids),
+        "recall_at_1": float(np.mean([m["id"].split(":")[0] == str(t) for m, t in zip(top, truth)])),
+        "top": top,
+        "accepted": np.array([m["score"] > threshold for m in top]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--identities", type=int, default=10000)
+    parser.add_argument("--photos", type=int, default=3, help="Enrolled photos per identity")
+    parser.add_argument("--probes", type=int, default=1000)
+    parser.add_argument("--noise", type=float, default=0.03, help="Per-dimension noise of a photo around its identity")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.70)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    centers, ids, samples = synthetic_gallery(args.identities, args.photos, args.noise, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    truth = rng.integers(0, args.identities, size=args.probes)
+    probes = normalize(centers[truth] + rng.normal(scale=args.noise, size=(args.probes, EMBEDDING_DIM)))
+
+    report = {}
+    with tempfile.TemporaryDirectory(prefix="quantization-bench-") as workdir:
+        for mode in MODES:
+            report[mode] = run_mode(mode, ids, samples, probes, truth, args.top_k, args.threshold, workdir)
+
+    exact_top, exact_accepted = report["none"]["top"], report["none"]["accepted"]
+    for mode in MODES:
+        result = report[mode]
+        top = result.pop("top")
+        result["top1_agreement"] = float(np.mean([a["id"] == b["id"] for a, b in zip(top, exact_top)]))
+        result["decision_agreement"] = float(np.mean(result.pop("accepted") == exact_accepted))
+        result["max_top1_score_error"] = float(max(abs(a["score"] - b["score"]) for a, b in zip(top, exact_top)))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,59 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+import os
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, DateTime, Date, Time, Index
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import func
 
-DATABASE_URL = "sqlite:///./test.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DEFAULT_SITE = os.getenv("DEFAULT_SITE", "default")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_url(url):
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + sep + rest
+
+
+is_sqlite = DATABASE_URL.startswith("sqlite")
+engine_options = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT, "pool_pre_ping": not is_sqlite}
+connect_args = {"check_same_thread": False} if is_sqlite else {}
+
+engine = create_engine(DATABASE_URL, connect_args=connect_args, **engine_options)
+async_engine = create_async_engine(async_url(DATABASE_URL), **engine_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets check-in reads run alongside the attendance writer instead of queueing behind its lock.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+if is_sqlite:
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+
 class User(Base):
     __tablename__ = "users"
+    # Never reuse a deleted user's id; tokens and attendance rows refer to users by id.
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, index=True)
@@ -18,9 +61,78 @@ class User(Base):
     ip = Column(String)
     timestamp = Column(DateTime, default=func.now())
     password = Column(String)
+    site = Column(String, index=True, nullable=False, default=DEFAULT_SITE, server_default=DEFAULT_SITE)
+
+class Attendance(Base):
+    __tablename__ = "attendance"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Idempotency key of the check-in that produced the row; replays with the same key are skipped.
+    event_id = Column(String, unique=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    username = Column(String)
+    date = Column(Date, nullable=False)
+    time = Column(Time, nullable=False)
+    timestamp = Column(DateTime, default=func.now())
+
+    __table_args__ = (Index("ix_attendance_date_user_id", "date", "user_id"),)
+
+
+class AttendanceDaily(Base):
+    """Per-user, per-day rollup of ``attendance``, maintained by the attendance writer."""
+
+    __tablename__ = "attendance_daily"
+
+    date = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    username = Column(String)
+    check_ins = Column(Integer, nullable=False, default=0)
+    first_seen = Column(DateTime)
+    last_seen = Column(DateTime)
+
+class AttendanceWeekly(Base):
+    """Per-user rollup for the week starting on Monday ``week_start``."""
+
+    __tablename__ = "attendance_weekly"
+
+    week_start = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    username = Column(String)
+    check_ins = Column(Integer, nullable=False, default=0)
+    days_present = Column(Integer, nullable=False, default=0)
+    first_seen = Column(DateTime)
+    last_seen = Column(DateTime)
+
+class EnrolledFile(Base):
+    """Source file a bulk-enrollment job turned into a user, written in the same transaction as the user."""
+
+    __tablename__ = "enrolled_files"
+
+    job_id = Column(String, primary_key=True)
+    filename = Column(String, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+
+
+ADDED_COLUMNS = {
+    "users": [("site", f"VARCHAR NOT NULL DEFAULT '{DEFAULT_SITE}'", "CREATE INDEX IF NOT EXISTS ix_users_site ON users (site)")],
+    "attendance": [("event_id", "VARCHAR", "CREATE UNIQUE INDEX IF NOT EXISTS ix_attendance_event_id ON attendance (event_id)")],
+}
+
+
+def add_missing_columns():
+    # create_all never alters an existing table, so columns added later are created here.
+    inspector = inspect(engine)
+    for table, added in ADDED_COLUMNS.items():
+        columns = {column["name"] for column in inspector.get_columns(table)}
+        for name, definition, index in added:
+            if name not in columns:
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+                    connection.execute(text(index))
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
 
 init_db()
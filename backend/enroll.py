@@ -0,0 +1,34 @@
+import argparse
+import json
+
+from .utils.attendance_utils import index
+from .utils.enrollment import EnrollmentJob, ENROLL_WORKERS
+from .utils.outbox import outbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-enroll a directory or zip of face photos.")
+    parser.add_argument("source", help="Directory or .zip of images, optionally with a manifest.csv (filename,username)")
+    parser.add_argument("--job-id", help="Resume the job with this id instead of starting a new one")
+    parser.add_argument("--workers", type=int, default=ENROLL_WORKERS)
+    parser.add_argument("--threshold", type=float, default=0.70, help="Similarity above which a face counts as already enrolled")
+    parser.add_argument("--site", help="Site to enroll into (defaults to DEFAULT_SITE)")
+    args = parser.parse_args()
+
+    job = EnrollmentJob(args.source, job_id=args.job_id, similarity_threshold=args.threshold, site=args.site)
+    print(f"Enrollment job {job.job_id}")
+    # Enrolled faces reach the gallery through the outbox; stopping drains what is left.
+    outbox.start()
+    try:
+        progress = job.run(
+            index,
+            workers=args.workers,
+            on_progress=lambda p: print(f"{p['processed']}/{p['total']} processed, {p['enrolled']} enrolled, {p['duplicates']} duplicates, {p['failed']} failed"),
+        )
+    finally:
+        outbox.stop()
+    print(json.dumps(progress, indent=2))
+
+
+if __name__ == "__main__":
+    main()
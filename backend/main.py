@@ -1,24 +1,51 @@
-from fastapi import FastAPI
-from .routes import users, admin
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from .routes import users, admin, health, metrics, stream
 
-from .database import engine, Base
+from .database import engine, async_engine, Base
 
-from .utils.auth_utils import get_password_hash
+from .utils.executors import executors
+from .utils.attendance_utils import embedding_batcher, index
+from .utils.attendance_store import import_legacy_sheets
+from .utils.outbox import outbox
+from .utils.attendance_rollups import ensure_rollups
+from .utils.identity import user_directory
+from .utils.metrics import start_trace, server_timing
 
-Base.metadata.create_all(bind=engine)
+TRACE_HEADER = "X-Trace-Stages"
 
-hasshed_pass = get_password_hash("admin")
-print(hasshed_pass)
+Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(user_directory.load)
+    await executors.start()
+    await embedding_batcher.start()
+    # Replays whatever an earlier run left in the outbox.
+    outbox.start()
+    await run_in_threadpool(ensure_rollups)
+    await run_in_threadpool(import_legacy_sheets)
+    yield
+    await embedding_batcher.stop()
+    await run_in_threadpool(outbox.stop)
+    await run_in_threadpool(index.flush)
+    executors.shutdown()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def trace_stages(request: Request, call_next):
+    if TRACE_HEADER.lower() not in request.headers:
+        return await call_next(request)
+    trace = start_trace()
+    response = await call_next(request)
+    response.headers["Server-Timing"] = server_timing(trace)
+    return response
 
 app.include_router(users.router)
 app.include_router(admin.router)
-
-
-
-
-
-
-
-
+app.include_router(health.router)
+app.include_router(metrics.router)
+app.include_router(stream.router)
@@ -0,0 +1,65 @@
+"""Check the gallery against the users table, or rebuild it from the embedding archive.
+
+    python -m backend.reindex verify
+    python -m backend.reindex export
+    python -m backend.reindex rebuild --backend hnsw --workers 8
+    python -m backend.reindex retrain
+
+``export`` copies galleries enrolled before the archive existed into it.
+``retrain`` refits the PQ codebook of each NumPy shard (VECTOR_QUANTIZATION=pq)
+on its current vectors; writes never do. Stop the server before ``rebuild``
+or ``retrain``; a running server keeps its own copy of the index in memory
+and would write it back.
+"""
+import argparse
+import json
+import sys
+
+from .utils.embedding_archive import EmbeddingArchive, EMBEDDING_ARCHIVE_DIR
+from .utils.model_manager import EMBEDDING_MODEL
+from .utils.reindexing import REINDEX_BATCH_SIZE, REINDEX_WORKERS, export_archive, rebuild_gallery, verify_gallery
+from .utils.sharding import create_sharded_gallery
+from .utils.vector_store import VECTOR_BACKEND, NumpyIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["verify", "export", "rebuild", "retrain"])
+    parser.add_argument("--backend", default=VECTOR_BACKEND, help="Index backend to check or rebuild into")
+    parser.add_argument("--archive", default=EMBEDDING_ARCHIVE_DIR)
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Embedding model whose archived vectors are used")
+    parser.add_argument("--site", action="append", help="Rebuild only this site (repeatable)")
+    parser.add_argument("--workers", type=int, default=REINDEX_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=REINDEX_BATCH_SIZE)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if indexed users without archived embeddings are dropped")
+    args = parser.parse_args()
+
+    archive = EmbeddingArchive(args.archive, model=args.model)
+    if args.command == "verify":
+        report = verify_gallery(create_sharded_gallery(args.backend), archive)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["consistent"] else 1)
+    elif args.command == "retrain":
+        gallery = create_sharded_gallery(args.backend)
+        retrained = []
+        for site in sorted(gallery.sites):
+            prototypes = gallery.shard(site).prototypes
+            if isinstance(prototypes, NumpyIndex):
+                prototypes.retrain_codebook()
+                retrained.append(site)
+        print(json.dumps({"retrained": retrained}, indent=2))
+    elif args.command == "export":
+        exported = export_archive(create_sharded_gallery(args.backend), archive)
+        print(json.dumps({"exported": exported, "model": args.model, "archive": archive.path()}, indent=2))
+    else:
+        try:
+            report = rebuild_gallery(
+                archive, args.backend, sites=args.site, workers=args.workers, batch_size=args.batch_size, force=args.force
+            )
+        except ValueError as e:
+            sys.exit(str(e))
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,102 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, status, Depends, Query, UploadFile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 from fastapi.security import OAuth2PasswordRequestForm
-from datetime import datetime, timedelta
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from datetime import datetime, time
 from ..database import User as UserModel
-from ..schema import UserInDB, UserAdminView
-from ..utils.auth_utils import get_current_user, get_db, authenticate_user, create_access_token
+from ..schema import TokenUser, UserAdminView, RefreshRequest
+from ..utils.auth_utils import get_current_user, get_async_db, authenticate_user, create_tokens, refresh_tokens
+from ..utils.identity import get_user, user_directory
+from ..utils.attendance_store import (
+    get_attendance_for_date, get_attendance_by_date, query_attendance, attendance_summary, export_xlsx,
+    ATTENDANCE_PAGE_SIZE, ATTENDANCE_MAX_PAGE_SIZE,
+)
+from ..utils.attendance_export import stream_attendance, EXPORT_MEDIA_TYPES
+from ..utils.attendance_rollups import attendance_rollups, rebuild_rollups
+from ..utils.attendance_utils import index, archive, embed_face, gallery_cache
+from ..utils.reindexing import verify_gallery
+from ..utils.executors import executors
+from ..utils.imaging import save_upload
+from ..utils.enrollment import ENROLLMENT_DIR, MAX_ENROLLMENT_ARCHIVE_BYTES, enrollment_jobs, start_enrollment_job, get_enrollment_job
 import os
-import pandas as pd
+import shutil
+import uuid
+import zipfile
+from .users import decode, detect, request_site
+from ..utils.sharding import ALL_SITES
 
 router = APIRouter()
 
 @router.get("/admin/users/", tags=["admin"], response_model=List[UserAdminView])
-async def list_users(user_id: Optional[int] = None, current_user: UserInDB = Depends(get_current_user), db: Session = Depends(get_db)):
+async def list_users(user_id: Optional[int] = None, site: Optional[str] = None, current_user: TokenUser = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     if user_id is not None:
-        user = db.query(UserModel).filter(UserModel.id == user_id).first()
+        user = await get_user(db, user_id)
         if not user:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
         return [user]
 
-    return db.query(UserModel).filter(current_user.id != UserModel.id).all()
+    query = select(UserModel).where(UserModel.id != current_user.id)
+    if site is not None:
+        query = query.where(UserModel.site == site)
+    return (await db.execute(query)).scalars().all()
+
+@router.delete("/admin/users/{user_id}", tags=["admin"])
+async def delete_user(user_id: int, current_user: TokenUser = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """Remove a user and their face embeddings; past attendance records are kept."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    if user_id == current_user.id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot delete your own account")
+
+    user = await db.get(UserModel, user_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    await db.delete(user)
+    await db.commit()
+
+    user_directory.remove(user_id)
+    gallery_cache.pop((user.site, str(user_id)))
+    await executors.io.run("db", index.delete, [str(user_id)], user.site)
+    await executors.io.run("db", index.flush)
+    return {"message": f"User {user.username} deleted", "user_id": user_id}
+
+@router.post("/admin/users/{user_id}/samples", tags=["admin"])
+async def add_user_samples(
+    user_id: int, image_data: List[UploadFile], current_user: TokenUser = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)
+):
+    """Add reference photos for an enrolled user; their prototype is recomputed from all samples."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    user = await get_user(db, user_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    embeddings, rejected = [], []
+    for upload in image_data:
+        try:
+            embeddings.append(await embed_face(await detect(await decode(upload))))
+        except HTTPException as e:
+            if e.status_code in (503, 504):
+                raise
+            rejected.append({"filename": upload.filename, "message": e.detail})
+        except Exception as e:
+            rejected.append({"filename": upload.filename, "message": str(e)})
+    if embeddings:
+        await executors.io.run("db", index.add_samples, str(user_id), embeddings, user.site)
+        await executors.io.run("db", index.flush)
+    return {"user_id": user_id, "added": len(embeddings), "samples": index.sample_count(user_id, site=user.site), "rejected": rejected}
 
 @router.post("/login", tags=["auth"], include_in_schema=False)
 async def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -36,86 +104,225 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token_expires = timedelta(minutes=15)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
+    return create_tokens(user)
+
+@router.post("/token/refresh", tags=["auth"])
+async def refresh_access_token(body: RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    tokens = await refresh_tokens(db, body.refresh_token)
+    if tokens is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return tokens
 
-    return {"access_token": access_token, "token_type": "bearer"}
+def parse_date(value: str):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid date '{value}', expected YYYY-MM-DD")
 
 @router.get("/admin/attendance/{date}", tags=["admin"])
-async def get_attendance(date: str, current_user: UserInDB = Depends(get_current_user)):
+async def get_attendance(date: str, current_user: TokenUser = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
-    file_path = f"attendance_sheets/{date}.xlsx"
-    if not os.path.exists(file_path):
+    attendance_data = await run_in_threadpool(get_attendance_for_date, parse_date(date))
+    if not attendance_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attendance sheet not found")
 
-    try:
-        attendance_data = pd.read_excel(file_path)
-        return attendance_data.to_dict(orient="records")
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error reading attendance sheet: {str(e)}")
+    return attendance_data
+
+@router.get("/admin/attendance/{date}/xlsx", tags=["admin"])
+async def export_attendance_xlsx(date: str, current_user: TokenUser = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    buffer = await run_in_threadpool(export_xlsx, parse_date(date))
+    return StreamingResponse(
+        buffer,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f'attachment; filename="{date}.xlsx"'},
+    )
 
 @router.get("/admin/attendance-sheets/", tags=["admin"])
-async def list_attendance_sheets(current_user: UserInDB = Depends(get_current_user)):
+async def list_attendance_sheets(current_user: TokenUser = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     try:
-        files = os.listdir("attendance_sheets/")
-        attendance_sheets = [f for f in files if f.endswith(".xlsx")]
-        all_sheets = []
-
-        for sheet in attendance_sheets:
-            try:
-                file_path = f"attendance_sheets/{sheet}"
-                attendance_data = pd.read_excel(file_path)
-                all_sheets.append({
-                    "date": sheet.split('.')[0],
-                    "data": attendance_data.to_dict(orient="records")
-                })
-            except ValueError:
-                continue
-
-        return {"attendance_sheets": all_sheets}
+        return {"attendance_sheets": await run_in_threadpool(get_attendance_by_date)}
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error listing attendance sheets: {str(e)}")
 
 @router.get("/admin/attendance-sheets-range/", tags=["admin"])
 async def list_attendance_sheets_range(
-    start_date: str = Query(..., description="Start date in DD-MM-YYYY format"),
-    end_date: str = Query(..., description="End date in DD-MM-YYYY format"),
-    current_user: UserInDB = Depends(get_current_user)
+    start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    current_user: TokenUser = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
+    start_date_dt = parse_date(start_date)
+    end_date_dt = parse_date(end_date)
+
     try:
-        start_date_dt = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date_dt = datetime.strptime(end_date, '%Y-%m-%d')
-        
-        files = os.listdir("attendance_sheets/")
-        attendance_sheets = [f for f in files if f.endswith(".xlsx")]
-        filtered_sheets = []
-
-        for sheet in attendance_sheets:
-            try:
-                sheet_date = datetime.strptime(sheet.split('.')[0], '%Y-%m-%d')
-                if start_date_dt <= sheet_date <= end_date_dt:
-                    file_path = f"attendance_sheets/{sheet}"
-                    attendance_data = pd.read_excel(file_path)
-                    filtered_sheets.append({
-                        "date": sheet.split('.')[0],
-                        "data": attendance_data.to_dict(orient="records")
-                    })
-            except ValueError:
-                continue
-        
-        if not filtered_sheets:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No attendance sheets found in the specified date range")
-
-        return {"attendance_sheets": filtered_sheets}
+        filtered_sheets = await run_in_threadpool(get_attendance_by_date, start_date_dt, end_date_dt)
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error filtering attendance sheets: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error filtering attendance sheets: {str(e)}")
+
+    if not filtered_sheets:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No attendance sheets found in the specified date range")
+
+    return {"attendance_sheets": filtered_sheets}
+
+def parse_time(value: str):
+    try:
+        return time.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid time '{value}', expected HH:MM or HH:MM:SS")
+
+def attendance_filters(
+    user_id: Optional[int] = None,
+    start_date: Optional[str] = Query(None, description="Start date in YYYY-MM-DD format"),
+    end_date: Optional[str] = Query(None, description="End date in YYYY-MM-DD format"),
+    start_time: Optional[str] = Query(None, description="Earliest time of day, HH:MM[:SS]"),
+    end_time: Optional[str] = Query(None, description="Latest time of day, HH:MM[:SS]"),
+):
+    return {
+        "user_id": user_id,
+        "start_date": parse_date(start_date) if start_date else None,
+        "end_date": parse_date(end_date) if end_date else None,
+        "start_time": parse_time(start_time) if start_time else None,
+        "end_time": parse_time(end_time) if end_time else None,
+    }
+
+@router.get("/admin/attendance-records/", tags=["admin"])
+async def list_attendance_records(
+    filters: dict = Depends(attendance_filters),
+    cursor: Optional[str] = None,
+    limit: int = Query(ATTENDANCE_PAGE_SIZE, ge=1, le=ATTENDANCE_MAX_PAGE_SIZE),
+    current_user: TokenUser = Depends(get_current_user)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    try:
+        records, next_cursor = await run_in_threadpool(query_attendance, cursor=cursor, limit=limit, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return {"records": records, "next_cursor": next_cursor}
+
+@router.get("/admin/attendance-summary/", tags=["admin"])
+async def get_attendance_summary(filters: dict = Depends(attendance_filters), current_user: TokenUser = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    return {"users": await run_in_threadpool(attendance_summary, **filters)}
+
+@router.get("/admin/attendance-rollups/", tags=["admin"])
+async def get_attendance_rollups(
+    period: str = Query("day", pattern="^(day|week)$"),
+    user_id: Optional[int] = None,
+    start_date: Optional[str] = Query(None, description="Start date in YYYY-MM-DD format"),
+    end_date: Optional[str] = Query(None, description="End date in YYYY-MM-DD format"),
+    current_user: TokenUser = Depends(get_current_user)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    rollups = await run_in_threadpool(
+        attendance_rollups, period, user_id,
+        parse_date(start_date) if start_date else None, parse_date(end_date) if end_date else None,
+    )
+    return {"period": period, "rollups": rollups}
+
+@router.post("/admin/attendance-rollups/rebuild", tags=["admin"])
+async def rebuild_attendance_rollups(
+    start_date: Optional[str] = Query(None, description="Start date in YYYY-MM-DD format"),
+    end_date: Optional[str] = Query(None, description="End date in YYYY-MM-DD format"),
+    current_user: TokenUser = Depends(get_current_user)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    counts = await run_in_threadpool(
+        rebuild_rollups, parse_date(start_date) if start_date else None, parse_date(end_date) if end_date else None
+    )
+    return {"rebuilt": counts}
+
+@router.get("/admin/attendance-export/", tags=["admin"])
+async def export_attendance(
+    start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    format: str = Query("csv", pattern="^(csv|arrow|parquet)$"),
+    user_id: Optional[int] = None,
+    current_user: TokenUser = Depends(get_current_user)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    try:
+        stream = stream_attendance(format, parse_date(start_date), parse_date(end_date), user_id)
+    except ImportError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="attendance_{start_date}_{end_date}.{format}"'},
+    )
+
+@router.post("/admin/enroll/bulk", tags=["admin"])
+async def bulk_enroll(archive: UploadFile, site: str = Depends(request_site), current_user: TokenUser = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    if site == ALL_SITES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Enrollment needs a specific site")
+
+    job_id = uuid.uuid4().hex
+    path = os.path.join(ENROLLMENT_DIR, job_id, "upload.zip")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        await save_upload(archive, path, limit=MAX_ENROLLMENT_ARCHIVE_BYTES)
+    except HTTPException:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        raise
+    if not zipfile.is_zipfile(path):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload must be a zip archive")
+
+    job = start_enrollment_job(path, index, job_id=job_id, site=site)
+    return job.progress()
+
+@router.get("/admin/enroll/jobs/{job_id}", tags=["admin"])
+async def get_enroll_job(job_id: str, current_user: TokenUser = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    job = get_enrollment_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Enrollment job not found")
+    return job.progress()
+
+@router.post("/admin/enroll/jobs/{job_id}/resume", tags=["admin"])
+async def resume_enroll_job(job_id: str, current_user: TokenUser = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    job = get_enrollment_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Enrollment job not found")
+    if job.state["status"] == "running" and job_id in enrollment_jobs:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Enrollment job is already running")
+    return start_enrollment_job(job.source, index, job_id=job_id).progress()
+
+@router.get("/admin/gallery/verify", tags=["admin"])
+async def verify_gallery_consistency(current_user: TokenUser = Depends(get_current_user)):
+    """Users missing from the index, index entries without a user, and users with no archived embedding."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    return await executors.io.run("db", verify_gallery, index, archive)
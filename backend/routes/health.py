@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException, status
+from ..utils.model_manager import model_manager
+from ..utils.executors import executors
+from ..utils.attendance_utils import probe_cache, gallery_cache
+from ..utils.identity import user_cache
+from ..utils.auth_utils import token_cache
+from ..utils.outbox import outbox
+
+router = APIRouter()
+
+@router.get("/health/live", tags=["health"])
+async def live():
+    return {"status": "ok"}
+
+@router.get("/health/ready", tags=["health"])
+async def ready():
+    if not executors.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Models are still loading")
+    return {
+        "status": "ready",
+        "model": model_manager.model_name,
+        "inference_workers": executors.inference_workers,
+        "inference_pending": executors.inference.pending,
+        "io_pending": executors.io.pending,
+    }
+
+@router.get("/health/caches", tags=["health"])
+async def caches():
+    return {"caches": [probe_cache.stats(), gallery_cache.stats(), user_cache.stats(), token_cache.stats()]}
+
+@router.get("/health/outbox", tags=["health"])
+async def outbox_status():
+    return {"outbox": outbox.stats()}
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from ..utils.metrics import registry, Gauge
+from ..utils.executors import executors
+from ..utils.attendance_utils import embedding_batcher, probe_cache, gallery_cache
+
+router = APIRouter()
+
+registry.register(Gauge("attendance_inference_pending", "Inference jobs queued or running.", lambda: executors.inference.pending))
+registry.register(Gauge("attendance_io_pending", "I/O jobs queued or running.", lambda: executors.io.pending))
+registry.register(Gauge(
+    "attendance_embed_queue_depth", "Faces waiting for the next embedding batch.",
+    lambda: embedding_batcher.queue_depth,
+))
+registry.register(Gauge("attendance_probe_cache_hit_ratio", "Hit ratio of the probe embedding cache.", lambda: probe_cache.stats()["hit_rate"]))
+registry.register(Gauge("attendance_gallery_cache_hit_ratio", "Hit ratio of the hot gallery cache.", lambda: gallery_cache.stats()["hit_rate"]))
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
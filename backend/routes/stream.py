@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from ..utils.attendance_utils import decode_frame, detect_faces_timed, embed_face, match_embedding
+from ..utils.detectors import crop
+from ..utils.executors import executors
+from ..utils.auth_utils import is_admin_token
+from ..utils.sharding import ALL_SITES, validate_site
+from ..database import DEFAULT_SITE
+from ..utils.metrics import stage_timer, observe_stage
+from ..utils.tracking import IoUTracker, face_quality
+from .users import attendance_result
+
+# Run detection on one frame in this many; tracks carry identities in between.
+STREAM_DETECT_EVERY = int(os.getenv("STREAM_DETECT_EVERY", "5"))
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+async def identify_track(websocket, frame, track, site):
+    face = crop(frame, track.box)
+    passed, quality = face_quality(face)
+    if not passed:
+        return
+    track.attempts += 1
+    # A failed track is reported and retried on a later frame; it must not end the stream.
+    try:
+        embedding = await embed_face(face)
+        success, user_id, similarity_score = await executors.io.run("query", match_embedding, embedding, 0.70, site)
+        result = await executors.io.run("db", attendance_result, success, user_id, similarity_score)
+    except HTTPException as e:
+        # A busy or slow server is no fault of the face, so it does not use up one of the track's attempts.
+        track.attempts -= 1
+        await websocket.send_json({"event": "error", "track_id": track.track_id, "detail": e.detail})
+        return
+    except ValueError as e:
+        await websocket.send_json({"event": "error", "track_id": track.track_id, "detail": str(e)})
+        return
+    except Exception:
+        # E.g. a crashed inference worker or a failed outbox write; later frames may well succeed.
+        logger.exception("Identifying track %d failed", track.track_id)
+        await websocket.send_json({"event": "error", "track_id": track.track_id, "detail": "Internal error"})
+        return
+    if success:
+        track.identified = True
+        track.user_id = user_id
+    await websocket.send_json({
+        "event": "attendance" if "user_id" in result else "unrecognized",
+        "track_id": track.track_id,
+        "box": list(track.box),
+        "quality": quality,
+        **result,
+    })
+
+async def process_frames(websocket, frames, site):
+    tracker = IoUTracker()
+    while True:
+        frame_index, data = await frames.get()
+        try:
+            with stage_timer("decode"):
+                frame = await run_in_threadpool(decode_frame, data)
+            with stage_timer("detect"):
+                boxes, timings = await executors.inference.run("detect", detect_faces_timed, frame)
+        except HTTPException as e:
+            await websocket.send_json({"event": "error", "frame": frame_index, "detail": e.detail})
+            continue
+        except ValueError as e:
+            await websocket.send_json({"event": "error", "frame": frame_index, "detail": str(e)})
+            continue
+        except Exception:
+            logger.exception("Processing frame %d failed", frame_index)
+            await websocket.send_json({"event": "error", "frame": frame_index, "detail": "Internal error"})
+            continue
+        for stage, seconds in timings.items():
+            observe_stage(stage, seconds)
+
+        tracks = [track for track in tracker.update(boxes, frame_index) if track.wants_embedding]
+        await asyncio.gather(*(identify_track(websocket, frame, track, site) for track in tracks))
+
+@router.websocket("/ws/mark-attendance")
+async def stream_attendance(websocket: WebSocket):
+    """Continuous check-in from a camera stream.
+
+    The client sends JPEG frames as binary messages. Every STREAM_DETECT_EVERY-th
+    frame is sampled; if the pipeline is still busy with an earlier one, the
+    newer frame replaces it, so a slow server drops frames instead of lagging.
+    Attendance events are pushed back as JSON. The site comes from the X-Site
+    header or the ``site`` query parameter; "*" needs an admin token, sent as a
+    bearer Authorization header or the ``token`` query parameter.
+    """
+    try:
+        site = validate_site(websocket.headers.get("x-site") or websocket.query_params.get("site") or DEFAULT_SITE)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+    token = token if scheme.lower() == "bearer" else websocket.query_params.get("token")
+    if site == ALL_SITES and not await is_admin_token(token):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    frames = asyncio.Queue(maxsize=1)
+    worker = asyncio.create_task(process_frames(websocket, frames, site))
+    frame_index = 0
+    try:
+        while True:
+            data = await websocket.receive_bytes()
+            frame_index += 1
+            if frame_index % STREAM_DETECT_EVERY:
+                continue
+            if frames.full():
+                frames.get_nowait()
+            frames.put_nowait((frame_index, data))
+            if worker.done():
+                worker.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        worker.cancel()
@@ -1,43 +1,228 @@
-from fastapi import APIRouter, HTTPException, UploadFile, Body, Request
-from typing import Annotated
-from ..utils.attendance_utils import register_user, verify_user, get_username_by_id, log_attendance, read_image_data
+import asyncio
+import os
+import numpy as np
+from fastapi import APIRouter, HTTPException, UploadFile, Body, Request, Header, Depends
+from typing import Annotated, List, Optional
+from ..utils.attendance_utils import enroll_user, detect_face_timed, detect_faces_timed, match_embedding, match_embeddings, embed_face, embed_faces, get_username_by_id, log_attendance, read_image_data
+from ..utils.executors import executors
+from ..utils.auth_utils import is_admin_token, optional_oauth2_scheme
+from ..utils.detectors import NoFaceDetected, as_rgb, crop
+from ..utils.metrics import stage_timer, observe_stage, outcomes
+from ..utils.model_manager import model_manager
+from ..utils.quantization import decode_wire
+from ..utils.vector_store import EMBEDDING_DIM
+from ..utils.sharding import ALL_SITES, validate_site
+from ..database import DEFAULT_SITE
+from ..schema import EmbeddingCheckIn
+
+# Pre-cropped faces above this size are rejected, so the crop endpoint cannot be used to skip detection on full frames.
+CROP_MAX_SIDE = int(os.getenv("CROP_MAX_SIDE", "400"))
+CROP_MIN_SIDE = 40
+# Client-computed embeddings bypass the server's model entirely, so they are opt-in.
+ACCEPT_CLIENT_EMBEDDINGS = os.getenv("ACCEPT_CLIENT_EMBEDDINGS", "0") == "1"
 
 router = APIRouter()
 
+async def request_site(x_site: Optional[str] = Header(None), token: Optional[str] = Depends(optional_oauth2_scheme)):
+    """The caller's site from the X-Site header; "*" searches every site and needs an admin token."""
+    try:
+        site = validate_site(x_site or DEFAULT_SITE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if site == ALL_SITES and not await is_admin_token(token):
+        raise HTTPException(status_code=403, detail="Searching every site needs an admin token")
+    return site
+
+async def decode(upload):
+    with stage_timer("decode"):
+        return await read_image_data(upload)
+
+async def detect(img):
+    try:
+        with stage_timer("detect"):
+            face_image, timings = await executors.inference.run("detect", detect_face_timed, img)
+    except NoFaceDetected:
+        outcomes.inc("no_face")
+        raise
+    for stage, seconds in timings.items():
+        observe_stage(stage, seconds)
+    return face_image
+
 @router.post("/register")
-async def register(request: Request, username: Annotated[str, Body()], image_data: UploadFile):
+async def register(request: Request, username: Annotated[str, Body()], image_data: UploadFile, site: str = Depends(request_site)):
     try:
         ip_address = request.client.host
-        
-        img = await read_image_data(image_data)
-        
-        success, message = register_user(username, img, ip_address)
+        if site == ALL_SITES:
+            raise HTTPException(status_code=400, detail="Registration needs a specific site")
+
+        img = await decode(image_data)
+
+        face_image = await detect(img)
+        new_embedding = await embed_face(face_image)
+        success, message = await executors.io.run("db", enroll_user, username, new_embedding, ip_address, 0.70, site)
         if success:
             return {"message": message}
         else:
             raise HTTPException(status_code=400, detail=message)
+    except HTTPException as e:
+        if e.status_code in (413, 503, 504):
+            raise
+        raise HTTPException(status_code=400, detail=e.detail)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    
+
+
+def attendance_result(success, user_id, similarity_score, idempotency_key=None):
+    outcomes.inc("recognized" if success else "unrecognized")
+    if success:
+        username = get_username_by_id(user_id)
+        if username:
+            log_attendance(user_id, username, idempotency_key)
+            return {"user_id": user_id, "username": username, "similarity_score": similarity_score}
+        else:
+            return {"message": "User ID found but username not found in database"}
+    elif similarity_score:
+        return {"message": "User not recognized", "similarity_score": similarity_score}
+    else:
+        return {"message": "User not recognized"}
+
 
 @router.post("/mark-attendance")
-async def mark_attendance(image_data: UploadFile):
+async def mark_attendance(image_data: UploadFile, site: str = Depends(request_site), idempotency_key: Optional[str] = Header(None)):
     try:
-        img = await read_image_data(image_data)
+        img = await decode(image_data)
 
-        success, user_id, similarity_score = verify_user(img)
-        
-        if success:
-            username = get_username_by_id(user_id)
-            if username:
-                log_attendance(user_id, username)
-                return {"user_id": user_id, "username": username, "similarity_score": similarity_score}
-            else:
-                return {"message": "User ID found but username not found in database"}
-        elif similarity_score:
-            return {"message": "User not recognized", "similarity_score": similarity_score}
-        else:
-            return {"message": "User not recognized"}
+        face_image = await detect(img)
+        embedding = await embed_face(face_image)
+        success, user_id, similarity_score = await executors.io.run("query", match_embedding, embedding, 0.70, site)
+
+        return await executors.io.run("db", attendance_result, success, user_id, similarity_score, idempotency_key)
+    except HTTPException as e:
+        if e.status_code in (413, 503, 504):
+            raise
+        raise HTTPException(status_code=400, detail=e.detail)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+
+@router.post("/mark-attendance/crop")
+async def mark_attendance_crop(image_data: UploadFile, site: str = Depends(request_site), idempotency_key: Optional[str] = Header(None)):
+    """Check in from a face crop made on the client; server-side detection is skipped."""
+    try:
+        face_image = as_rgb(await decode(image_data))
+        if max(face_image.shape[:2]) > CROP_MAX_SIDE or min(face_image.shape[:2]) < CROP_MIN_SIDE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Face crops must be between {CROP_MIN_SIDE} and {CROP_MAX_SIDE} px; send full photos to /mark-attendance",
+            )
+        embedding = await embed_face(face_image)
+        success, user_id, similarity_score = await executors.io.run("query", match_embedding, embedding, 0.70, site)
+
+        return await executors.io.run("db", attendance_result, success, user_id, similarity_score, idempotency_key)
+    except HTTPException as e:
+        if e.status_code in (413, 503, 504):
+            raise
+        raise HTTPException(status_code=400, detail=e.detail)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/mark-attendance/embedding")
+async def mark_attendance_embedding(body: EmbeddingCheckIn, site: str = Depends(request_site), idempotency_key: Optional[str] = Header(None)):
+    """Check in from an embedding computed on the client with the same model as the server."""
+    if not ACCEPT_CLIENT_EMBEDDINGS:
+        raise HTTPException(status_code=403, detail="Client-side embeddings are disabled on this server")
+    if body.model != model_manager.model_name:
+        raise HTTPException(status_code=409, detail=f"Embedding model mismatch: server uses {model_manager.model_name}")
+    try:
+        embedding = decode_wire(body.embedding, body.dtype)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if embedding.shape != (EMBEDDING_DIM,) or not np.isfinite(embedding).all():
+        raise HTTPException(status_code=400, detail=f"Expected {EMBEDDING_DIM} finite values")
+
+    success, user_id, similarity_score = await executors.io.run("query", match_embedding, embedding, 0.70, site)
+    return await executors.io.run("db", attendance_result, success, user_id, similarity_score, idempotency_key)
+
+
+@router.post("/mark-attendance/batch")
+async def mark_attendance_batch(image_data: List[UploadFile], site: str = Depends(request_site)):
+    results = [{"filename": upload.filename} for upload in image_data]
+    images = {}
+    for i, upload in enumerate(image_data):
+        try:
+            images[i] = await decode(upload)
+        except HTTPException as e:
+            results[i]["message"] = e.detail
+
+    detections = await asyncio.gather(*(detect(img) for img in images.values()), return_exceptions=True)
+    faces = {}
+    for i, detection in zip(images, detections):
+        if isinstance(detection, HTTPException) and detection.status_code in (503, 504):
+            raise detection
+        if isinstance(detection, Exception):
+            results[i]["message"] = str(detection)
+        else:
+            faces[i] = detection
+
+    # All faces are submitted together so cache misses share one forward pass.
+    embeddings = await asyncio.gather(*(embed_face(face) for face in faces.values()), return_exceptions=True)
+    for i, embedding in zip(faces, embeddings):
+        if isinstance(embedding, Exception):
+            results[i]["message"] = str(embedding)
+            continue
+        try:
+            match = await executors.io.run("query", match_embedding, embedding, 0.70, site)
+            results[i].update(await executors.io.run("db", attendance_result, *match))
+        except Exception as e:
+            results[i]["message"] = str(e)
+
+    return {"results": results}
+
+
+@router.post("/mark-attendance/multi")
+async def mark_attendance_multi(image_data: UploadFile, site: str = Depends(request_site)):
+    """Recognize every face in one photo and mark attendance for each person."""
+    try:
+        img = as_rgb(await decode(image_data))
+
+        with stage_timer("detect"):
+            boxes, timings = await executors.inference.run("detect", detect_faces_timed, img)
+        for stage, seconds in timings.items():
+            observe_stage(stage, seconds)
+        if not boxes:
+            outcomes.inc("no_face")
+            return {"faces": [], "message": "No faces detected in the image."}
+
+        # Every face of the photo in one forward pass; a face the model rejects gets its error in its place.
+        with stage_timer("embed"):
+            embedded = await executors.inference.run("embed", embed_faces, [crop(img, box) for box in boxes])
+        embeddable = [i for i, embedding in enumerate(embedded) if not isinstance(embedding, Exception)]
+        matches = [(False, None, None)] * len(boxes)
+        if embeddable:
+            found = await executors.io.run("query", match_embeddings, np.stack([embedded[i] for i in embeddable]), 0.70, site)
+            for i, match in zip(embeddable, found):
+                matches[i] = match
+
+        # The same person can match twice (e.g. a reflection); only their best face is logged.
+        best = {}
+        for i, (success, user_id, similarity_score) in enumerate(matches):
+            if success and (user_id not in best or similarity_score > matches[best[user_id]][2]):
+                best[user_id] = i
+
+        faces = []
+        for i, (box, (success, user_id, similarity_score)) in enumerate(zip(boxes, matches)):
+            if isinstance(embedded[i], Exception):
+                result = {"message": str(embedded[i])}
+            elif success and best[user_id] != i:
+                result = {"message": "Duplicate of another face in this image", "user_id": user_id, "similarity_score": similarity_score}
+            else:
+                result = await executors.io.run("db", attendance_result, success, user_id, similarity_score)
+            faces.append({"box": list(box), **result})
+        return {"faces": faces}
+    except HTTPException as e:
+        if e.status_code in (413, 503, 504):
+            raise
+        raise HTTPException(status_code=400, detail=e.detail)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
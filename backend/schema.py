@@ -13,9 +13,23 @@ class UserInDB(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+class TokenUser(BaseModel):
+    id: int
+    username: str
+    role: str
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class EmbeddingCheckIn(BaseModel):
+    embedding: str
+    dtype: str = "float16"
+    model: str
+
 class UserAdminView(BaseModel):
     id: int
     username: str
     role: str
+    site: str
     ip: str
     timestamp: datetime
\ No newline at end of file
@@ -0,0 +1,38 @@
+import os
+import tempfile
+
+# database.py and the stores read their locations at import time, so point them at a scratch directory first.
+SCRATCH = tempfile.mkdtemp(prefix="attendance-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(SCRATCH, 'test.db')}")
+os.environ.setdefault("OUTBOX_PATH", os.path.join(SCRATCH, "outbox.db"))
+os.environ.setdefault("VECTOR_INDEX_PATH", os.path.join(SCRATCH, "vector_index", "face-recognition"))
+os.environ.setdefault("EMBEDDING_ARCHIVE_DIR", os.path.join(SCRATCH, "embedding_archive"))
+os.environ.setdefault("ENROLLMENT_DIR", os.path.join(SCRATCH, "enrollment_jobs"))
+
+import pytest
+
+from backend.database import Base, SessionLocal, User, engine
+from backend.utils.identity import user_directory
+
+
+@pytest.fixture
+def db_tables():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def make_user(db_tables):
+    def make_user(username, role="student"):
+        db = SessionLocal(expire_on_commit=False)
+        try:
+            user = User(username=username, role=role)
+            db.add(user)
+            db.commit()
+        finally:
+            db.close()
+        user_directory.set(user.id, user.username)
+        return user
+    return make_user
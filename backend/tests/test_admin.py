@@ -0,0 +1,28 @@
+import os
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.routes import admin
+from backend.utils.auth_utils import create_tokens, token_cache
+from backend.utils.enrollment import ENROLLMENT_DIR
+
+
+def test_bulk_enroll_rejects_an_oversized_archive(make_user, monkeypatch):
+    token_cache.clear()
+    monkeypatch.setattr(admin, "MAX_ENROLLMENT_ARCHIVE_BYTES", 1024)
+    admin_token = create_tokens(make_user("admin", "admin"))["access_token"]
+    jobs = set(os.listdir(ENROLLMENT_DIR)) if os.path.isdir(ENROLLMENT_DIR) else set()
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    with TestClient(app) as client:
+        response = client.post(
+            "/admin/enroll/bulk",
+            files={"archive": ("faces.zip", b"\0" * 4096, "application/zip")},
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+    assert response.status_code == 413
+    # The partial upload is not left behind as a job.
+    assert set(os.listdir(ENROLLMENT_DIR)) == jobs
+    token_cache.clear()
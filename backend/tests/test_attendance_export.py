@@ -0,0 +1,49 @@
+import csv
+import io
+from datetime import date, datetime, timedelta
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.database import Attendance, SessionLocal
+from backend.routes import admin
+from backend.utils.attendance_export import iter_attendance_chunks, stream_csv
+from backend.utils.attendance_store import ATTENDANCE_COLUMNS, attendance_record, attendance_row, write_attendance
+from backend.utils.auth_utils import create_tokens, token_cache
+
+
+def test_streamed_csv_matches_a_single_pass_export(make_user):
+    token_cache.clear()
+    admin_token = create_tokens(make_user("admin", "admin"))["access_token"]
+    start = datetime(2024, 8, 1, 8, 0)
+    write_attendance([
+        attendance_row(i % 7 + 1, f'user, "{i % 7}"', start + timedelta(days=i % 5, minutes=i), event_id=f"event-{i}")
+        for i in range(53)
+    ])
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Attendance).order_by(Attendance.date, Attendance.id).all()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(ATTENDANCE_COLUMNS)
+        writer.writerows([record[column] for column in ATTENDANCE_COLUMNS] for record in map(attendance_record, rows))
+        expected = buffer.getvalue().encode()
+    finally:
+        db.close()
+
+    # Chunk boundaries fall inside days, so the keyset cursor and the per-chunk flush are both exercised.
+    streamed = b"".join(stream_csv(iter_attendance_chunks(date(2024, 8, 1), date(2024, 8, 5), chunk_size=7)))
+    assert streamed == expected
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    with TestClient(app) as client:
+        response = client.get(
+            "/admin/attendance-export/",
+            params={"start_date": "2024-08-01", "end_date": "2024-08-05"},
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+    assert response.status_code == 200
+    assert response.content == expected
+    token_cache.clear()
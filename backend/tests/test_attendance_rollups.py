@@ -0,0 +1,72 @@
+import random
+from datetime import date, datetime, timedelta
+
+from backend.utils.attendance_rollups import _segments, rollup_summary
+from backend.utils.attendance_store import attendance_row, write_attendance
+
+FIRST_DAY = date(2024, 7, 1)
+DAYS = 70
+
+
+def random_range(rng):
+    start = FIRST_DAY + timedelta(days=rng.randrange(-10, DAYS + 10))
+    end = start + timedelta(days=rng.randrange(0, 40))
+    return (None if rng.random() < 0.1 else start), (None if rng.random() < 0.1 else end)
+
+
+def brute_force_summary(rows, user_id, start_date, end_date):
+    users = {}
+    for row in rows:
+        if (start_date is not None and row["date"] < start_date) or (end_date is not None and row["date"] > end_date):
+            continue
+        if user_id is not None and row["user_id"] != user_id:
+            continue
+        entry = users.setdefault(row["user_id"], {"username": row["username"], "check_ins": 0, "days": set(), "seen": []})
+        entry["check_ins"] += 1
+        entry["days"].add(row["date"])
+        entry["seen"].append(row["timestamp"])
+    return [
+        {
+            "user_id": key,
+            "username": users[key]["username"],
+            "check_ins": users[key]["check_ins"],
+            "days_present": len(users[key]["days"]),
+            "first_seen": min(users[key]["seen"]),
+            "last_seen": max(users[key]["seen"]),
+        }
+        for key in sorted(users)
+    ]
+
+
+def test_segments_tile_the_range_with_whole_weeks():
+    rng = random.Random(0)
+    for _ in range(300):
+        start, end = random_range(rng)
+        if start is None or end is None:
+            continue
+        covered = []
+        for period, low, high in _segments(start, end):
+            if period == "week":
+                assert low.weekday() == 0 and high.weekday() == 0
+                high += timedelta(days=6)
+            covered += [low + timedelta(days=n) for n in range((high - low).days + 1)]
+        assert sorted(covered) == [start + timedelta(days=n) for n in range((end - start).days + 1)]
+
+
+def test_rollup_summary_matches_a_brute_force_count(db_tables):
+    rng = random.Random(1)
+    rows = [
+        attendance_row(
+            user_id,
+            f"user{user_id}",
+            datetime.combine(FIRST_DAY + timedelta(days=rng.randrange(DAYS)), datetime.min.time()) + timedelta(seconds=rng.randrange(86400)),
+            event_id=f"event-{i}",
+        )
+        for i, user_id in enumerate(rng.randrange(1, 7) for _ in range(600))
+    ]
+    write_attendance(rows)
+
+    for _ in range(300):
+        start, end = random_range(rng)
+        user_id = rng.randrange(1, 7) if rng.random() < 0.2 else None
+        assert rollup_summary(user_id, start, end) == brute_force_summary(rows, user_id, start, end), (user_id, start, end)
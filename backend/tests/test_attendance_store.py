@@ -0,0 +1,40 @@
+import os
+from datetime import date, time
+
+from backend.database import SessionLocal, Attendance, AttendanceDaily
+from backend.utils.attendance_store import import_legacy_sheets
+
+BUNDLED_SHEETS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "attendance_sheets")
+
+
+def test_import_legacy_sheets_reads_bundled_sheets(db_tables):
+    imported = import_legacy_sheets(BUNDLED_SHEETS)
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Attendance).order_by(Attendance.timestamp).all()
+        assert imported == len(rows) > 0
+        assert {row.date for row in rows} == {date(2024, 7, 26), date(2024, 7, 28), date(2024, 7, 30)}
+        # 2024-07-30.xlsx has a DD-MM-YYYY Date cell; the file name decides the day.
+        assert any(row.date == date(2024, 7, 30) and row.time == time(1, 43, 46) for row in rows)
+        assert db.query(AttendanceDaily).count() > 0
+    finally:
+        db.close()
+
+
+def test_import_legacy_sheets_is_idempotent(db_tables):
+    first = import_legacy_sheets(BUNDLED_SHEETS)
+    assert first > 0
+    assert import_legacy_sheets(BUNDLED_SHEETS) == 0
+
+
+def test_import_legacy_sheets_skips_unparseable_rows(db_tables, tmp_path):
+    import pandas as pd
+
+    pd.DataFrame([
+        {"Date": "2024-08-01", "Time": "09:00", "User ID": "1", "Username": "a"},
+        {"Date": "2024-08-01", "Time": "not a time", "User ID": "2", "Username": "b"},
+        {"Date": "2024-08-01", "Time": "09:05:10", "User ID": "x", "Username": "c"},
+    ]).to_excel(tmp_path / "2024-08-01.xlsx", index=False)
+
+    assert import_legacy_sheets(str(tmp_path)) == 1
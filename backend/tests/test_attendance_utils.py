@@ -0,0 +1,107 @@
+import asyncio
+
+import numpy as np
+
+from backend.utils import attendance_utils
+from backend.utils.cache import perceptual_hash
+
+
+def gradient(offset=0):
+    row = np.linspace(0, 150, 64, dtype=np.float32) + offset
+    return np.repeat(np.tile(row, (64, 1))[:, :, None], 3, axis=2).astype(np.uint8)
+
+
+def test_probe_cache_reuses_an_embedding_only_for_a_matching_crop(monkeypatch):
+    calls = []
+
+    async def embed(face):
+        calls.append(face)
+        return np.full(4, len(calls), dtype=np.float32)
+
+    monkeypatch.setattr(attendance_utils.embedding_batcher, "embed", embed)
+    attendance_utils.probe_cache.clear()
+    face, brighter = gradient(), gradient(offset=80)
+    assert perceptual_hash(face) == perceptual_hash(brighter)
+
+    async def scenario():
+        first = await attendance_utils.embed_face(face)
+        again = await attendance_utils.embed_face(face.copy())
+        other = await attendance_utils.embed_face(brighter)
+        return first, again, other
+
+    first, again, other = asyncio.run(scenario())
+    assert len(calls) == 2
+    np.testing.assert_array_equal(first, again)
+    assert not np.array_equal(first, other)
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_close_hot_hit_is_confirmed_by_the_full_index(monkeypatch):
+    probe = unit(1, 0)
+    # The hot user clears the hot threshold (0.80) but not by the margin.
+    attendance_utils.gallery_cache.clear()
+    attendance_utils.gallery_cache.set(("default", "1"), unit(0.85, np.sqrt(1 - 0.85 ** 2)))
+    monkeypatch.setattr(attendance_utils, "promote", lambda *args, **kwargs: None)
+    monkeypatch.setattr(attendance_utils.index, "fetch", lambda ids, site=None: {})
+
+    monkeypatch.setattr(
+        attendance_utils.index, "query",
+        lambda embedding, top_k=1, site=None: {"matches": [{"id": "2", "score": 0.95, "site": "default"}]},
+    )
+    success, user_id, score = attendance_utils.match_embedding(probe, site="default")
+    assert (success, user_id) == (True, "2") and score == 0.95
+
+    # A user the index does not know yet (enrollment still pending) is still matched from the hot set.
+    monkeypatch.setattr(attendance_utils.index, "query", lambda embedding, top_k=1, site=None: {"matches": []})
+    success, user_id, score = attendance_utils.match_embedding(probe, site="default")
+    assert (success, user_id) == (True, "1") and abs(score - 0.85) < 1e-5
+    attendance_utils.gallery_cache.clear()
+
+
+def test_replayed_outbox_entries_are_applied_once(db_tables, monkeypatch):
+    from backend.database import Attendance, AttendanceDaily, SessionLocal
+
+    queued = []
+    add = attendance_utils.outbox.add
+    monkeypatch.setattr(attendance_utils.outbox, "add", lambda kind, payload, key=None: queued.append((key, payload)) or add(kind, payload, key))
+
+    site = "replay"
+    registered, _ = attendance_utils.enroll_user("carol", np.eye(512, dtype=np.float32)[0], "127.0.0.1", site=site)
+    assert registered
+    user_id = queued[0][1]["user_id"]
+    attendance_utils.log_attendance(user_id, "carol", idempotency_key="check-in-1")
+    enrollment, attendance = queued
+
+    # A crash between applying a batch and deleting it hands the same entries to the handlers again.
+    for _ in range(2):
+        attendance_utils.apply_enrollments([enrollment])
+        attendance_utils.apply_attendance([attendance])
+    assert attendance_utils.index.ids(site=site) == [user_id]
+    assert attendance_utils.index.sample_count(user_id, site=site) == 1
+    db = SessionLocal()
+    try:
+        assert db.query(Attendance).count() == 1
+        assert db.query(AttendanceDaily).one().check_ins == 1
+    finally:
+        db.close()
+    attendance_utils.gallery_cache.clear()
+
+
+def test_enrollment_is_rolled_back_when_the_outbox_write_fails(db_tables, monkeypatch):
+    from backend.database import SessionLocal, User
+
+    def fail(kind, payload, key=None):
+        raise OSError("outbox unavailable")
+
+    monkeypatch.setattr(attendance_utils.outbox, "add", fail)
+    registered, detail = attendance_utils.enroll_user("dave", np.eye(512, dtype=np.float32)[1], "127.0.0.1", site="rollback")
+    assert not registered and "outbox unavailable" in detail
+    db = SessionLocal()
+    try:
+        assert db.query(User).count() == 0
+    finally:
+        db.close()
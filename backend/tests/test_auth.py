@@ -0,0 +1,85 @@
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from backend.database import SessionLocal, User
+from backend.routes import admin
+from backend.routes.users import request_site
+from backend.schema import TokenUser
+from backend.utils.auth_utils import create_tokens, get_current_user, token_cache
+from backend.utils.executors import executors
+from backend.utils.identity import user_directory
+
+
+def test_token_stops_working_once_its_user_is_deleted(make_user):
+    token_cache.clear()
+    admin_user = make_user("admin", "admin")
+    student = make_user("student", "student")
+    admin_token = create_tokens(admin_user)["access_token"]
+    student_token = create_tokens(student)["access_token"]
+
+    app = FastAPI()
+    app.include_router(admin.router)
+
+    @app.get("/me")
+    async def me(current_user: TokenUser = Depends(get_current_user)):
+        return {"id": current_user.id}
+
+    with TestClient(app) as client:
+        # The first request puts the student's token in the token cache.
+        assert client.get("/me", headers={"Authorization": f"Bearer {student_token}"}).json() == {"id": student.id}
+        deleted = client.delete(f"/admin/users/{student.id}", headers={"Authorization": f"Bearer {admin_token}"})
+        assert deleted.status_code == 200
+        assert client.get("/me", headers={"Authorization": f"Bearer {student_token}"}).status_code == 401
+    executors.io.shutdown()
+    token_cache.clear()
+
+
+def test_every_site_search_needs_an_admin_token(make_user):
+    token_cache.clear()
+    admin_token = create_tokens(make_user("admin", "admin"))["access_token"]
+    student_token = create_tokens(make_user("student", "student"))["access_token"]
+
+    app = FastAPI()
+
+    @app.get("/site")
+    async def site(site: str = Depends(request_site)):
+        return {"site": site}
+
+    with TestClient(app) as client:
+        assert client.get("/site", headers={"X-Site": "north"}).json() == {"site": "north"}
+        assert client.get("/site", headers={"X-Site": "*"}).status_code == 403
+        student = client.get("/site", headers={"X-Site": "*", "Authorization": f"Bearer {student_token}"})
+        assert student.status_code == 403
+        admin = client.get("/site", headers={"X-Site": "*", "Authorization": f"Bearer {admin_token}"})
+        assert admin.json() == {"site": "*"}
+    token_cache.clear()
+
+
+def test_token_is_not_inherited_by_a_user_that_reuses_the_id(make_user):
+    token_cache.clear()
+    old_admin = make_user("oldadmin", "admin")
+    token = create_tokens(old_admin)["access_token"]
+
+    app = FastAPI()
+
+    @app.get("/me")
+    async def me(current_user: TokenUser = Depends(get_current_user)):
+        return {"id": current_user.id}
+
+    with TestClient(app) as client:
+        assert client.get("/me", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+        db = SessionLocal()
+        try:
+            db.delete(db.get(User, old_admin.id))
+            # Databases created before ids were made AUTOINCREMENT hand the freed id to the next user.
+            db.add(User(id=old_admin.id, username="student", role="student"))
+            db.commit()
+        finally:
+            db.close()
+        user_directory.remove(old_admin.id)
+        user_directory.set(old_admin.id, "student")
+        assert client.get("/me", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+        # Without the cached entry, the claims path rejects it too.
+        token_cache.clear()
+        assert client.get("/me", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+    token_cache.clear()
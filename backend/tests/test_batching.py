@@ -0,0 +1,60 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.utils.batching import EmbeddingBatcher
+from backend.utils.model_manager import ModelManager
+
+
+class FakeModel:
+    input_shape = (4, 4)
+
+    def __init__(self):
+        self.batches = []
+
+    def forward(self, batch):
+        self.batches.append(len(batch))
+        return batch.reshape(len(batch), -1)[:, :2].tolist()
+
+
+def test_represent_runs_one_forward_pass_and_isolates_a_bad_face(monkeypatch):
+    manager = ModelManager()
+    manager.model = FakeModel()
+    manager.ready = True
+
+    def preprocess(face, enforce_detection=True):
+        if face is None:
+            raise ValueError("Face could not be detected")
+        return np.full((1, 4, 4, 3), face, dtype=np.float32)
+
+    monkeypatch.setattr(manager, "_preprocess", preprocess)
+    results = manager.represent([1.0, None, 2.0])
+    assert manager.model.batches == [2]
+    np.testing.assert_array_equal(results[0], [1.0, 1.0])
+    assert isinstance(results[1], ValueError)
+    np.testing.assert_array_equal(results[2], [2.0, 2.0])
+
+
+def test_batcher_fails_only_the_face_that_could_not_be_embedded():
+    calls = []
+
+    def embed_fn(faces):
+        calls.append(list(faces))
+        return [ValueError("no face") if face < 0 else np.full(2, face, dtype=np.float32) for face in faces]
+
+    async def scenario():
+        batcher = EmbeddingBatcher(embed_fn, window_ms=50)
+        await batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.embed(face) for face in (1, -1, 2)), return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    good, bad, other = asyncio.run(scenario())
+    assert calls == [[1, -1, 2]]
+    np.testing.assert_array_equal(good, [1, 1])
+    assert isinstance(bad, ValueError)
+    np.testing.assert_array_equal(other, [2, 2])
+    with pytest.raises(ValueError):
+        asyncio.run(EmbeddingBatcher(embed_fn).embed(-1))
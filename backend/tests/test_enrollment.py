@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from backend.database import SessionLocal, User
+from backend.utils import attendance_utils
+from backend.utils.enrollment import EnrollmentJob
+from backend.utils.outbox import outbox
+
+
+def test_resumed_job_does_not_re_enroll_files_committed_before_a_crash(db_tables, tmp_path, monkeypatch):
+    for name in ("alice.jpg", "bob.jpg"):
+        (tmp_path / name).write_bytes(b"")
+    index = attendance_utils.index
+    site = "enroll-resume"
+    alice, bob = np.eye(512, dtype=np.float32)[:2]
+
+    job = EnrollmentJob(str(tmp_path), job_id="resume", site=site)
+
+    def crash():
+        raise OSError("disk full")
+
+    # The users and their outbox entries are committed, then the checkpoint is lost.
+    monkeypatch.setattr(job, "_save_state", crash)
+    with pytest.raises(OSError):
+        job._commit(index, {"alice.jpg": alice, "bob.jpg": bob}, {"alice.jpg": "alice", "bob.jpg": "bob"})
+
+    progress = EnrollmentJob(str(tmp_path), job_id="resume").run(index)
+    assert progress["processed"] == 2 and progress["enrolled"] == 2
+
+    db = SessionLocal()
+    try:
+        users = db.query(User.id, User.username).order_by(User.id).all()
+    finally:
+        db.close()
+    assert [username for _, username in users] == ["alice", "bob"]
+
+    while outbox.drain("enrollment"):
+        pass
+    assert sorted(index.ids(site=site)) == sorted(str(user_id) for user_id, _ in users)
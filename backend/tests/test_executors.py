@@ -0,0 +1,46 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+from backend.utils import executors as executors_module
+from backend.utils.executors import StageExecutor
+
+
+def test_timed_out_job_keeps_its_slot_until_it_finishes(monkeypatch):
+    monkeypatch.setitem(executors_module.STAGE_TIMEOUTS, "slow", 0.05)
+    stage = StageExecutor("test", lambda: ThreadPoolExecutor(max_workers=1), max_pending=1)
+    finish = threading.Event()
+    finished = threading.Event()
+
+    def slow():
+        finish.wait(5)
+        finished.set()
+
+    async def scenario():
+        with pytest.raises(HTTPException) as timeout:
+            await stage.run("slow", slow)
+        assert timeout.value.status_code == 504
+        # The worker is still busy with the timed-out job, so the pool is full.
+        assert stage.pending == 1
+        with pytest.raises(HTTPException) as busy:
+            await stage.run("slow", slow)
+        assert busy.value.status_code == 503
+
+        finish.set()
+        await asyncio.get_running_loop().run_in_executor(None, finished.wait, 5)
+        for _ in range(100):
+            if stage.pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert stage.pending == 0
+        assert await stage.run("slow", lambda: "done") == "done"
+        assert stage.pending == 0
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        finish.set()
+        stage.shutdown()
@@ -0,0 +1,68 @@
+import numpy as np
+
+from backend.utils import gallery
+from backend.utils.gallery import GalleryIndex, sample_id
+from backend.utils.vector_store import NumpyIndex, normalize
+
+
+def make_gallery(tmp_path, max_samples=10):
+    prototypes = NumpyIndex(path=str(tmp_path / "prototypes"), quantization="none")
+    samples = NumpyIndex(path=str(tmp_path / "samples"), quantization="none")
+    return GalleryIndex(prototypes, samples, max_samples=max_samples)
+
+
+def user_samples(users=40, per_user=4, dim=512, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((users, dim))
+    return {str(user): normalize(centres[user] + 0.8 * rng.standard_normal((per_user, dim))) for user in range(users)}
+
+
+def test_rerank_orders_like_a_brute_force_search(tmp_path, monkeypatch):
+    samples = user_samples()
+    index = make_gallery(tmp_path)
+    for user_id, vectors in samples.items():
+        index.add_samples(user_id, vectors)
+
+    # With every prototype a candidate, re-ranking must agree with scoring each user by prototype and samples.
+    monkeypatch.setattr(gallery, "RERANK_MARGIN", 2.0)
+    monkeypatch.setattr(gallery, "RERANK_CANDIDATES", len(samples))
+    probes = normalize(np.random.default_rng(1).standard_normal((30, 512)))
+    for probe, result in zip(probes, index.query_batch(probes, top_k=10)):
+        expected = sorted(
+            ((user_id, max(float(normalize(vectors.mean(axis=0)) @ probe), float(np.max(vectors @ probe))))
+             for user_id, vectors in samples.items()),
+            key=lambda item: item[1],
+            reverse=True,
+        )[:10]
+        assert [match["id"] for match in result["matches"]] == [user_id for user_id, _ in expected]
+        np.testing.assert_allclose([match["score"] for match in result["matches"]], [score for _, score in expected], atol=1e-5)
+
+
+def test_rerank_finds_the_owner_of_the_closest_sample(tmp_path):
+    samples = user_samples()
+    index = make_gallery(tmp_path)
+    for user_id, vectors in samples.items():
+        index.add_samples(user_id, vectors)
+
+    rng = np.random.default_rng(2)
+    for user_id, vectors in samples.items():
+        probe = normalize(vectors[-1] + 0.05 * rng.standard_normal(512))
+        assert index.query(probe, top_k=1)["matches"][0]["id"] == user_id
+
+
+def test_samples_are_capped_at_max_samples_keeping_the_enrollment_sample(tmp_path):
+    vectors = user_samples(users=1, per_user=7)["0"]
+    index = make_gallery(tmp_path, max_samples=3)
+    index.upsert([("1", vectors[0])])
+    for vector in vectors[1:4]:
+        index.add_samples("1", [vector])
+    # Added and evicted within one batch, the older of these are never written.
+    index.add_samples("1", vectors[4:])
+
+    assert index.sample_count("1") == 3
+    assert sorted(index.samples.ids()) == sorted([sample_id("1", 0), sample_id("1", 5), sample_id("1", 6)])
+    kept = np.stack([vectors[0], vectors[5], vectors[6]])
+    np.testing.assert_allclose(index.fetch(["1"])["1"], normalize(kept.mean(axis=0)), atol=1e-5)
+
+    reopened = make_gallery(tmp_path, max_samples=3)
+    assert reopened.sample_count("1") == 3
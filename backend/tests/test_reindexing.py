@@ -0,0 +1,46 @@
+import numpy as np
+
+from backend.database import SessionLocal, User
+from backend.utils.embedding_archive import EmbeddingArchive
+from backend.utils.gallery import GalleryIndex, create_gallery
+from backend.utils.reindexing import rebuild_gallery
+from backend.utils.vector_store import NumpyIndex, normalize
+
+
+def test_chunked_rebuild_matches_enrolling_one_vector_at_a_time(db_tables, tmp_path):
+    rng = np.random.default_rng(0)
+    db = SessionLocal()
+    try:
+        users = [User(username=f"user{i}", site=("north", "south")[i % 2]) for i in range(9)]
+        db.add_all(users)
+        db.commit()
+        site_of = {str(user.id): user.site for user in users}
+    finally:
+        db.close()
+
+    # Rows of different users interleave, and some users have more samples than the cap keeps.
+    archive = EmbeddingArchive(directory=str(tmp_path / "archive"), model="test")
+    rows = [(user_id, rng.standard_normal(512).astype(np.float32)) for _ in range(3) for user_id in site_of]
+    rows += [(user_id, rng.standard_normal(512).astype(np.float32)) for _ in range(12) for user_id in list(site_of)[:2]]
+    for user_id, vector in rows:
+        archive.append([(user_id, vector)], site_of[user_id])
+
+    report = rebuild_gallery(archive, "numpy", workers=4, batch_size=5)
+    assert report["vectors"] == len(rows)
+
+    for site in ("north", "south"):
+        expected = GalleryIndex(
+            NumpyIndex(path=str(tmp_path / f"{site}-prototypes"), quantization="none"),
+            NumpyIndex(path=str(tmp_path / f"{site}-samples"), quantization="none"),
+        )
+        for user_id, vector in rows:
+            if site_of[user_id] == site:
+                expected.upsert([(user_id, vector)])
+        rebuilt = create_gallery("numpy", site)
+        assert sorted(rebuilt.samples.ids()) == sorted(expected.samples.ids())
+        assert sorted(rebuilt.ids()) == sorted(expected.ids())
+        for user_id in expected.ids():
+            assert rebuilt.sample_count(user_id) == expected.sample_count(user_id)
+            np.testing.assert_allclose(rebuilt.fetch([user_id])[user_id], expected.fetch([user_id])[user_id], atol=1e-5)
+        probe = normalize(rows[-1][1])
+        assert rebuilt.query(probe, top_k=3)["matches"][0]["id"] == expected.query(probe, top_k=3)["matches"][0]["id"]
@@ -0,0 +1,75 @@
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from backend.routes import stream
+from backend.utils.executors import executors
+
+
+def test_stream_reports_a_busy_server_and_stays_open(monkeypatch):
+    embeds = []
+
+    async def detect(stage, fn, frame):
+        return [(0, 0, 32, 32)], {}
+
+    async def embed_face(face):
+        embeds.append(face)
+        if len(embeds) == 1:
+            raise HTTPException(status_code=503, detail="Server busy (inference queue full), retry shortly")
+        return np.ones(4, dtype=np.float32)
+
+    monkeypatch.setattr(stream, "STREAM_DETECT_EVERY", 1)
+    monkeypatch.setattr(stream, "decode_frame", lambda data: np.zeros((64, 64, 3), dtype=np.uint8))
+    monkeypatch.setattr(stream, "face_quality", lambda face: (True, {}))
+    monkeypatch.setattr(stream, "embed_face", embed_face)
+    monkeypatch.setattr(stream, "match_embedding", lambda embedding, threshold, site: (False, None, 0.4))
+    monkeypatch.setattr(executors.inference, "run", detect)
+
+    app = FastAPI()
+    app.include_router(stream.router)
+    with TestClient(app) as client, client.websocket_connect("/ws/mark-attendance") as websocket:
+        websocket.send_bytes(b"frame")
+        error = websocket.receive_json()
+        assert error["event"] == "error" and error["track_id"] == 1 and "busy" in error["detail"]
+
+        websocket.send_bytes(b"frame")
+        event = websocket.receive_json()
+        assert event["event"] == "unrecognized" and event["track_id"] == 1
+    executors.io.shutdown()
+
+
+def test_stream_survives_a_crashing_inference_stage(monkeypatch):
+    detects, embeds = [], []
+
+    async def detect(stage, fn, frame):
+        detects.append(frame)
+        if len(detects) == 1:
+            raise RuntimeError("A process in the process pool was terminated abruptly")
+        return [(0, 0, 32, 32)], {}
+
+    async def embed_face(face):
+        embeds.append(face)
+        if len(embeds) == 1:
+            raise RuntimeError("inference failed")
+        return np.ones(4, dtype=np.float32)
+
+    monkeypatch.setattr(stream, "STREAM_DETECT_EVERY", 1)
+    monkeypatch.setattr(stream, "decode_frame", lambda data: np.zeros((64, 64, 3), dtype=np.uint8))
+    monkeypatch.setattr(stream, "face_quality", lambda face: (True, {}))
+    monkeypatch.setattr(stream, "embed_face", embed_face)
+    monkeypatch.setattr(stream, "match_embedding", lambda embedding, threshold, site: (False, None, 0.4))
+    monkeypatch.setattr(executors.inference, "run", detect)
+
+    app = FastAPI()
+    app.include_router(stream.router)
+    with TestClient(app) as client, client.websocket_connect("/ws/mark-attendance") as websocket:
+        websocket.send_bytes(b"frame")
+        assert websocket.receive_json() == {"event": "error", "frame": 1, "detail": "Internal error"}
+
+        websocket.send_bytes(b"frame")
+        assert websocket.receive_json() == {"event": "error", "track_id": 1, "detail": "Internal error"}
+
+        websocket.send_bytes(b"frame")
+        event = websocket.receive_json()
+        assert event["event"] == "unrecognized" and event["track_id"] == 1
+    executors.io.shutdown()
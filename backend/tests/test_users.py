@@ -0,0 +1,31 @@
+import cv2
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.routes import users
+from backend.utils.executors import executors
+
+
+def test_multi_embeds_every_face_in_one_call(monkeypatch):
+    passes = []
+
+    async def run(stage, fn, *args):
+        if stage == "detect":
+            return [(0, 0, 32, 32), (32, 32, 32, 32), (0, 32, 32, 32)], {}
+        passes.append(len(args[0]))
+        return [np.ones(512, dtype=np.float32), ValueError("Face could not be detected"), np.ones(512, dtype=np.float32)]
+
+    monkeypatch.setattr(executors.inference, "run", run)
+    monkeypatch.setattr(users, "match_embeddings", lambda embeddings, threshold, site: [(False, None, 0.2)] * len(embeddings))
+    png = cv2.imencode(".png", np.zeros((64, 64, 3), dtype=np.uint8))[1].tobytes()
+
+    app = FastAPI()
+    app.include_router(users.router)
+    with TestClient(app) as client:
+        response = client.post("/mark-attendance/multi", files={"image_data": ("photo.png", png, "image/png")})
+    executors.io.shutdown()
+    assert response.status_code == 200
+    assert passes == [3]
+    messages = [face["message"] for face in response.json()["faces"]]
+    assert messages == ["User not recognized", "Face could not be detected", "User not recognized"]
@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from backend.utils.vector_store import NumpyIndex, normalize
+
+
+def random_vectors(n, dim=512, seed=0):
+    return normalize(np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32))
+
+
+@pytest.mark.parametrize("quantization", ["none", "float16", "int8", "pq"])
+def test_writes_are_searchable_and_survive_reload(tmp_path, quantization):
+    path = str(tmp_path / "index")
+    vectors = random_vectors(300)
+    index = NumpyIndex(path=path, quantization=quantization)
+    index.upsert([(str(i), vector) for i, vector in enumerate(vectors[:200])])
+    index.upsert([(str(i), vector) for i, vector in enumerate(vectors[200:], start=200)])
+    index.delete(["5", "250"])
+    index.upsert([("7", vectors[8])])
+
+    for reopened in (index, NumpyIndex(path=path, quantization=quantization)):
+        assert len(reopened.ids()) == 298
+        assert reopened.query(vectors[3], top_k=1)["matches"][0]["id"] == "3"
+        assert reopened.query(vectors[260], top_k=1)["matches"][0]["id"] == "260"
+        assert "5" not in {match["id"] for match in reopened.query(vectors[5], top_k=10)["matches"]}
+        assert np.allclose(reopened.fetch(["7"])["7"], vectors[8], atol=1e-6)
+
+
+def test_writes_append_to_journal_instead_of_rewriting(tmp_path):
+    path = str(tmp_path / "index")
+    index = NumpyIndex(path=path)
+    index.upsert([(str(i), vector) for i, vector in enumerate(random_vectors(2000))])
+    index.compact()
+    base_mtime = (tmp_path / "index.npy").stat().st_mtime_ns
+
+    index.upsert([("new", random_vectors(1, seed=1)[0])])
+    index.delete(["0"])
+
+    assert (tmp_path / "index.npy").stat().st_mtime_ns == base_mtime
+    assert (tmp_path / "index.journal").exists()
+    assert NumpyIndex(path=path).query(random_vectors(1, seed=1)[0], top_k=1)["matches"][0]["id"] == "new"
+
+
+def test_torn_journal_line_is_dropped(tmp_path):
+    path = str(tmp_path / "index")
+    vectors = random_vectors(3)
+    index = NumpyIndex(path=path)
+    index.upsert([("a", vectors[0])])
+    with open(f"{path}.journal", "a") as f:
+        f.write('{"put": ["b"], "rows": "AAA')
+
+    reopened = NumpyIndex(path=path)
+    assert reopened.ids() == ["a"]
+    reopened.upsert([("c", vectors[2])])
+    assert sorted(NumpyIndex(path=path).ids()) == ["a", "c"]
+
+
+def test_compaction_keeps_live_rows_only(tmp_path):
+    path = str(tmp_path / "index")
+    vectors = random_vectors(50)
+    index = NumpyIndex(path=path, quantization="int8")
+    index.upsert([(str(i), vector) for i, vector in enumerate(vectors)])
+    index.delete([str(i) for i in range(0, 50, 2)])
+    index.compact()
+
+    assert np.load(f"{path}.npy").shape == (25, 512)
+    assert not (tmp_path / "index.journal").exists()
+    assert index.query(vectors[11], top_k=1)["matches"][0]["id"] == "11"
+
+
+def test_writes_encode_only_new_rows_and_never_refit(tmp_path, monkeypatch):
+    path = str(tmp_path / "index")
+    vectors = random_vectors(400)
+    NumpyIndex(path=path, quantization="pq").upsert([(str(i), vector) for i, vector in enumerate(vectors[:300])])
+    index = NumpyIndex(path=path, quantization="pq")
+    codebook = index.codec.codebook.copy()
+
+    encoded, fitted = [], []
+    encode, fit = index.codec.encode, index.codec.fit
+    monkeypatch.setattr(index.codec, "encode", lambda rows: encoded.append(len(rows)) or encode(rows))
+    monkeypatch.setattr(index.codec, "fit", lambda rows: fitted.append(len(rows)) or fit(rows))
+    for i in range(300, 400):
+        index.upsert([(str(i), vectors[i])])
+    index.compact()
+
+    assert fitted == []
+    assert set(encoded) == {1}
+    assert np.array_equal(index.codec.codebook, codebook)
+    assert index.query(vectors[350], top_k=1)["matches"][0]["id"] == "350"
+
+    index.retrain_codebook()
+    assert fitted == [400]
+
+
+def test_hnsw_batches_inserts_and_saves_only_on_flush(tmp_path, monkeypatch):
+    pytest.importorskip("hnswlib")
+    from backend.utils.vector_store import HNSWIndex
+
+    path = str(tmp_path / "index")
+    vectors = random_vectors(300)
+    index = HNSWIndex(path=path, max_elements=64)
+    saves, inserts = [], []
+    monkeypatch.setattr(index, "save", lambda real=index.save: saves.append(1) or real())
+
+    class CountingIndex:
+        def __init__(self, wrapped):
+            self.wrapped = wrapped
+
+        def add_items(self, data, *args, **kwargs):
+            inserts.append(len(data))
+            return self.wrapped.add_items(data, *args, **kwargs)
+
+        def __getattr__(self, name):
+            return getattr(self.wrapped, name)
+
+    monkeypatch.setattr(index, "_index", CountingIndex(index._index))
+
+    index.upsert([(str(i), vector) for i, vector in enumerate(vectors)])
+    index.upsert([("3", vectors[4]), ("3", vectors[3])])
+    index.delete(["5"])
+    assert inserts == [300, 1]
+    assert saves == []
+    assert not (tmp_path / "index.hnsw").exists()
+
+    index.flush()
+    index.flush()
+    assert saves == [1]
+    reopened = HNSWIndex(path=path)
+    assert len(reopened.ids()) == 299
+    assert reopened.query(vectors[3], top_k=1)["matches"][0]["id"] == "3"
+    assert "5" not in reopened.ids()
+
+
+def test_pinecone_needs_an_api_key():
+    from backend.utils.vector_store import PineconeIndex
+
+    with pytest.raises(ValueError, match="PINECONE_API_KEY"):
+        PineconeIndex(api_key=None)
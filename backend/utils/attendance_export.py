@@ -0,0 +1,123 @@
+import csv
+import io
+
+from .attendance_store import query_attendance, ATTENDANCE_COLUMNS
+
+EXPORT_CHUNK_SIZE = 5000
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose contents are handed out chunk by chunk."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_attendance_chunks(start_date=None, end_date=None, user_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    cursor = None
+    while True:
+        records, cursor = query_attendance(user_id=user_id, start_date=start_date, end_date=end_date, cursor=cursor, limit=chunk_size)
+        if records:
+            yield records
+        if cursor is None:
+            return
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Arrow and Parquet exports require the 'pyarrow' package") from e
+    return pyarrow
+
+
+def _arrow_schema(pa):
+    return pa.schema([
+        ("Date", pa.string()),
+        ("Time", pa.string()),
+        ("User ID", pa.int64()),
+        ("Username", pa.string()),
+    ])
+
+
+def _record_batch(pa, schema, records):
+    return pa.RecordBatch.from_pydict(
+        {column: [record[column] for record in records] for column in ATTENDANCE_COLUMNS},
+        schema=schema,
+    )
+
+
+def stream_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ATTENDANCE_COLUMNS)
+    for records in chunks:
+        writer.writerows([record[column] for column in ATTENDANCE_COLUMNS] for record in records)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def stream_arrow(chunks):
+    pa = _require_pyarrow()
+    schema = _arrow_schema(pa)
+    sink = _DrainableSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for records in chunks:
+            writer.write_batch(_record_batch(pa, schema, records))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_parquet(chunks):
+    pa = _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(pa)
+    sink = _DrainableSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for records in chunks:
+            # One row group per chunk keeps the writer's buffered state bounded.
+            writer.write_batch(_record_batch(pa, schema, records))
+            yield sink.drain()
+    yield sink.drain()
+
+
+EXPORT_WRITERS = {
+    "csv": stream_csv,
+    "arrow": stream_arrow,
+    "parquet": stream_parquet,
+}
+
+
+def stream_attendance(export_format, start_date=None, end_date=None, user_id=None):
+    writer = EXPORT_WRITERS[export_format]
+    if export_format != "csv":
+        _require_pyarrow()
+    return writer(iter_attendance_chunks(start_date, end_date, user_id))
@@ -0,0 +1,224 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import func
+
+from ..database import SessionLocal, Attendance, AttendanceDaily, AttendanceWeekly
+
+UPSERT_CHUNK_ROWS = 500
+ROLLUP_PERIODS = {"day": (AttendanceDaily, AttendanceDaily.date), "week": (AttendanceWeekly, AttendanceWeekly.week_start)}
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _dialect(db):
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert, func.least, func.greatest
+    from sqlalchemy.dialects.sqlite import insert
+    # SQLite's two-argument min()/max() are scalar, like LEAST/GREATEST.
+    return insert, func.min, func.max
+
+
+def _upsert(db, model, rows, keys, updates):
+    insert = _dialect(db)[0]
+    for start in range(0, len(rows), UPSERT_CHUNK_ROWS):
+        stmt = insert(model).values(rows[start:start + UPSERT_CHUNK_ROWS])
+        db.execute(stmt.on_conflict_do_update(index_elements=keys, set_=updates(stmt.excluded)))
+
+
+def apply_rollups(db, rows):
+    """Fold newly inserted attendance rows into the rollup tables within the caller's transaction."""
+    if not rows:
+        return
+    daily = {}
+    for row in rows:
+        key = (row["date"], row["user_id"])
+        entry = daily.get(key)
+        if entry is None:
+            daily[key] = {
+                "date": row["date"], "user_id": row["user_id"], "username": row["username"],
+                "check_ins": 1, "first_seen": row["timestamp"], "last_seen": row["timestamp"],
+            }
+        else:
+            entry["username"] = row["username"]
+            entry["check_ins"] += 1
+            entry["first_seen"] = min(entry["first_seen"], row["timestamp"])
+            entry["last_seen"] = max(entry["last_seen"], row["timestamp"])
+
+    _, smaller, larger = _dialect(db)
+    _upsert(db, AttendanceDaily, list(daily.values()), [AttendanceDaily.date, AttendanceDaily.user_id], lambda excluded: {
+        "username": excluded.username,
+        "check_ins": AttendanceDaily.check_ins + excluded.check_ins,
+        "first_seen": smaller(AttendanceDaily.first_seen, excluded.first_seen),
+        "last_seen": larger(AttendanceDaily.last_seen, excluded.last_seen),
+    })
+
+    weeks = defaultdict(set)
+    for day, user_id in daily:
+        weeks[week_start(day)].add(user_id)
+    _refresh_weeks(db, weeks)
+
+
+def _refresh_weeks(db, weeks):
+    # A week is recomputed from at most seven daily rows per user, so it never drifts from them.
+    rows = []
+    for week, user_ids in weeks.items():
+        query = db.query(
+            AttendanceDaily.user_id,
+            func.max(AttendanceDaily.username).label("username"),
+            func.sum(AttendanceDaily.check_ins).label("check_ins"),
+            func.count().label("days_present"),
+            func.min(AttendanceDaily.first_seen).label("first_seen"),
+            func.max(AttendanceDaily.last_seen).label("last_seen"),
+        ).filter(
+            AttendanceDaily.date >= week,
+            AttendanceDaily.date < week + timedelta(days=7),
+            AttendanceDaily.user_id.in_(user_ids),
+        ).group_by(AttendanceDaily.user_id)
+        rows.extend({"week_start": week, **row._asdict()} for row in query)
+    _upsert(db, AttendanceWeekly, rows, [AttendanceWeekly.week_start, AttendanceWeekly.user_id], lambda excluded: {
+        "username": excluded.username,
+        "check_ins": excluded.check_ins,
+        "days_present": excluded.days_present,
+        "first_seen": excluded.first_seen,
+        "last_seen": excluded.last_seen,
+    })
+
+
+def rebuild_rollups(start_date=None, end_date=None):
+    """Recompute the rollups from the raw attendance table, widened to whole weeks."""
+    start_date = week_start(start_date) if start_date is not None else None
+    end_date = week_start(end_date) + timedelta(days=6) if end_date is not None else None
+    db = SessionLocal()
+    try:
+        for model, column in ROLLUP_PERIODS.values():
+            query = db.query(model)
+            if start_date is not None:
+                query = query.filter(column >= start_date)
+            if end_date is not None:
+                query = query.filter(column <= end_date)
+            query.delete(synchronize_session=False)
+
+        query = db.query(
+            Attendance.date,
+            Attendance.user_id,
+            func.max(Attendance.username).label("username"),
+            func.count(Attendance.id).label("check_ins"),
+            func.min(Attendance.timestamp).label("first_seen"),
+            func.max(Attendance.timestamp).label("last_seen"),
+        )
+        if start_date is not None:
+            query = query.filter(Attendance.date >= start_date)
+        if end_date is not None:
+            query = query.filter(Attendance.date <= end_date)
+        daily = [row._asdict() for row in query.group_by(Attendance.date, Attendance.user_id)]
+        db.bulk_insert_mappings(AttendanceDaily, daily)
+
+        weekly = {}
+        for row in daily:
+            key = (week_start(row["date"]), row["user_id"])
+            entry = weekly.get(key)
+            if entry is None:
+                weekly[key] = {"week_start": key[0], **{k: row[k] for k in ("user_id", "username", "check_ins", "first_seen", "last_seen")}, "days_present": 1}
+            else:
+                entry["check_ins"] += row["check_ins"]
+                entry["days_present"] += 1
+                entry["first_seen"] = min(entry["first_seen"], row["first_seen"])
+                entry["last_seen"] = max(entry["last_seen"], row["last_seen"])
+        db.bulk_insert_mappings(AttendanceWeekly, list(weekly.values()))
+        db.commit()
+        return {"daily": len(daily), "weekly": len(weekly)}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def ensure_rollups():
+    """Build the rollups once for databases that predate them."""
+    db = SessionLocal()
+    try:
+        missing = db.query(AttendanceDaily).first() is None and db.query(Attendance).first() is not None
+    finally:
+        db.close()
+    return rebuild_rollups() if missing else None
+
+
+def _segments(start_date, end_date):
+    """Split a date range into whole Monday-Sunday weeks plus the leftover days at either end."""
+    first_week = start_date if start_date is None or start_date.weekday() == 0 else week_start(start_date) + timedelta(days=7)
+    last_week = end_date if end_date is None else week_start(end_date) - timedelta(days=0 if end_date.weekday() == 6 else 7)
+    if first_week is not None and last_week is not None and first_week > last_week:
+        return [("day", start_date, end_date)]
+    segments = [("week", first_week, last_week)]
+    if start_date is not None and start_date < first_week:
+        segments.append(("day", start_date, first_week - timedelta(days=1)))
+    if end_date is not None and end_date > last_week + timedelta(days=6):
+        segments.append(("day", last_week + timedelta(days=7), end_date))
+    return segments
+
+
+def rollup_summary(user_id=None, start_date=None, end_date=None):
+    """Per-user totals over a date range, read from the weekly rollup with daily rows for partial weeks."""
+    users = {}
+    db = SessionLocal()
+    try:
+        for period, low, high in _segments(start_date, end_date):
+            model, column = ROLLUP_PERIODS[period]
+            days = func.sum(model.days_present) if period == "week" else func.count()
+            query = db.query(
+                model.user_id,
+                func.max(model.username).label("username"),
+                func.sum(model.check_ins).label("check_ins"),
+                days.label("days_present"),
+                func.min(model.first_seen).label("first_seen"),
+                func.max(model.last_seen).label("last_seen"),
+            )
+            if low is not None:
+                query = query.filter(column >= low)
+            if high is not None:
+                query = query.filter(column <= high)
+            if user_id is not None:
+                query = query.filter(model.user_id == user_id)
+            for row in query.group_by(model.user_id):
+                entry = users.get(row.user_id)
+                if entry is None:
+                    users[row.user_id] = row._asdict()
+                else:
+                    entry["check_ins"] += row.check_ins
+                    entry["days_present"] += row.days_present
+                    entry["first_seen"] = min(entry["first_seen"], row.first_seen)
+                    entry["last_seen"] = max(entry["last_seen"], row.last_seen)
+    finally:
+        db.close()
+    return [users[key] for key in sorted(users)]
+
+
+def attendance_rollups(period="day", user_id=None, start_date=None, end_date=None):
+    """Totals per day or per week: how many users were present and how many check-ins there were."""
+    model, column = ROLLUP_PERIODS[period]
+    db = SessionLocal()
+    try:
+        query = db.query(
+            column.label("period"),
+            func.count(model.user_id).label("users_present"),
+            func.sum(model.check_ins).label("check_ins"),
+            func.min(model.first_seen).label("first_seen"),
+            func.max(model.last_seen).label("last_seen"),
+        )
+        if start_date is not None:
+            query = query.filter(column >= (week_start(start_date) if period == "week" else start_date))
+        if end_date is not None:
+            query = query.filter(column <= end_date)
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        return [
+            {**row._asdict(), "period": row.period.strftime("%Y-%m-%d")}
+            for row in query.group_by(column).order_by(column)
+        ]
+    finally:
+        db.close()
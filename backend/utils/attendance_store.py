@@ -0,0 +1,215 @@
+import base64
+import io
+import logging
+import os
+from itertools import groupby
+from datetime import datetime, time
+
+import pandas as pd
+from openpyxl import Workbook
+from sqlalchemy import func, and_, or_
+
+from ..database import SessionLocal, Attendance
+from .attendance_rollups import apply_rollups, rollup_summary
+
+logger = logging.getLogger(__name__)
+
+ATTENDANCE_DIR = "attendance_sheets"
+ATTENDANCE_COLUMNS = ["Date", "Time", "User ID", "Username"]
+ATTENDANCE_PAGE_SIZE = 500
+ATTENDANCE_MAX_PAGE_SIZE = 5000
+
+
+def attendance_row(user_id, username, when, event_id=None):
+    return {
+        "event_id": event_id,
+        "user_id": int(user_id),
+        "username": username,
+        "date": when.date(),
+        "time": when.time().replace(microsecond=0),
+        "timestamp": when,
+    }
+
+
+def write_attendance(rows):
+    """Insert attendance rows and fold them into the rollups in one transaction.
+
+    Rows whose ``event_id`` is already stored are skipped, so a replayed batch
+    is only counted once. Returns the number of rows inserted.
+    """
+    db = SessionLocal()
+    try:
+        event_ids = [row["event_id"] for row in rows if row["event_id"] is not None]
+        stored = {event_id for (event_id,) in db.query(Attendance.event_id).filter(Attendance.event_id.in_(event_ids))}
+        rows = [row for row in rows if row["event_id"] not in stored]
+        db.bulk_insert_mappings(Attendance, rows)
+        apply_rollups(db, rows)
+        db.commit()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def attendance_record(row):
+    return {
+        "Date": row.date.strftime("%Y-%m-%d"),
+        "Time": row.time.strftime("%H:%M:%S"),
+        "User ID": row.user_id,
+        "Username": row.username,
+    }
+
+
+def get_attendance_for_date(date):
+    db = SessionLocal()
+    try:
+        rows = db.query(Attendance).filter(Attendance.date == date).order_by(Attendance.id).all()
+        return [attendance_record(row) for row in rows]
+    finally:
+        db.close()
+
+
+def filter_attendance(query, user_id=None, start_date=None, end_date=None, start_time=None, end_time=None):
+    if start_date is not None:
+        query = query.filter(Attendance.date >= start_date)
+    if end_date is not None:
+        query = query.filter(Attendance.date <= end_date)
+    if user_id is not None:
+        query = query.filter(Attendance.user_id == user_id)
+    if start_time is not None:
+        query = query.filter(Attendance.time >= start_time)
+    if end_time is not None:
+        query = query.filter(Attendance.time <= end_time)
+    return query
+
+
+def get_attendance_by_date(start_date=None, end_date=None):
+    db = SessionLocal()
+    try:
+        query = filter_attendance(db.query(Attendance), start_date=start_date, end_date=end_date)
+        rows = query.order_by(Attendance.date, Attendance.id).all()
+        return [
+            {"date": day.strftime('%Y-%m-%d'), "data": [attendance_record(row) for row in day_rows]}
+            for day, day_rows in groupby(rows, key=lambda row: row.date)
+        ]
+    finally:
+        db.close()
+
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(f"{row.date.isoformat()}:{row.id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        day, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return datetime.strptime(day, '%Y-%m-%d').date(), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def query_attendance(user_id=None, start_date=None, end_date=None, start_time=None, end_time=None, cursor=None, limit=ATTENDANCE_PAGE_SIZE):
+    """Keyset-paginated attendance records ordered by (date, id).
+
+    Each page is a bounded range scan on the (date, user_id) index, so the
+    cost of a page does not depend on how much history precedes it.
+    """
+    limit = max(1, min(limit, ATTENDANCE_MAX_PAGE_SIZE))
+    db = SessionLocal()
+    try:
+        query = filter_attendance(db.query(Attendance), user_id, start_date, end_date, start_time, end_time)
+        if cursor is not None:
+            after_date, after_id = decode_cursor(cursor)
+            query = query.filter(or_(
+                Attendance.date > after_date,
+                and_(Attendance.date == after_date, Attendance.id > after_id),
+            ))
+        rows = query.order_by(Attendance.date, Attendance.id).limit(limit + 1).all()
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return [attendance_record(row) for row in rows[:limit]], next_cursor
+    finally:
+        db.close()
+
+
+def attendance_summary(user_id=None, start_date=None, end_date=None, start_time=None, end_time=None):
+    if start_time is None and end_time is None:
+        return rollup_summary(user_id, start_date, end_date)
+    # Time-of-day windows cut across the rollups, so they are answered from the raw rows.
+    db = SessionLocal()
+    try:
+        query = db.query(
+            Attendance.user_id,
+            func.max(Attendance.username).label("username"),
+            func.count(Attendance.id).label("check_ins"),
+            func.count(func.distinct(Attendance.date)).label("days_present"),
+            func.min(Attendance.timestamp).label("first_seen"),
+            func.max(Attendance.timestamp).label("last_seen"),
+        )
+        query = filter_attendance(query, user_id, start_date, end_date, start_time, end_time)
+        return [
+            {
+                "user_id": row.user_id,
+                "username": row.username,
+                "check_ins": row.check_ins,
+                "days_present": row.days_present,
+                "first_seen": row.first_seen,
+                "last_seen": row.last_seen,
+            }
+            for row in query.group_by(Attendance.user_id).order_by(Attendance.user_id)
+        ]
+    finally:
+        db.close()
+
+
+def export_xlsx(date):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(ATTENDANCE_COLUMNS)
+    for record in get_attendance_for_date(date):
+        sheet.append([record[column] for column in ATTENDANCE_COLUMNS])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def import_legacy_sheets(directory=ATTENDANCE_DIR):
+    """Load per-day xlsx files written by older versions into the table.
+
+    A day that already has rows in the table is skipped, so this is safe to
+    run on every startup.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    imported = 0
+    db = SessionLocal()
+    try:
+        known_dates = {row.date for row in db.query(Attendance.date).distinct()}
+        for sheet in sorted(os.listdir(directory)):
+            if not sheet.endswith(".xlsx"):
+                continue
+            try:
+                sheet_date = datetime.strptime(sheet.split('.')[0], '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            if sheet_date in known_dates:
+                continue
+            data = pd.read_excel(os.path.join(directory, sheet), dtype=str)
+            rows = []
+            for number, record in enumerate(data.to_dict(orient="records"), start=2):
+                # The Date column is not reliable (some rows are DD-MM-YYYY); the file name is.
+                # Older sheets store times as HH:MM, newer ones as HH:MM:SS.
+                try:
+                    when = datetime.combine(sheet_date, time.fromisoformat(str(record["Time"]).strip()))
+                    rows.append(attendance_row(record["User ID"], record["Username"], when))
+                except (TypeError, ValueError) as e:
+                    logger.warning("Skipping row %d of %s: %s", number, sheet, e)
+            db.bulk_insert_mappings(Attendance, rows)
+            apply_rollups(db, rows)
+            db.commit()
+            imported += len(rows)
+        return imported
+    finally:
+        db.close()
@@ -1,56 +1,103 @@
 from fastapi import UploadFile, HTTPException
-from pinecone import Pinecone
-import io
+from fastapi.concurrency import run_in_threadpool
 import cv2
-from deepface import DeepFace
 import numpy as np
-from PIL import Image
 import pandas as pd
-from ..database import SessionLocal, User
+from ..database import DEFAULT_SITE, SessionLocal, User
+from collections import defaultdict
 from datetime import datetime
 import os
-from sqlalchemy.exc import NoResultFound
-from openpyxl import Workbook, load_workbook
+from .vector_store import normalize
+from .gallery import PROMOTE_THRESHOLD
+from .sharding import ALL_SITES, create_sharded_gallery
+from .model_manager import model_manager
+from .batching import EmbeddingBatcher
+from .executors import executors
+from .attendance_store import attendance_row, write_attendance
+from .outbox import outbox, encode_vector, decode_vector
+from .embedding_archive import EmbeddingArchive
+from .cache import TTLCache, perceptual_hash, thumbnail
+from .identity import user_directory
+from .detectors import NoFaceDetected, as_rgb, detect_boxes, crop
+from .imaging import read_upload, decode_image
+from .metrics import stage_timer, outcomes
 
-pc = Pinecone(api_key='5fae31d3-2cf4-474a-ad33-11826e76bf01')
-index = pc.Index("face-recognition")
+archive = EmbeddingArchive(model=model_manager.model_name)
+index = create_sharded_gallery(archive=archive)
 
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+PROBE_CACHE_SIZE = int(os.getenv("PROBE_CACHE_SIZE", "2048"))
+PROBE_CACHE_TTL = float(os.getenv("PROBE_CACHE_TTL", "300"))
+# A cached embedding is reused only if its crop's thumbnail is within this mean grey-level difference.
+PROBE_MAX_DIFFERENCE = float(os.getenv("PROBE_MAX_DIFFERENCE", "4.0"))
+GALLERY_CACHE_SIZE = int(os.getenv("GALLERY_CACHE_SIZE", "1024"))
+GALLERY_CACHE_TTL = float(os.getenv("GALLERY_CACHE_TTL", "3600"))
+# A hot-gallery hit skips the index, so it must clear a stricter bar than the index match.
+HOT_MATCH_THRESHOLD = float(os.getenv("HOT_MATCH_THRESHOLD", "0.80"))
+# Only a hot hit this far above that bar is trusted without checking the full index.
+HOT_MATCH_MARGIN = float(os.getenv("HOT_MATCH_MARGIN", "0.10"))
 
-ATTENDANCE_DIR = "attendance_sheets"
-os.makedirs(ATTENDANCE_DIR, exist_ok=True)
+probe_cache = TTLCache(PROBE_CACHE_SIZE, PROBE_CACHE_TTL, name="probe_embeddings")
+gallery_cache = TTLCache(GALLERY_CACHE_SIZE, GALLERY_CACHE_TTL, name="hot_gallery")
+
+def embed_faces(images):
+    """One forward pass over ``images``; a face that cannot be embedded gets its ValueError in its place."""
+    results = model_manager.represent([np.asarray(image) for image in images])
+    return [
+        ValueError("Embedding contains NaN or Inf values.")
+        if not isinstance(result, Exception) and not np.isfinite(result).all() else result
+        for result in results
+    ]
+
+def get_embeddings(images):
+    results = embed_faces(images)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return np.stack(results)
 
 def get_embedding(image):
-    image_np = np.array(image)
-    
-    embedding = DeepFace.represent(img_path=image_np, model_name='Facenet512')[0]['embedding']
-    embedding = np.array(embedding, dtype=np.float32)
-    if np.isnan(embedding).any() or np.isinf(embedding).any():
-        raise ValueError("Embedding contains NaN or Inf values.")
+    return get_embeddings([image])[0]
+
+embedding_batcher = EmbeddingBatcher(embed_faces, executor=executors.inference)
+
+async def embed_face(face_image):
+    key = perceptual_hash(face_image)
+    small = thumbnail(face_image)
+    cached = probe_cache.get(key)
+    # Different faces can share a 64-bit hash, so a hit must also look like the crop it was computed from.
+    if cached is not None and float(np.mean(np.abs(cached[0] - small))) <= PROBE_MAX_DIFFERENCE:
+        return cached[1]
+    with stage_timer("embed"):
+        embedding = await embedding_batcher.embed(face_image)
+    probe_cache.set(key, (small, embedding))
     return embedding
 
-def detect_face(image):
-    image_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-    
-    gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-    
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60))
+def detect_faces(image, timings=None):
+    model_manager.ensure_loaded()
+    return detect_boxes(model_manager.detector, as_rgb(image), timings=timings)
+
+def detect_faces_timed(image):
+    timings = {}
+    boxes = detect_faces(image, timings)
+    return boxes, timings
+
+def detect_face(image, timings=None):
+    image = as_rgb(image)
     
-    if len(faces) == 0:
-        raise ValueError("No faces detected in the image.")
+    boxes = detect_faces(image, timings)
     
-    (x, y, w, h) = faces[0]
+    if len(boxes) == 0:
+        raise NoFaceDetected("No faces detected in the image.")
     
-    face = image_cv[y:y+h, x:x+w]
+    return crop(image, boxes[0])
 
-    cv2.imwrite('processed.png', face)
+def detect_face_timed(image):
+    timings = {}
+    face = detect_face(image, timings)
+    return face, timings
 
-    face_image = Image.fromarray(cv2.cvtColor(face, cv2.COLOR_BGR2RGB))
-    
-    return face_image
-
-def check_existing_user(new_embedding, similarity_threshold):
-    results = index.query(vector=new_embedding.tolist(), top_k=10)
+def check_existing_user(new_embedding, similarity_threshold, site=DEFAULT_SITE):
+    results = index.query(new_embedding, top_k=10, site=site)
     
     for match in results.get('matches', []):
         similarity_score = match['score']
@@ -60,27 +107,50 @@ def check_existing_user(new_embedding, similarity_threshold):
     return False, None
 
 def register_user(username, image, ip_address, similarity_threshold=0.70):
-    db = SessionLocal()
     try:
         face_image = detect_face(image)
         
         new_embedding = get_embedding(face_image)
-        
-        exists, similarity_score = check_existing_user(new_embedding, similarity_threshold)
+    except Exception as e:
+        return False, str(e)
+
+    return enroll_user(username, new_embedding, ip_address, similarity_threshold)
+
+def enroll_user(username, new_embedding, ip_address, similarity_threshold=0.70, site=DEFAULT_SITE):
+    db = SessionLocal()
+    try:
+        exists, similarity_score = check_existing_user(new_embedding, similarity_threshold, site)
         
         if exists:
+            outcomes.inc("duplicate")
             return False, f"User with similar face already registered. Similarity score: {similarity_score:.2f}"
         
         new_user = User(
             username=username,
             ip=ip_address,
-            timestamp=datetime.utcnow()
+            timestamp=datetime.utcnow(),
+            site=site
         )
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
-        
-        index.upsert(vectors=[(str(new_user.id), new_embedding.tolist())])
+        db.flush()
+
+        # The index write is queued before the user commits, so a committed user always reaches the index.
+        key = f"enrollment:{new_user.id}"
+        try:
+            outbox.add(
+                "enrollment",
+                {"user_id": str(new_user.id), "username": username, "site": site, "embedding": encode_vector(new_embedding)},
+                key=key,
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            outbox.discard([key])
+            raise
+        user_directory.set(new_user.id, new_user.username)
+        # The hot gallery lets the user check in before the outbox entry lands.
+        gallery_cache.set((site, str(new_user.id)), normalize(new_embedding))
+        outcomes.inc("registered")
         
         return True, f"User {username} registered successfully with ID {new_user.id}"
     except Exception as e:
@@ -94,56 +164,129 @@ def verify_user(image, confidence_threshold=0.70):
         
         embedding = get_embedding(face_image)
         
-        results = index.query(vector=embedding.tolist(), top_k=1)
-        
-        if results and results['matches']:
-            match = results['matches'][0]
-            user_id = match['id']
-            similarity_score = match['score']
-            
-            if similarity_score >= confidence_threshold:
-                return True, user_id, similarity_score
-            else:
-                return False, None, similarity_score
-        else:
-            return False, None, None
+        return match_embedding(embedding, confidence_threshold)
     except Exception as e:
         raise ValueError(f"Error during verification: {str(e)}")
+
+def match_hot_gallery(embedding, threshold, site=DEFAULT_SITE):
+    # Hot entries are keyed by (site, user id) so a check-in never matches outside its partition.
+    hot = [(key, vector) for key, vector in gallery_cache.items() if site == ALL_SITES or key[0] == site]
+    if not hot:
+        return None, None, None
+    scores = np.stack([vector for _, vector in hot]) @ normalize(embedding)
+    best = int(np.argmax(scores))
+    if scores[best] >= threshold:
+        hot_site, user_id = hot[best][0]
+        return hot_site, user_id, float(scores[best])
+    return None, None, None
+
+def match_embeddings(embeddings, confidence_threshold=0.70, site=DEFAULT_SITE):
+    with stage_timer("vector_query"):
+        results = index.query_batch(embeddings, top_k=1, site=site)
+    matches = []
+    for embedding, result in zip(embeddings, results):
+        if result['matches']:
+            match = result['matches'][0]
+            success = match['score'] >= confidence_threshold
+            if success:
+                promote(match['id'], embedding, match['score'], site=match['site'])
+            matches.append((success, match['id'] if success else None, match['score']))
+        else:
+            matches.append((False, None, None))
+    return matches
+
+def match_embedding(embedding, confidence_threshold=0.70, site=DEFAULT_SITE):
+    with stage_timer("vector_query"):
+        return _match_embedding(embedding, confidence_threshold, site)
+
+def _match_embedding(embedding, confidence_threshold, site):
+    hot_threshold = max(confidence_threshold, HOT_MATCH_THRESHOLD)
+    hot_site, hot_user, hot_score = match_hot_gallery(embedding, hot_threshold, site)
+    if hot_user is not None and hot_score >= hot_threshold + HOT_MATCH_MARGIN:
+        promote(hot_user, embedding, hot_score, site=hot_site)
+        return True, hot_user, hot_score
+
+    # A closer hot hit is confirmed by the full index, where someone outside the hot set may score higher.
+    results = index.query(embedding, top_k=1, site=site)
+    if hot_user is not None and not (results and results['matches'] and results['matches'][0]['score'] > hot_score):
+        # The index does not know a user whose enrollment is still in the outbox.
+        promote(hot_user, embedding, hot_score, site=hot_site)
+        return True, hot_user, hot_score
+
+    if results and results['matches']:
+        match = results['matches'][0]
+        user_id = match['id']
+        similarity_score = match['score']
+
+        if similarity_score >= confidence_threshold:
+            for vector_id, vector in index.fetch([user_id], site=match['site']).items():
+                gallery_cache.set((match['site'], vector_id), vector)
+            promote(user_id, embedding, similarity_score, site=match['site'])
+            return True, user_id, similarity_score
+        else:
+            return False, None, similarity_score
+    else:
+        return False, None, None
     
 async def read_image_data(upload_file: UploadFile):
+    contents = await read_upload(upload_file)
     try:
-        contents = await upload_file.read()
-        image = Image.open(io.BytesIO(contents))
-        return np.array(image)
+        return await run_in_threadpool(decode_image, contents)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def decode_frame(contents):
+    frame = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Could not decode frame")
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
 def get_username_by_id(user_id: int):
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.id == user_id).one()
-        return user.username
-    except NoResultFound:
-        return None
-    finally:
-        db.close()
+    with stage_timer("db_lookup"):
+        return _get_username_by_id(user_id)
 
-def log_attendance(user_id: str, username: str):
-    today_date = datetime.now().strftime("%Y-%m-%d")
-    current_time = datetime.now().strftime("%H:%M:%S")
-    file_path = os.path.join(ATTENDANCE_DIR, f"{today_date}.xlsx")
-    
-    if os.path.exists(file_path):
-        workbook = load_workbook(file_path)
-        sheet = workbook.active
-    else:
-        workbook = Workbook()
-        sheet = workbook.active
-        sheet.append(["Date", "Time", "User ID", "Username"])
-    
-    # for row in sheet.iter_rows(min_row=2, values_only=True):
-    #     if row[2] == user_id and row[0] == today_date:
-    #         return
+def _get_username_by_id(user_id):
+    return user_directory.get(user_id)
+
+def log_attendance(user_id: str, username: str, idempotency_key=None):
+    with stage_timer("attendance_write"):
+        payload = {"user_id": int(user_id), "username": username, "timestamp": datetime.now().isoformat()}
+        outbox.add("attendance", payload, key=f"attendance:{idempotency_key}" if idempotency_key else None)
+
+def is_enrolled_user(payload):
+    # A user rolled back after its entry was queued frees its id for the next user, so the name must match too.
+    username = user_directory.get(payload["user_id"])
+    return username is not None and payload.get("username", username) == username
+
+def apply_enrollments(entries):
+    by_site = defaultdict(list)
+    for _, payload in entries:
+        # Skip users deleted while pending, and replays that would add the same face as a second sample.
+        if is_enrolled_user(payload) and not index.sample_count(payload["user_id"], site=payload["site"]):
+            by_site[payload["site"]].append((payload["user_id"], decode_vector(payload["embedding"])))
+    for site, vectors in by_site.items():
+        index.upsert(vectors, site=site)
+    index.flush()
+
+def apply_attendance(entries):
+    write_attendance([
+        attendance_row(payload["user_id"], payload["username"], datetime.fromisoformat(payload["timestamp"]), event_id=key)
+        for key, payload in entries
+    ])
+
+def promote(user_id, embedding, score, site=DEFAULT_SITE):
+    # Confident check-ins become gallery samples from the outbox drainer, never inside the request.
+    if score >= PROMOTE_THRESHOLD:
+        outbox.add("promotion", {"user_id": str(user_id), "site": site, "score": float(score), "embedding": encode_vector(embedding)})
+
+def apply_promotions(entries):
+    for _, payload in entries:
+        if payload["user_id"] in user_directory:
+            index.promote(payload["user_id"], decode_vector(payload["embedding"]), payload["score"], site=payload["site"])
+    index.flush()
 
-    sheet.append([today_date, current_time, user_id, username])
-    workbook.save(file_path)
\ No newline at end of file
+outbox.handler("enrollment", apply_enrollments)
+outbox.handler("attendance", apply_attendance)
+outbox.handler("promotion", apply_promotions)
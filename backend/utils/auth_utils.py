@@ -2,23 +2,34 @@ from fastapi import Depends, HTTPException, status
 from pydantic import BaseModel
 from typing import Optional
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
-from ..database import SessionLocal, User as UserModel
+from ..database import SessionLocal, AsyncSessionLocal
+from .identity import get_user, get_user_by_username, user_directory
+from .cache import TTLCache
 import os
-from ..schema import TokenData, UserInDB
+import time
+from ..schema import TokenData, TokenUser
 from dotenv import load_dotenv
 
 load_dotenv()
 
-SECRET_KEY = "kajhowl3h2ihk4kkhdi4k5jbksjk45"
+SECRET_KEY = os.getenv("SECRET_KEY", "kajhowl3h2ihk4kkhdi4k5jbksjk45")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 15
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+
+# Signature-checked access tokens, so polling dashboards skip the JWT decode.
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, name="verified_tokens")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
 def get_db():
     db = SessionLocal()
@@ -27,15 +38,20 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(UserModel).filter(UserModel.username == username).first()
-    if not user or not verify_password(password, user.password):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
+    # bcrypt takes hundreds of milliseconds; keep it off the event loop.
+    if not user or not user.password or not await run_in_threadpool(verify_password, password, user.password):
         return None
 
     return user
@@ -50,24 +66,97 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def user_claims(user):
+    return {"sub": user.username, "uid": user.id, "role": user.role}
+
+def create_tokens(user):
+    claims = user_claims(user)
+    return {
+        "access_token": create_access_token(
+            {**claims, "type": "access"}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        ),
+        "refresh_token": create_access_token(
+            {**claims, "type": "refresh"}, expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        ),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "role": user.role,
+    }
+
+def decode_token(token: str, token_type: str):
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get("type", "access") != token_type:
+        raise JWTError(f"Expected a {token_type} token")
+    return payload
+
+async def refresh_tokens(db: AsyncSession, refresh_token: str):
+    """Issue a new token pair from a refresh token, re-reading the user so role changes apply."""
+    try:
+        payload = decode_token(refresh_token, "refresh")
+    except JWTError:
+        return None
+    if payload.get("uid") is None:
+        return None
+    user = await get_user(db, payload["uid"])
+    if user is None or user.username != payload.get("sub"):
+        return None
+    return create_tokens(user)
+
+def is_current_user(user_id, username):
+    # SQLite can hand a deleted user's id to the next user, so the id alone does not identify the token's owner.
+    return user_id in user_directory and user_directory.get(user_id) == username
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+    cached = token_cache.get(token)
+    if cached is not None:
+        user, expires = cached
+        # A user deleted since the token was cached is re-checked below instead of being let through.
+        if expires > time.time() and is_current_user(user.id, user.username):
+            return user
+        token_cache.pop(token)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token, "access")
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    
-    user = db.query(UserModel).filter(UserModel.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
 
-    return user
\ No newline at end of file
+    if "uid" in payload and "role" in payload:
+        # Deleted users drop out of the resident directory, which revokes their tokens.
+        if payload["uid"] not in user_directory:
+            db_user = await get_user(db, payload["uid"])
+            if db_user is None:
+                raise credentials_exception
+            user_directory.set(db_user.id, db_user.username)
+        if not is_current_user(payload["uid"], username):
+            raise credentials_exception
+        user = TokenUser(id=payload["uid"], username=username, role=payload["role"])
+    else:
+        # Tokens issued before role claims existed.
+        db_user = await get_user_by_username(db, token_data.username)
+        if db_user is None:
+            raise credentials_exception
+        user = TokenUser(id=db_user.id, username=db_user.username, role=db_user.role)
+
+    token_cache.set(token, (user, payload["exp"]))
+    return user
+
+async def is_admin_token(token: Optional[str]):
+    """Whether ``token`` is a valid access token of an admin; for routes that do not otherwise authenticate."""
+    if not token:
+        return False
+    async with AsyncSessionLocal() as db:
+        try:
+            user = await get_current_user(token, db)
+        except HTTPException:
+            return False
+    return user.role == "admin"
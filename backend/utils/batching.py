@@ -0,0 +1,112 @@
+import asyncio
+import os
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "10"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_MAX_QUEUE = int(os.getenv("EMBED_MAX_QUEUE", "256"))
+
+
+class EmbeddingBatcher:
+    """Micro-batching scheduler in front of a batched embedding function.
+
+    Concurrent callers of ``embed`` are queued; a single background task
+    collects faces for up to ``window_ms`` or ``max_batch`` faces, whichever
+    comes first, runs one forward pass and resolves each caller's future with
+    its own embedding. While a batch is running the next one is filling up.
+    Forward passes run on ``executor`` (a StageExecutor) when one is given.
+
+    ``embed_fn`` returns one entry per face, either its embedding or the
+    exception for a face it could not embed; only that caller sees the error.
+    """
+
+    def __init__(self, embed_fn, executor=None, max_batch=EMBED_MAX_BATCH, window_ms=EMBED_BATCH_WINDOW_MS, max_queue=EMBED_MAX_QUEUE):
+        self.embed_fn = embed_fn
+        self.executor = executor
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self.max_queue = max_queue
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _forward(self, faces):
+        if self.executor is None:
+            return await run_in_threadpool(self.embed_fn, faces)
+        return await self.executor.run("embed", self.embed_fn, faces)
+
+    async def embed(self, face):
+        if not self.running:
+            result = (await self._forward([face]))[0]
+            if isinstance(result, Exception):
+                raise result
+            return result
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((face, future))
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy (embedding queue full), retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Callers that gave up (client disconnect, timeout) do not need a forward pass.
+        return [(face, future) for face, future in batch if not future.done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            try:
+                results = await self._forward([face for face, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
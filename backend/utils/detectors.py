@@ -0,0 +1,129 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar")
+HAAR_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+YUNET_MODEL_PATH = os.getenv("YUNET_MODEL_PATH", os.path.join("models", "face_detection_yunet_2023mar.onnx"))
+YUNET_SCORE_THRESHOLD = float(os.getenv("YUNET_SCORE_THRESHOLD", "0.8"))
+# Detection runs on a copy whose longest side is at most this many pixels.
+DETECT_MAX_SIDE = int(os.getenv("DETECT_MAX_SIDE", "640"))
+MIN_FACE_SIZE = 60
+REFINE_PADDING = 0.25
+
+
+class NoFaceDetected(ValueError):
+    pass
+
+
+def as_rgb(image):
+    image = np.asarray(image)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:
+        return image[:, :, :3]
+    return image
+
+
+class FaceDetector:
+    """Returns face boxes as ``(x, y, w, h)`` in the coordinates of the input frame."""
+
+    def detect(self, image, min_size=MIN_FACE_SIZE):
+        raise NotImplementedError
+
+
+class HaarDetector(FaceDetector):
+    def __init__(self, cascade_path=HAAR_CASCADE_PATH):
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise RuntimeError(f"Could not load face detector from {cascade_path}")
+
+    def detect(self, image, min_size=MIN_FACE_SIZE):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+        return [tuple(int(v) for v in face) for face in faces]
+
+
+class YuNetDetector(FaceDetector):
+    """OpenCV's DNN face detector, loaded from a local ONNX file."""
+
+    def __init__(self, model_path=YUNET_MODEL_PATH, score_threshold=YUNET_SCORE_THRESHOLD):
+        if not os.path.exists(model_path):
+            raise RuntimeError(f"YuNet model not found at {model_path}")
+        self.detector = cv2.FaceDetectorYN.create(model_path, "", (320, 320), score_threshold)
+
+    def detect(self, image, min_size=MIN_FACE_SIZE):
+        height, width = image.shape[:2]
+        self.detector.setInputSize((width, height))
+        _, faces = self.detector.detect(cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        if faces is None:
+            return []
+        boxes = []
+        for face in faces:
+            x, y, w, h = (int(round(v)) for v in face[:4])
+            if w >= min_size and h >= min_size:
+                boxes.append((max(0, x), max(0, y), w, h))
+        return boxes
+
+
+DETECTORS = {
+    "haar": HaarDetector,
+    "yunet": YuNetDetector,
+}
+
+
+def create_detector(name=FACE_DETECTOR):
+    try:
+        return DETECTORS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown FACE_DETECTOR '{name}', expected one of {sorted(DETECTORS)}")
+
+
+def _record(timings, stage, start):
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
+
+
+def _pad_box(box, padding, width, height):
+    x, y, w, h = box
+    pad_w, pad_h = int(w * padding), int(h * padding)
+    left, top = max(0, x - pad_w), max(0, y - pad_h)
+    right, bottom = min(width, x + w + pad_w), min(height, y + h + pad_h)
+    return left, top, right - left, bottom - top
+
+
+def detect_boxes(detector, image, max_side=DETECT_MAX_SIDE, refine=True, timings=None):
+    """Detect on a downscaled frame, then refine each box at full resolution.
+
+    Boxes are returned largest first, in full-resolution coordinates.
+    """
+    start = time.perf_counter()
+    height, width = image.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    small = image if scale == 1.0 else cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    start = _record(timings, "detect_downscale", start)
+
+    boxes = detector.detect(small, min_size=max(16, int(MIN_FACE_SIZE * scale)))
+    start = _record(timings, "detect_model", start)
+
+    refined = []
+    for x, y, w, h in boxes:
+        box = (int(x / scale), int(y / scale), int(w / scale), int(h / scale))
+        if refine and scale < 1.0:
+            rx, ry, rw, rh = _pad_box(box, REFINE_PADDING, width, height)
+            candidates = detector.detect(image[ry:ry + rh, rx:rx + rw], min_size=max(MIN_FACE_SIZE, int(box[2] * 0.6)))
+            if candidates:
+                cx, cy, cw, ch = max(candidates, key=lambda c: c[2] * c[3])
+                box = (rx + cx, ry + cy, cw, ch)
+        refined.append(box)
+    _record(timings, "detect_refine", start)
+    return sorted(refined, key=lambda b: b[2] * b[3], reverse=True)
+
+
+def crop(image, box):
+    x, y, w, h = box
+    return np.ascontiguousarray(image[y:y + h, x:x + w])
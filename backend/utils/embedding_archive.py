@@ -0,0 +1,73 @@
+import os
+import threading
+
+import numpy as np
+
+from .vector_store import EMBEDDING_DIM
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EMBEDDING_ARCHIVE_DIR = os.getenv("EMBEDDING_ARCHIVE_DIR", "embedding_archive")
+
+
+def record_dtype(dim=EMBEDDING_DIM):
+    return np.dtype([("site", "S64"), ("user_id", "<i8"), ("vector", "<f4", (dim,))])
+
+
+class EmbeddingArchive:
+    """Append-only copy of enrollment embeddings, kept outside the vector index.
+
+    Each model gets one file, ``<dir>/<model>.emb``, of fixed-size records
+    (site, user id, float32 vector) that memory-maps straight into a NumPy
+    structured array. The index can be rebuilt from it, or moved to another
+    backend or quantisation, without re-enrolling anyone. Nothing is ever
+    removed; a rebuild keeps only the users still in the ``users`` table.
+    """
+
+    def __init__(self, directory=EMBEDDING_ARCHIVE_DIR, model=None, dim=EMBEDDING_DIM):
+        self.directory = directory
+        self.model = model
+        self.dtype = record_dtype(dim)
+        self._lock = threading.Lock()
+
+    def path(self, model=None):
+        return os.path.join(self.directory, f"{model or self.model}.emb")
+
+    def models(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith(".emb"))
+
+    def append(self, vectors, site, model=None):
+        """Archive ``(user_id, vector)`` pairs enrolled into ``site``."""
+        if not vectors:
+            return
+        records = np.zeros(len(vectors), dtype=self.dtype)
+        records["site"] = site
+        records["user_id"] = [int(user_id) for user_id, _ in vectors]
+        records["vector"] = np.stack([np.asarray(vector, dtype=np.float32) for _, vector in vectors])
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self.path(model), "ab+") as f:
+            if fcntl is not None:
+                # The server and the CLI tools may append at the same time.
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # Drop the torn tail of a write interrupted by a crash so records stay aligned.
+            end = f.seek(0, os.SEEK_END)
+            f.truncate(end - end % self.dtype.itemsize)
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self, model=None):
+        """Every archived record for ``model``, memory-mapped; fields ``site``, ``user_id`` and ``vector``."""
+        path = self.path(model)
+        rows = os.path.getsize(path) // self.dtype.itemsize if os.path.exists(path) else 0
+        if rows == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(path, dtype=self.dtype, mode="r", shape=(rows,))
+
+    def user_ids(self, model=None):
+        return {str(user_id) for user_id in np.unique(self.load(model)["user_id"])}
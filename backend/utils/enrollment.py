@@ -0,0 +1,270 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from ..database import DEFAULT_SITE, EnrolledFile, SessionLocal, User
+from .identity import user_directory
+from .model_manager import model_manager
+from .outbox import outbox, encode_vector
+from .vector_store import normalize
+
+ENROLLMENT_DIR = os.getenv("ENROLLMENT_DIR", "enrollment_jobs")
+MAX_ENROLLMENT_ARCHIVE_BYTES = int(os.getenv("MAX_ENROLLMENT_ARCHIVE_BYTES", str(2 * 1024 ** 3)))
+ENROLL_WORKERS = int(os.getenv("ENROLL_WORKERS", str(os.cpu_count() or 1)))
+ENROLL_TASK_SIZE = int(os.getenv("ENROLL_TASK_SIZE", "16"))
+ENROLL_COMMIT_SIZE = int(os.getenv("ENROLL_COMMIT_SIZE", "256"))
+MANIFEST_NAME = "manifest.csv"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def _read_source(source, filename):
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return archive.read(filename)
+    with open(os.path.join(source, filename), "rb") as f:
+        return f.read()
+
+
+def _list_source(source):
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return [name for name in archive.namelist() if not name.endswith("/")]
+    return [
+        os.path.relpath(os.path.join(root, name), source)
+        for root, _, names in os.walk(source)
+        for name in names
+    ]
+
+
+def read_manifest(source):
+    """Return ``[(filename, username), ...]`` for an enrollment source.
+
+    The manifest is a ``manifest.csv`` with ``filename`` and ``username``
+    columns. Without one, every image is enrolled under its file stem.
+    """
+    names = _list_source(source)
+    if MANIFEST_NAME in names:
+        reader = csv.DictReader(io.StringIO(_read_source(source, MANIFEST_NAME).decode("utf-8-sig")))
+        return [(row["filename"], row["username"]) for row in reader]
+    return [
+        (name, os.path.splitext(os.path.basename(name))[0])
+        for name in sorted(names)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def _embed_files(source, filenames):
+    """Worker task: detect a handful of images and embed their faces in one forward pass."""
+    from .attendance_utils import detect_face, embed_faces
+
+    results, faces = {}, {}
+    for filename in filenames:
+        try:
+            image = np.array(Image.open(io.BytesIO(_read_source(source, filename))).convert("RGB"))
+            faces[filename] = detect_face(image)
+        except Exception as e:
+            results[filename] = str(e)
+    if faces:
+        for filename, result in zip(faces, embed_faces(list(faces.values()))):
+            results[filename] = str(result) if isinstance(result, Exception) else result
+    return results
+
+
+def _init_enroll_worker():
+    model_manager.load()
+
+
+class EnrollmentJob:
+    """Resumable bulk enrollment of a directory or zip of face photos.
+
+    Progress is checkpointed to ``<ENROLLMENT_DIR>/<job_id>/state.json`` after
+    every committed chunk; running a job again with the same id skips the
+    files it already handled. Each enrolled file is also recorded in
+    ``enrolled_files`` in the same transaction as its user, so a crash before
+    the checkpoint never enrolls the file twice.
+    """
+
+    def __init__(self, source, job_id=None, ip_address="bulk-enrollment", similarity_threshold=0.70, site=None):
+        self.source = source
+        self.site = site or DEFAULT_SITE
+        self.job_id = job_id or uuid.uuid4().hex
+        self.ip_address = ip_address
+        self.similarity_threshold = similarity_threshold
+        self.directory = os.path.join(ENROLLMENT_DIR, self.job_id)
+        self._lock = threading.Lock()
+        self._enrolled = []
+        self.state = self._load_state()
+        self.source = source or self.state["source"]
+        # A resumed job keeps enrolling into the site it started with.
+        self.site = self.state.setdefault("site", self.site)
+
+    @property
+    def _state_file(self):
+        return os.path.join(self.directory, "state.json")
+
+    def _load_state(self):
+        if os.path.exists(self._state_file):
+            with open(self._state_file) as f:
+                return json.load(f)
+        return {
+            "job_id": self.job_id,
+            "source": self.source,
+            "site": self.site,
+            "status": "pending",
+            "total": 0,
+            "done": [],
+            "enrolled": 0,
+            "duplicates": 0,
+            "failed": {},
+            "started_at": None,
+            "finished_at": None,
+        }
+
+    def _save_state(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._state_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self._state_file)
+
+    def progress(self):
+        with self._lock:
+            state = dict(self.state)
+        state["processed"] = len(state.pop("done"))
+        state["failed"] = len(state["failed"])
+        return state
+
+    def run(self, index, workers=ENROLL_WORKERS, on_enrolled=None, on_progress=None):
+        manifest = read_manifest(self.source)
+        usernames = dict(manifest)
+        done = set(self.state["done"])
+        # Files committed after the last checkpoint were enrolled already.
+        recovered = [filename for filename in self._enrolled_files() if filename not in done]
+        done.update(recovered)
+        pending = [filename for filename, _ in manifest if filename not in done]
+        with self._lock:
+            self.state["done"].extend(recovered)
+            self.state["enrolled"] += len(recovered)
+            self.state.update(status="running", total=len(manifest), started_at=self.state["started_at"] or datetime.utcnow().isoformat())
+        self._save_state()
+
+        tasks = [pending[i:i + ENROLL_TASK_SIZE] for i in range(0, len(pending), ENROLL_TASK_SIZE)]
+        buffered = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_enroll_worker) as pool:
+                futures = [pool.submit(_embed_files, self.source, task) for task in tasks]
+                for future in as_completed(futures):
+                    buffered.update(future.result())
+                    if len(buffered) >= ENROLL_COMMIT_SIZE:
+                        self._commit(index, buffered, usernames, on_enrolled)
+                        buffered = {}
+                        if on_progress is not None:
+                            on_progress(self.progress())
+            self._commit(index, buffered, usernames, on_enrolled)
+            status = "completed"
+        except Exception as e:
+            status = f"failed: {e}"
+        with self._lock:
+            self.state.update(status=status, finished_at=datetime.utcnow().isoformat())
+        self._save_state()
+        return self.progress()
+
+    def _enrolled_files(self):
+        db = SessionLocal()
+        try:
+            return [filename for filename, in db.query(EnrolledFile.filename).filter(EnrolledFile.job_id == self.job_id)]
+        finally:
+            db.close()
+
+    def _dedupe(self, index, filenames, embeddings):
+        """Vectorised duplicate check against the gallery, this run's earlier chunks and within the chunk."""
+        keep, duplicates = [], []
+        gallery_hits = index.query_batch(embeddings, top_k=1, site=self.site)
+        batch = normalize(embeddings)
+        within = batch @ batch.T
+        # Earlier chunks reach the gallery through the outbox, so they may not be searchable yet.
+        earlier = (batch @ np.concatenate(self._enrolled).T).max(axis=1) if self._enrolled else np.full(len(batch), -1.0)
+        for i, filename in enumerate(filenames):
+            matches = gallery_hits[i]["matches"]
+            if matches and matches[0]["score"] >= self.similarity_threshold:
+                duplicates.append(filename)
+            elif earlier[i] >= self.similarity_threshold:
+                duplicates.append(filename)
+            elif any(within[i, j] >= self.similarity_threshold for j in keep):
+                duplicates.append(filename)
+            else:
+                keep.append(i)
+        return keep, duplicates
+
+    def _commit(self, index, results, usernames, on_enrolled=None):
+        if not results:
+            return
+        failed = {filename: value for filename, value in results.items() if isinstance(value, str)}
+        filenames = [filename for filename in results if filename not in failed]
+        keep, duplicates = [], []
+        if filenames:
+            embeddings = np.stack([results[filename] for filename in filenames])
+            keep, duplicates = self._dedupe(index, filenames, embeddings)
+
+        if keep:
+            now = datetime.utcnow()
+            users = [User(username=usernames[filenames[i]], ip=self.ip_address, timestamp=now, site=self.site) for i in keep]
+            db = SessionLocal()
+            keys = []
+            try:
+                db.add_all(users)
+                db.flush()
+                db.add_all([EnrolledFile(job_id=self.job_id, filename=filenames[i], user_id=user.id) for user, i in zip(users, keep)])
+                vectors = [(str(user.id), embeddings[i]) for user, i in zip(users, keep)]
+                names = [(user.id, user.username) for user in users]
+                # The index writes are queued before the users commit, so a committed user always reaches the gallery.
+                keys = outbox.add_many("enrollment", [
+                    (f"enrollment:{user_id}", {"user_id": user_id, "username": username, "site": self.site, "embedding": encode_vector(vector)})
+                    for (user_id, vector), (_, username) in zip(vectors, names)
+                ])
+                db.commit()
+            except Exception:
+                db.rollback()
+                outbox.discard(keys)
+                raise
+            finally:
+                db.close()
+            for user_id, username in names:
+                user_directory.set(user_id, username)
+            self._enrolled.append(normalize(embeddings[keep]))
+            if on_enrolled is not None:
+                on_enrolled(vectors)
+
+        with self._lock:
+            self.state["done"].extend(results)
+            self.state["enrolled"] += len(keep)
+            self.state["duplicates"] += len(duplicates)
+            self.state["failed"].update(failed)
+        self._save_state()
+
+
+enrollment_jobs = {}
+
+
+def start_enrollment_job(source, index, job_id=None, **kwargs):
+    job = EnrollmentJob(source, job_id=job_id, **kwargs)
+    enrollment_jobs[job.job_id] = job
+    threading.Thread(target=job.run, args=(index,), name=f"enroll-{job.job_id}", daemon=True).start()
+    return job
+
+
+def get_enrollment_job(job_id):
+    job = enrollment_jobs.get(job_id)
+    if job is None and os.path.exists(os.path.join(ENROLLMENT_DIR, job_id, "state.json")):
+        job = EnrollmentJob(None, job_id=job_id)
+    return job
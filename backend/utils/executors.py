@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from .model_manager import model_manager
+
+# 0 keeps inference in-process on a thread pool (one resident model).
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "64"))
+IO_MAX_PENDING = int(os.getenv("IO_MAX_PENDING", "256"))
+
+STAGE_TIMEOUTS = {
+    "detect": float(os.getenv("DETECT_TIMEOUT", "5")),
+    "embed": float(os.getenv("EMBED_TIMEOUT", "10")),
+    "query": float(os.getenv("QUERY_TIMEOUT", "2")),
+    "db": float(os.getenv("DB_TIMEOUT", "5")),
+}
+
+
+def _init_inference_worker():
+    model_manager.load()
+
+
+def _warm_inference_worker():
+    model_manager.load()
+    return os.getpid()
+
+
+class StageExecutor:
+    """A pool plus a bound on in-flight work.
+
+    ``run`` rejects with 503 as soon as ``max_pending`` jobs are queued or
+    running instead of letting the backlog grow, and turns a stage that
+    exceeds its timeout into a 504. A job's slot is freed when the job itself
+    finishes, not when its caller gives up on it.
+    """
+
+    def __init__(self, name, factory, max_pending):
+        self.name = name
+        self.factory = factory
+        self.max_pending = max_pending
+        self.pending = 0
+        self.pool = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.pool is None:
+            self.pool = self.factory()
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def try_acquire(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail=f"Server busy ({self.name} queue full), retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self.pending += 1
+
+    def release(self, *_):
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, stage, fn, *args):
+        self.start()
+        self.try_acquire()
+        call = functools.partial(fn, *args)
+        if isinstance(self.pool, ThreadPoolExecutor):
+            # Carry the request's context (e.g. its stage trace) into the worker thread.
+            call = functools.partial(contextvars.copy_context().run, call)
+        try:
+            future = self.pool.submit(call)
+        except BaseException:
+            self.release()
+            raise
+        # A timed-out job keeps its worker busy until it returns, so it keeps its slot until then too.
+        future.add_done_callback(self.release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), STAGE_TIMEOUTS.get(stage))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=f"Stage '{stage}' timed out")
+
+
+class Executors:
+    def __init__(self, inference_workers=INFERENCE_WORKERS, io_workers=IO_WORKERS):
+        self.inference_workers = inference_workers
+        if inference_workers > 0:
+            # TensorFlow is not fork-safe, so inference workers are spawned fresh.
+            inference_factory = lambda: ProcessPoolExecutor(
+                max_workers=inference_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_inference_worker,
+            )
+        else:
+            inference_factory = lambda: ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.inference = StageExecutor("inference", inference_factory, INFERENCE_MAX_PENDING)
+        self.io = StageExecutor(
+            "io", lambda: ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="io"), IO_MAX_PENDING
+        )
+        self.ready = False
+
+    async def start(self):
+        self.inference.start()
+        self.io.start()
+        loop = asyncio.get_running_loop()
+        if self.inference_workers > 0:
+            await asyncio.gather(*(
+                loop.run_in_executor(self.inference.pool, _warm_inference_worker)
+                for _ in range(self.inference_workers)
+            ))
+        else:
+            await loop.run_in_executor(self.inference.pool, model_manager.load)
+        self.ready = True
+
+    def shutdown(self):
+        self.ready = False
+        self.inference.shutdown()
+        self.io.shutdown()
+
+
+executors = Executors()
@@ -0,0 +1,218 @@
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from ..database import DEFAULT_SITE
+from .vector_store import VECTOR_BACKEND, VECTOR_INDEX_PATH, NumpyIndex, VectorStore, get_vector_store, normalize
+
+MAX_SAMPLES_PER_USER = int(os.getenv("MAX_SAMPLES_PER_USER", "10"))
+# Prototypes scoring within this margin of the best one are re-ranked by their samples.
+RERANK_MARGIN = float(os.getenv("RERANK_MARGIN", "0.05"))
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "5"))
+# A lone best prototype at or above this score is returned without re-ranking.
+RERANK_CONFIDENT = float(os.getenv("RERANK_CONFIDENT", "0.80"))
+PROMOTE_THRESHOLD = float(os.getenv("PROMOTE_THRESHOLD", "0.85"))
+# A check-in this close to an existing sample adds nothing and is not promoted.
+PROMOTE_MAX_SIMILARITY = float(os.getenv("PROMOTE_MAX_SIMILARITY", "0.97"))
+PROMOTE_BATCH_SIZE = int(os.getenv("PROMOTE_BATCH_SIZE", "32"))
+
+
+def sample_id(user_id, n):
+    return f"{user_id}:{n}"
+
+
+def sample_owner(vector_id):
+    return vector_id.rpartition(":")[0]
+
+
+def sample_number(vector_id):
+    return int(vector_id.rpartition(":")[2])
+
+
+def prepare_samples(user_vectors, max_samples=MAX_SAMPLES_PER_USER):
+    """Sample and prototype rows for ``[(user id, vectors in enrollment order), ...]``.
+
+    The rows are what one ``upsert`` per vector would leave behind, computed
+    without touching a gallery so that chunks of users can be prepared in
+    parallel and written with ``GalleryIndex.bulk_insert``.
+    """
+    samples, prototypes = [], []
+    for user_id, vectors in user_vectors:
+        user_id = str(user_id)
+        vectors = normalize(vectors)
+        # The cap keeps the enrollment sample and the newest of the rest.
+        kept = [0] + list(range(max(1, len(vectors) - max_samples + 1), len(vectors)))
+        samples += [(sample_id(user_id, n), vectors[n]) for n in kept]
+        prototypes.append((user_id, normalize(np.mean(vectors[kept], axis=0))))
+    return samples, prototypes
+
+
+class GalleryIndex(VectorStore):
+    """Several reference embeddings per user behind one prototype each.
+
+    ``prototypes`` holds the normalised centroid of each user's samples under
+    the user id; ``samples`` holds the samples as ``<user id>:<n>``. Queries
+    search the prototypes, so a lookup stays O(users). Only when several
+    prototypes score close to the best, or the best is not clearly above the
+    bar, are those candidates re-scored by their closest sample.
+
+    ``upsert`` adds samples rather than replacing the user's vector.
+    """
+
+    def __init__(self, prototypes, samples, max_samples=MAX_SAMPLES_PER_USER):
+        self.prototypes = prototypes
+        self.samples = samples
+        self.max_samples = max_samples
+        self._lock = threading.RLock()
+        self._pending = []
+        self._sample_ids = defaultdict(list)
+        for vector_id in samples.ids():
+            self._sample_ids[sample_owner(vector_id)].append(vector_id)
+        for ids in self._sample_ids.values():
+            ids.sort(key=sample_number)
+
+        missing = [user_id for user_id in prototypes.ids() if user_id not in self._sample_ids]
+        if missing:
+            # Galleries from before multi-sample support hold one vector per user; it becomes sample 0.
+            legacy = prototypes.fetch(missing)
+            samples.upsert([(sample_id(user_id, 0), vector) for user_id, vector in legacy.items()])
+            for user_id in legacy:
+                self._sample_ids[user_id].append(sample_id(user_id, 0))
+
+    def _samples_for(self, user_ids):
+        with self._lock:
+            ids = [vector_id for user_id in user_ids for vector_id in self._sample_ids.get(user_id, ())]
+        grouped = defaultdict(list)
+        for vector_id, vector in self.samples.fetch(ids).items():
+            grouped[sample_owner(vector_id)].append(vector)
+        return grouped
+
+    def _add(self, vectors):
+        with self._lock:
+            new, evicted, touched = {}, [], set()
+            for user_id, values in vectors:
+                user_id = str(user_id)
+                ids = self._sample_ids[user_id]
+                vector_id = sample_id(user_id, sample_number(ids[-1]) + 1 if ids else 0)
+                ids.append(vector_id)
+                new[vector_id] = normalize(values)
+                touched.add(user_id)
+                if len(ids) > self.max_samples:
+                    # Keep the enrollment sample; drop the oldest of the rest.
+                    evicted.append(ids.pop(1))
+            # A sample added and evicted within the same batch is never written.
+            stored = [vector_id for vector_id in evicted if new.pop(vector_id, None) is None]
+            self.samples.upsert(list(new.items()))
+            if stored:
+                self.samples.delete(stored)
+            self._update_prototypes(touched)
+
+    def _update_prototypes(self, user_ids):
+        grouped = self._samples_for(user_ids)
+        self.prototypes.upsert([(user_id, normalize(np.mean(vectors, axis=0))) for user_id, vectors in grouped.items()])
+
+    def bulk_insert(self, samples, prototypes):
+        """Write rows from ``prepare_samples`` for users not yet in the gallery, one upsert per store."""
+        if not samples:
+            return
+        with self._lock:
+            for vector_id, _ in samples:
+                self._sample_ids[sample_owner(vector_id)].append(vector_id)
+            self.samples.upsert(samples)
+            self.prototypes.upsert(prototypes)
+
+    def add_samples(self, user_id, vectors):
+        self._add([(user_id, vector) for vector in vectors])
+
+    def sample_count(self, user_id):
+        with self._lock:
+            return len(self._sample_ids.get(str(user_id), ()))
+
+    def promote(self, user_id, vector, score):
+        """Queue a confident check-in as a new sample for ``user_id``; written in batches."""
+        if score < PROMOTE_THRESHOLD:
+            return
+        user_id = str(user_id)
+        vector = normalize(vector)
+        with self._lock:
+            known = self._samples_for([user_id]).get(user_id, [])
+            known += [pending for owner, pending in self._pending if owner == user_id]
+            if known and float(np.max(np.stack(known) @ vector)) >= PROMOTE_MAX_SIMILARITY:
+                return
+            self._pending.append((user_id, vector))
+            if len(self._pending) >= PROMOTE_BATCH_SIZE:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if pending:
+                self._add(pending)
+            self.prototypes.flush()
+            self.samples.flush()
+
+    def _rerank(self, vector, result, top_k):
+        matches = result["matches"]
+        if not matches:
+            return result
+        best = matches[0]["score"]
+        close = [match for match in matches if match["score"] >= best - RERANK_MARGIN]
+        if len(close) > 1 or best < RERANK_CONFIDENT:
+            samples = self._samples_for([match["id"] for match in close])
+            query = normalize(vector)
+            for match in close:
+                if len(samples.get(match["id"], ())) > 1:
+                    match["score"] = max(match["score"], float(np.max(np.stack(samples[match["id"]]) @ query)))
+            matches = sorted(matches, key=lambda match: match["score"], reverse=True)
+        return {"matches": matches[:top_k]}
+
+    def query(self, vector, top_k=10):
+        return self.query_batch([vector], top_k=top_k)[0]
+
+    def query_batch(self, vectors, top_k=10):
+        results = self.prototypes.query_batch(vectors, top_k=max(top_k, RERANK_CANDIDATES))
+        return [self._rerank(vector, result, top_k) for vector, result in zip(vectors, results)]
+
+    def upsert(self, vectors):
+        self._add(vectors)
+
+    def delete(self, ids):
+        with self._lock:
+            ids = [str(user_id) for user_id in ids]
+            self._pending = [(owner, vector) for owner, vector in self._pending if owner not in ids]
+            doomed = [vector_id for user_id in ids for vector_id in self._sample_ids.pop(user_id, ())]
+            if doomed:
+                self.samples.delete(doomed)
+            self.prototypes.delete(ids)
+
+    def clear(self):
+        with self._lock:
+            self._pending = []
+            self._sample_ids.clear()
+            self.samples.delete(self.samples.ids())
+            self.prototypes.delete(self.prototypes.ids())
+
+    def fetch(self, ids):
+        return self.prototypes.fetch(ids)
+
+    def ids(self):
+        return self.prototypes.ids()
+
+    def save(self):
+        self.flush()
+        self.prototypes.save()
+        self.samples.save()
+
+
+def create_gallery(backend=VECTOR_BACKEND, site=DEFAULT_SITE):
+    # The default site keeps the original index names, so single-site galleries need no migration.
+    prefix = None if site == DEFAULT_SITE else f"site-{site}"
+    samples_name = f"{prefix}-samples" if prefix else "samples"
+    if backend == "numpy":
+        # Samples are only fetched by id, never scanned, so they skip the quantised copy.
+        samples = NumpyIndex(path=f"{VECTOR_INDEX_PATH}-{samples_name}", quantization="none")
+    else:
+        samples = get_vector_store(backend, collection=samples_name)
+    return GalleryIndex(get_vector_store(backend, collection=prefix), samples)
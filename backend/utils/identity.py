@@ -0,0 +1,108 @@
+import os
+import threading
+
+from sqlalchemy import select
+
+from ..database import SessionLocal, User
+from .cache import TTLCache
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Detached User rows by primary key, plus username -> id so token lookups land on the same entries.
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL, name="users")
+user_ids = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL, name="user_ids")
+
+
+def remember_user(user):
+    user_cache.set(user.id, user)
+    user_ids.set(user.username, user.id)
+    return user
+
+
+def forget_user(user_id):
+    user = user_cache.pop(user_id)
+    if user is not None:
+        user_ids.pop(user.username)
+
+
+async def get_user(db, user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.get(User, user_id)
+        if user is not None:
+            remember_user(user)
+    return user
+
+
+async def get_user_by_username(db, username):
+    user_id = user_ids.get(username)
+    if user_id is not None:
+        user = await get_user(db, user_id)
+        if user is not None and user.username == username:
+            return user
+    user = (await db.execute(select(User).where(User.username == username))).scalars().first()
+    return remember_user(user) if user is not None else None
+
+
+def get_user_sync(user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        db = SessionLocal(expire_on_commit=False)
+        try:
+            user = db.get(User, user_id)
+        finally:
+            db.close()
+        if user is not None:
+            remember_user(user)
+    return user
+
+
+class UserDirectory:
+    """Resident id -> username map so recognition never queries the users table.
+
+    Loaded at startup and kept current by registration and deletion. A miss
+    (e.g. a user enrolled by another process) falls back to the database once
+    and is then remembered.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        db = SessionLocal()
+        try:
+            names = dict(db.query(User.id, User.username).all())
+        finally:
+            db.close()
+        with self._lock:
+            self._names = names
+
+    def get(self, user_id):
+        user_id = int(user_id)
+        username = self._names.get(user_id)
+        if username is None:
+            user = get_user_sync(user_id)
+            if user is not None:
+                username = user.username
+                self.set(user_id, username)
+        return username
+
+    def set(self, user_id, username):
+        with self._lock:
+            self._names[int(user_id)] = username
+
+    def remove(self, user_id):
+        with self._lock:
+            self._names.pop(int(user_id), None)
+        forget_user(int(user_id))
+
+    def __contains__(self, user_id):
+        return int(user_id) in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+
+user_directory = UserDirectory()
@@ -0,0 +1,77 @@
+import io
+import os
+
+import cv2
+import numpy as np
+from fastapi import HTTPException, status
+from PIL import Image, ImageOps
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+# Longest side of the decoded image; detection refines faces at this resolution.
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", "1600"))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+EXIF_ORIENTATION = 0x0112
+
+
+def too_large(detail):
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+
+
+async def read_upload(upload_file, limit=MAX_UPLOAD_BYTES):
+    """Read an upload in chunks, rejecting it as soon as it exceeds ``limit`` bytes."""
+    if upload_file.size is not None and upload_file.size > limit:
+        raise too_large(f"Upload exceeds {limit} bytes")
+    buffer = bytearray()
+    while True:
+        chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return bytes(buffer)
+        buffer += chunk
+        if len(buffer) > limit:
+            raise too_large(f"Upload exceeds {limit} bytes")
+
+
+async def save_upload(upload_file, path, limit=MAX_UPLOAD_BYTES):
+    """Stream an upload to ``path`` in chunks, rejecting it as soon as it exceeds ``limit`` bytes."""
+    if upload_file.size is not None and upload_file.size > limit:
+        raise too_large(f"Upload exceeds {limit} bytes")
+    written = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return written
+            written += len(chunk)
+            if written > limit:
+                raise too_large(f"Upload exceeds {limit} bytes")
+            f.write(chunk)
+
+
+def decode_image(data, max_side=DECODE_MAX_SIDE):
+    """Decode to a contiguous RGB uint8 array no larger than ``max_side``, upright per EXIF.
+
+    Only the header is parsed before the size check. JPEGs are then decoded
+    directly at a reduced DCT scale (1/2, 1/4 or 1/8) instead of at full
+    resolution and shrunk afterwards.
+    """
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise too_large(f"Image has {width * height} pixels, the limit is {MAX_IMAGE_PIXELS}")
+
+    # EXIF orientations 5-8 swap the axes, so the long side is the same either way.
+    scale = min(1.0, max_side / max(width, height))
+    if image.format == "JPEG" and scale < 1.0:
+        image.draft("RGB", (int(width * scale), int(height * scale)))
+    if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    array = np.asarray(image)
+    height, width = array.shape[:2]
+    if max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        array = cv2.resize(array, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(array)
@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+
+import numpy as np
+from deepface import DeepFace
+from deepface.modules import detection, preprocessing
+
+from .detectors import create_detector
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "Facenet512")
+# DeepFace's own detector, run on each crop before embedding as DeepFace.represent always has.
+EMBEDDING_DETECTOR = os.getenv("EMBEDDING_DETECTOR", "opencv")
+
+
+class ModelManager:
+    """Owns the embedding model and face detector for the lifetime of a process.
+
+    ``load`` builds both once and runs a warm-up inference so the first real
+    request does not pay for graph construction. ``ready`` stays False until
+    that has happened and is what the readiness probe reports.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        self.model_name = model_name
+        self.model = None
+        self.detector = None
+        self.ready = False
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.ready:
+                return
+            start = time.perf_counter()
+            self.detector = create_detector()
+            self.model = DeepFace.build_model(self.model_name)
+            self.warm_up()
+            self.load_seconds = time.perf_counter() - start
+            self.ready = True
+
+    def ensure_loaded(self):
+        if not self.ready:
+            self.load()
+
+    def warm_up(self):
+        dummy_face = np.random.default_rng(0).integers(0, 256, size=(160, 160, 3), dtype=np.uint8)
+        self.detector.detect(dummy_face)
+        self.model.forward(self._preprocess(dummy_face, enforce_detection=False))
+
+    def _preprocess(self, face, enforce_detection=True):
+        # DeepFace.represent's per-face steps, with the detector and alignment the existing galleries
+        # were enrolled with: find and align the face in the crop, then resize and normalise it.
+        found = detection.extract_faces(
+            img_path=np.asarray(face), detector_backend=EMBEDDING_DETECTOR, grayscale=False,
+            enforce_detection=enforce_detection, align=True,
+        )
+        # input_shape is (width, height); resize_image takes (height, width).
+        width, height = self.model.input_shape
+        image = preprocessing.resize_image(img=found[0]["face"][:, :, ::-1], target_size=(height, width))
+        return preprocessing.normalize_input(img=image, normalization="base")
+
+    def represent(self, faces):
+        """Embed ``faces`` in one forward pass of the resident model.
+
+        Returns one entry per face: its float32 embedding, or the ValueError
+        raised while preparing it (e.g. no face found in the crop), so one bad
+        face does not fail the others.
+        """
+        self.ensure_loaded()
+        results, batch = [], []
+        for face in faces:
+            try:
+                batch.append(self._preprocess(face))
+                results.append(None)
+            except ValueError as e:
+                results.append(e)
+        if batch:
+            embeddings = iter(np.asarray(self.model.forward(np.concatenate(batch)), dtype=np.float32).reshape(len(batch), -1))
+            results = [next(embeddings) if result is None else result for result in results]
+        return results
+
+
+model_manager = ModelManager()
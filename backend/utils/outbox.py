@@ -0,0 +1,172 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+OUTBOX_DRAIN_INTERVAL = float(os.getenv("OUTBOX_DRAIN_INTERVAL", "0.05"))
+# A kind whose handler keeps failing is retried with exponential backoff up to this many seconds.
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "30"))
+
+
+def encode_vector(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode()
+
+
+def decode_vector(data):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class Outbox:
+    """Durable local queue for writes bound for the database and the vector index.
+
+    ``add`` commits an entry to a local SQLite file and returns, so the caller
+    never waits on the backend the write is meant for. A drainer thread hands
+    pending entries to the handler registered for their kind, in batches, and
+    deletes them only once the handler succeeds; a failing kind backs off
+    without holding up the others. Whatever is left on shutdown or after a
+    crash is replayed on the next start.
+
+    Entries are keyed and adding a key that is still pending is a no-op.
+    Handlers may still see an entry twice (a crash between applying a batch
+    and deleting it), so they must be idempotent.
+    """
+
+    def __init__(self, path=OUTBOX_PATH, batch_size=OUTBOX_BATCH_SIZE, interval=OUTBOX_DRAIN_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.handlers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._retry_at = {}
+        self._backoff = {}
+        self._errors = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_kind_seq ON outbox (kind, seq)")
+
+    def handler(self, kind, apply):
+        """Register ``apply(entries)`` for ``kind``; it receives a list of ``(key, payload)``."""
+        self.handlers[kind] = apply
+
+    def add(self, kind, payload, key=None):
+        key = key or f"{kind}:{uuid.uuid4().hex}"
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (key, kind, payload, created) VALUES (?, ?, ?, ?)",
+                (key, kind, json.dumps(payload), time.time()),
+            )
+        self._wake.set()
+        return key
+
+    def add_many(self, kind, entries):
+        """Add ``[(key, payload), ...]`` in one local transaction."""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO outbox (key, kind, payload, created) VALUES (?, ?, ?, ?)",
+                    [(key, kind, json.dumps(payload), now) for key, payload in entries],
+                )
+        self._wake.set()
+        return [key for key, _ in entries]
+
+    def discard(self, keys):
+        """Drop pending entries whose writes were rolled back before they could be applied."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE key = ?", [(key,) for key in keys])
+
+    def drain(self, kind):
+        """Apply one batch of ``kind``; returns how many entries were applied."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, key, payload FROM outbox WHERE kind = ? ORDER BY seq LIMIT ?", (kind, self.batch_size)
+            ).fetchall()
+        if not rows:
+            return 0
+        seqs = [(seq,) for seq, _, _ in rows]
+        try:
+            self.handlers[kind]([(key, json.loads(payload)) for _, key, payload in rows])
+        except Exception as e:
+            with self._lock:
+                self._conn.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE seq = ?", seqs)
+            self._errors[kind] = str(e)
+            raise
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE seq = ?", seqs)
+        self._errors.pop(kind, None)
+        return len(rows)
+
+    def drain_all(self):
+        applied = 0
+        now = time.monotonic()
+        for kind in list(self.handlers):
+            if self._retry_at.get(kind, 0) > now:
+                continue
+            try:
+                applied += self.drain(kind)
+                self._backoff.pop(kind, None)
+            except Exception:
+                delay = min(self._backoff.get(kind, self.interval) * 2, OUTBOX_MAX_BACKOFF)
+                self._backoff[kind] = delay
+                self._retry_at[kind] = now + delay
+        return applied
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Keep draining while there is a backlog; otherwise sleep until an add or the next retry.
+            if not self.drain_all():
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="outbox-drainer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the drainer after one last pass; entries that still fail stay for the next start."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._retry_at.clear()
+        while self.drain_all():
+            pass
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, COUNT(*), MIN(created), MAX(attempts) FROM outbox GROUP BY kind"
+            ).fetchall()
+        now = time.time()
+        return {
+            kind: {
+                "pending": pending,
+                "oldest_seconds": round(now - oldest, 3),
+                "max_attempts": attempts,
+                "last_error": self._errors.get(kind),
+            }
+            for kind, pending, oldest, attempts in rows
+        }
+
+
+outbox = Outbox()
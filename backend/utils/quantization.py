@@ -0,0 +1,181 @@
+import base64
+import os
+
+import numpy as np
+
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+# Candidates kept from the compact search per requested result, before exact rescoring.
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "8"))
+PQ_SUBSPACES = int(os.getenv("PQ_SUBSPACES", "64"))
+PQ_CENTROIDS = 256
+PQ_TRAIN_ITERATIONS = 12
+SCORE_CHUNK_ROWS = 16384
+
+
+class Codec:
+    """Compact in-memory representation of a normalised float32 gallery.
+
+    ``scores`` returns approximate cosine similarities for a batch of
+    normalised queries; the index rescores the best candidates against the
+    exact float32 vectors afterwards.
+    """
+
+    name = None
+
+    def fit(self, vectors):
+        pass
+
+    def encode(self, vectors):
+        raise NotImplementedError
+
+    def scores(self, codes, queries):
+        raise NotImplementedError
+
+    def nbytes(self, codes):
+        return sum(array.nbytes for array in codes) if isinstance(codes, tuple) else codes.nbytes
+
+
+class Float16Codec(Codec):
+    name = "float16"
+
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=np.float16)
+
+    def scores(self, codes, queries):
+        # numpy has no fast float16 GEMM, so upcast cache-sized blocks at a time.
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+            block = codes[start:start + SCORE_CHUNK_ROWS].astype(np.float32)
+            out[:, start:start + len(block)] = queries @ block.T
+        return out
+
+
+class Int8Codec(Codec):
+    """Symmetric per-vector scalar quantisation: ``v ~= codes * scale``."""
+
+    name = "int8"
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def scores(self, codes, queries):
+        codes, scales = codes
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+            block = codes[start:start + SCORE_CHUNK_ROWS].astype(np.float32)
+            out[:, start:start + len(block)] = (queries @ block.T) * scales[start:start + len(block)]
+        return out
+
+
+class ProductQuantizer(Codec):
+    """Product quantisation with asymmetric distance computation.
+
+    Each vector is split into ``subspaces`` slices and each slice replaced by
+    the id of its nearest of 256 centroids, so a 512-d vector becomes
+    ``subspaces`` bytes. A query builds one lookup table per slice and scores
+    every code with table lookups and a sum.
+    """
+
+    name = "pq"
+
+    def __init__(self, subspaces=PQ_SUBSPACES, centroids=PQ_CENTROIDS, codebook=None):
+        self.subspaces = subspaces
+        self.centroids = centroids
+        self.codebook = codebook
+
+    def fit(self, vectors, iterations=PQ_TRAIN_ITERATIONS, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        dim = vectors.shape[1]
+        if dim % self.subspaces:
+            raise ValueError(f"Dimension {dim} is not divisible into {self.subspaces} subspaces")
+        sub_dim = dim // self.subspaces
+        k = min(self.centroids, len(vectors))
+        rng = np.random.default_rng(seed)
+        codebook = np.zeros((self.subspaces, self.centroids, sub_dim), dtype=np.float32)
+        for m in range(self.subspaces):
+            data = vectors[:, m * sub_dim:(m + 1) * sub_dim]
+            centers = data[rng.choice(len(data), size=k, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = _nearest(data, centers)
+                sums = np.zeros_like(centers)
+                np.add.at(sums, assignment, data)
+                counts = np.bincount(assignment, minlength=k)
+                occupied = counts > 0
+                centers[occupied] = sums[occupied] / counts[occupied, None]
+            codebook[m, :k] = centers
+            # With fewer vectors than centroids, spare slots repeat a real centroid.
+            codebook[m, k:] = centers[0]
+        self.codebook = codebook
+
+    def encode(self, vectors):
+        if self.codebook is None:
+            self.fit(vectors)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        sub_dim = self.codebook.shape[2]
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            codes[:, m] = _nearest(vectors[:, m * sub_dim:(m + 1) * sub_dim], self.codebook[m])
+        return codes
+
+    def scores(self, codes, queries):
+        sub_dim = self.codebook.shape[2]
+        out = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for q, query in enumerate(queries):
+            tables = np.einsum("md,mkd->mk", query.reshape(self.subspaces, sub_dim), self.codebook)
+            out[q] = tables[np.arange(self.subspaces), codes].sum(axis=1)
+        return out
+
+
+def _nearest(data, centers):
+    # ||x - c||^2 up to the per-row constant ||x||^2, which does not change the argmin.
+    distances = (centers ** 2).sum(axis=1)[None, :] - 2 * data @ centers.T
+    return distances.argmin(axis=1)
+
+
+CODECS = {
+    "float16": Float16Codec,
+    "int8": Int8Codec,
+    "pq": ProductQuantizer,
+}
+
+
+def get_codec(name=VECTOR_QUANTIZATION):
+    if name in (None, "", "none", "float32"):
+        return None
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown VECTOR_QUANTIZATION '{name}', expected none or one of {sorted(CODECS)}")
+
+
+def encode_wire(vector, dtype="float16"):
+    """Serialise an embedding compactly for transport: base64 of float16 or int8+scale bytes."""
+    vector = np.asarray(vector, dtype=np.float32)
+    if dtype == "float16":
+        payload = vector.astype("<f2").tobytes()
+    elif dtype == "int8":
+        scale = float(np.abs(vector).max() / 127.0) or 1.0
+        payload = np.float32(scale).astype("<f4").tobytes() + np.clip(np.rint(vector / scale), -127, 127).astype(np.int8).tobytes()
+    elif dtype == "float32":
+        payload = vector.astype("<f4").tobytes()
+    else:
+        raise ValueError(f"Unsupported wire dtype '{dtype}'")
+    return base64.b64encode(payload).decode()
+
+
+def decode_wire(data, dtype="float16"):
+    payload = base64.b64decode(data)
+    if dtype == "float16":
+        return np.frombuffer(payload, dtype="<f2").astype(np.float32)
+    if dtype == "int8":
+        scale = np.frombuffer(payload[:4], dtype="<f4")[0]
+        return np.frombuffer(payload[4:], dtype=np.int8).astype(np.float32) * scale
+    if dtype == "float32":
+        return np.frombuffer(payload, dtype="<f4").astype(np.float32)
+    raise ValueError(f"Unsupported wire dtype '{dtype}'")
@@ -0,0 +1,188 @@
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ..database import SessionLocal, User
+from .gallery import create_gallery, prepare_samples, sample_number, sample_owner
+from .vector_store import VECTOR_BACKEND
+
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "10000"))
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+
+def id_order(user_id):
+    return (len(user_id), user_id)
+
+
+def users_by_site():
+    """``{site: {user id: role}}`` for every user in the database."""
+    db = SessionLocal()
+    try:
+        users = defaultdict(dict)
+        for user_id, site, role in db.query(User.id, User.site, User.role):
+            users[site][str(user_id)] = role
+        return users
+    finally:
+        db.close()
+
+
+def verify_gallery(gallery, archive=None):
+    """Diff the ``users`` table against the index ids of every site.
+
+    ``missing_from_index`` are users who cannot be recognised (admins are
+    created without a face and are not expected in the index);
+    ``orphaned_in_index`` are index entries with no user behind them. With an
+    ``archive``, ``not_archived`` lists users a rebuild could not restore.
+    """
+    users = users_by_site()
+    archived = archive.user_ids() if archive is not None else None
+    sites = []
+    for site in sorted(set(users) | set(gallery.sites)):
+        known = users.get(site, {})
+        expected = {user_id for user_id, role in known.items() if role != "admin"}
+        indexed = set(gallery.ids(site=site))
+        entry = {
+            "site": site,
+            "users": len(expected),
+            "indexed": len(indexed),
+            "missing_from_index": sorted(expected - indexed, key=id_order),
+            "orphaned_in_index": sorted(indexed - set(known), key=id_order),
+        }
+        if archived is not None:
+            entry["not_archived"] = sorted(expected - archived, key=id_order)
+        sites.append(entry)
+    consistent = not any(entry["missing_from_index"] or entry["orphaned_in_index"] for entry in sites)
+    return {"consistent": consistent, "sites": sites}
+
+
+def export_archive(gallery, archive):
+    """Copy the samples of users not yet archived from the index into ``archive``.
+
+    For galleries enrolled before the archive existed; the vectors are assumed
+    to come from the archive's model.
+    """
+    archived = archive.user_ids()
+    exported = 0
+    for site in sorted(gallery.sites):
+        samples = gallery.shard(site).samples
+        ids = sorted(
+            (vector_id for vector_id in samples.ids() if sample_owner(vector_id) not in archived),
+            key=lambda vector_id: (sample_owner(vector_id), sample_number(vector_id)),
+        )
+        vectors = samples.fetch(ids)
+        archive.append([(sample_owner(vector_id), vectors[vector_id]) for vector_id in ids if vector_id in vectors], site)
+        exported += len(ids)
+    return exported
+
+
+def _archived_rows(records, users):
+    """Group archive rows by each user's current site, dropping deleted users and repeated vectors."""
+    site_of = {user_id: site for site, known in users.items() for user_id in known}
+    rows, seen, archived, skipped = defaultdict(list), set(), set(), 0
+    for i, (user_id, vector) in enumerate(zip(records["user_id"], records["vector"])):
+        user_id = str(user_id)
+        site = site_of.get(user_id)
+        if site is None:
+            skipped += 1
+            continue
+        # A retried enrollment can archive the same vector twice.
+        key = (user_id, hash(vector.tobytes()))
+        if key in seen:
+            continue
+        seen.add(key)
+        archived.add(user_id)
+        rows[site].append(i)
+    return rows, archived, skipped
+
+
+def _user_chunks(records, rows, batch_size):
+    """Split a site's rows into chunks of about ``batch_size`` vectors without splitting a user."""
+    by_user = defaultdict(list)
+    for i, user_id in zip(rows, records["user_id"][np.asarray(rows, dtype=np.int64)]):
+        by_user[str(user_id)].append(i)
+    chunks, chunk, size = [], [], 0
+    for user_id, indexes in by_user.items():
+        chunk.append((user_id, indexes))
+        size += len(indexes)
+        if size >= batch_size:
+            chunks.append(chunk)
+            chunk, size = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _prepare_chunk(gallery, records, chunk):
+    start = time.perf_counter()
+    # Archive order is enrollment order, so each user's first row becomes their sample 0 again.
+    samples, prototypes = prepare_samples(
+        [(user_id, records["vector"][np.asarray(indexes)]) for user_id, indexes in chunk], gallery.max_samples
+    )
+    return samples, prototypes, time.perf_counter() - start
+
+
+def _rebuild_site(gallery, site, prepared, vectors):
+    start = time.perf_counter()
+    gallery.clear()
+    gallery.bulk_insert(
+        [row for samples, _, _ in prepared for row in samples],
+        [row for _, prototypes, _ in prepared for row in prototypes],
+    )
+    gallery.save()
+    # The site's chunks shared the pool with other sites, so its time is the sum of its own work.
+    seconds = time.perf_counter() - start + sum(elapsed for _, _, elapsed in prepared)
+    return {
+        "site": site,
+        "users": len(gallery.ids()),
+        "vectors": vectors,
+        "seconds": round(seconds, 3),
+        "vectors_per_second": round(vectors / seconds, 1) if seconds else None,
+    }
+
+
+def rebuild_gallery(
+    archive, backend=VECTOR_BACKEND, sites=None, model=None, workers=REINDEX_WORKERS, batch_size=REINDEX_BATCH_SIZE, force=False
+):
+    """Replace the index of each site with the archived embeddings of its current users.
+
+    Each site's users are split into chunks of about ``batch_size`` vectors,
+    and the chunks of every site are prepared in parallel. Each site is then
+    written with one bulk insert per store.
+    ``backend`` may differ from the one in use, which migrates the gallery.
+    Raises ValueError, before anything is changed, if users now in the index
+    have nothing archived and would be dropped, unless ``force`` is set.
+    """
+    start = time.perf_counter()
+    users = users_by_site()
+    records = archive.load(model)
+    rows, archived, skipped = _archived_rows(records, users)
+    galleries = {site: create_gallery(backend, site) for site in sorted(sites or set(users) | set(rows))}
+    lost = sum(
+        1 for site, gallery in galleries.items() for user_id in gallery.ids()
+        if user_id in users.get(site, {}) and user_id not in archived
+    )
+    if lost and not force:
+        raise ValueError(f"{lost} indexed users have no archived embedding and would be dropped; export them to the archive first")
+    chunks = [(site, chunk) for site in galleries for chunk in _user_chunks(records, rows.get(site, []), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        prepared = defaultdict(list)
+        for (site, _), result in zip(chunks, pool.map(lambda item: _prepare_chunk(galleries[item[0]], records, item[1]), chunks)):
+            prepared[site].append(result)
+        reports = list(pool.map(
+            lambda site: _rebuild_site(galleries[site], site, prepared[site], len(rows.get(site, []))), galleries
+        ))
+    seconds = time.perf_counter() - start
+    vectors = sum(report["vectors"] for report in reports)
+    return {
+        "backend": backend,
+        "model": model or archive.model,
+        "sites": reports,
+        "vectors": vectors,
+        "dropped_users": lost,
+        "skipped_rows_of_deleted_users": skipped,
+        "seconds": round(seconds, 3),
+        "vectors_per_second": round(vectors / seconds, 1) if seconds else None,
+    }
@@ -0,0 +1,138 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ..database import DEFAULT_SITE, SessionLocal, User
+from .gallery import create_gallery
+from .vector_store import VECTOR_BACKEND
+
+ALL_SITES = "*"
+# Shards kept in memory at once; the least recently used one is flushed and dropped beyond this.
+MAX_LOADED_SHARDS = int(os.getenv("MAX_LOADED_SHARDS", "16"))
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))
+SITE_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def validate_site(site):
+    if site != ALL_SITES and not SITE_PATTERN.match(site):
+        raise ValueError(f"Invalid site '{site}': use 1-64 letters, digits, '-' or '_'")
+    return site
+
+
+class ShardedGallery:
+    """One gallery per site, loaded on first use and evicted least-recently-used.
+
+    A query searches only the caller's site, so its cost follows the size of
+    that site. ``site="*"`` fans the query out over every known site in
+    parallel and merges the per-shard top-k. Matches carry the ``site`` they
+    came from. User ids are global, so a user lives in exactly one shard.
+
+    With an ``archive``, enrolled vectors (``upsert`` and ``add_samples``, not
+    promotions) are also appended to it so the shards can be rebuilt.
+    """
+
+    def __init__(self, backend=VECTOR_BACKEND, sites=(), max_loaded=MAX_LOADED_SHARDS, workers=SHARD_SEARCH_WORKERS, archive=None):
+        self.backend = backend
+        self.archive = archive
+        self.max_loaded = max_loaded
+        self.sites = set(sites) | {DEFAULT_SITE}
+        self._shards = OrderedDict()
+        self._lock = threading.RLock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard-search")
+
+    def shard(self, site=DEFAULT_SITE):
+        if validate_site(site) == ALL_SITES:
+            raise ValueError("A single site is required here")
+        with self._lock:
+            gallery = self._shards.get(site)
+            if gallery is not None:
+                self._shards.move_to_end(site)
+                return gallery
+        # Loading can take a while for a large site, so it happens outside the lock.
+        gallery = create_gallery(self.backend, site)
+        with self._lock:
+            gallery = self._shards.setdefault(site, gallery)
+            self._shards.move_to_end(site)
+            self.sites.add(site)
+            while len(self._shards) > self.max_loaded:
+                _, evicted = self._shards.popitem(last=False)
+                evicted.flush()
+            return gallery
+
+    def loaded(self):
+        with self._lock:
+            return list(self._shards)
+
+    def evict(self, site):
+        with self._lock:
+            gallery = self._shards.pop(site, None)
+        if gallery is not None:
+            gallery.flush()
+
+    def _search(self, site, vectors, top_k):
+        return [
+            {"matches": [{**match, "site": site} for match in result["matches"]]}
+            for result in self.shard(site).query_batch(vectors, top_k=top_k)
+        ]
+
+    def query_batch(self, vectors, top_k=10, site=DEFAULT_SITE):
+        if site != ALL_SITES:
+            return self._search(site, vectors, top_k)
+        with self._lock:
+            sites = sorted(self.sites)
+        per_site = list(self._pool.map(lambda s: self._search(s, vectors, top_k), sites))
+        merged = []
+        for row in zip(*per_site):
+            matches = [match for result in row for match in result["matches"]]
+            merged.append({"matches": sorted(matches, key=lambda match: match["score"], reverse=True)[:top_k]})
+        return merged
+
+    def query(self, vector, top_k=10, site=DEFAULT_SITE):
+        return self.query_batch([vector], top_k=top_k, site=site)[0]
+
+    def upsert(self, vectors, site=DEFAULT_SITE):
+        shard = self.shard(site)
+        if self.archive is not None:
+            self.archive.append(vectors, site)
+        shard.upsert(vectors)
+
+    def add_samples(self, user_id, vectors, site=DEFAULT_SITE):
+        shard = self.shard(site)
+        if self.archive is not None:
+            self.archive.append([(user_id, vector) for vector in vectors], site)
+        shard.add_samples(user_id, vectors)
+
+    def sample_count(self, user_id, site=DEFAULT_SITE):
+        return self.shard(site).sample_count(user_id)
+
+    def promote(self, user_id, vector, score, site=DEFAULT_SITE):
+        self.shard(site).promote(user_id, vector, score)
+
+    def delete(self, ids, site=DEFAULT_SITE):
+        self.shard(site).delete(ids)
+
+    def fetch(self, ids, site=DEFAULT_SITE):
+        return self.shard(site).fetch(ids)
+
+    def ids(self, site=DEFAULT_SITE):
+        return self.shard(site).ids()
+
+    def flush(self):
+        with self._lock:
+            shards = list(self._shards.values())
+        for gallery in shards:
+            gallery.flush()
+
+
+def known_sites():
+    db = SessionLocal()
+    try:
+        return {site for (site,) in db.query(User.site).distinct()}
+    finally:
+        db.close()
+
+
+def create_sharded_gallery(backend=VECTOR_BACKEND, archive=None):
+    return ShardedGallery(backend, sites=known_sites(), archive=archive)
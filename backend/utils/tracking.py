@@ -0,0 +1,100 @@
+import itertools
+import os
+
+import cv2
+import numpy as np
+
+STREAM_MIN_FACE_SIZE = int(os.getenv("STREAM_MIN_FACE_SIZE", "80"))
+STREAM_MIN_SHARPNESS = float(os.getenv("STREAM_MIN_SHARPNESS", "60"))
+STREAM_MIN_SYMMETRY = float(os.getenv("STREAM_MIN_SYMMETRY", "0.45"))
+TRACK_IOU_THRESHOLD = 0.3
+TRACK_MAX_AGE = int(os.getenv("TRACK_MAX_AGE", "30"))
+TRACK_MAX_ATTEMPTS = int(os.getenv("TRACK_MAX_ATTEMPTS", "3"))
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def face_quality(face):
+    """Return ``(passed, metrics)`` for an RGB face crop.
+
+    Checks size, sharpness (variance of the Laplacian) and a cheap frontal-pose
+    proxy: how well the left half of the face mirrors the right half.
+    """
+    height, width = face.shape[:2]
+    gray = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    half = width // 2
+    left = gray[:, :half].astype(np.float32)
+    right = cv2.flip(gray[:, width - half:], 1).astype(np.float32)
+    symmetry = float(np.corrcoef(left.ravel(), right.ravel())[0, 1]) if half > 1 else 0.0
+    metrics = {"size": min(height, width), "sharpness": sharpness, "symmetry": symmetry}
+    passed = (
+        metrics["size"] >= STREAM_MIN_FACE_SIZE
+        and sharpness >= STREAM_MIN_SHARPNESS
+        and symmetry >= STREAM_MIN_SYMMETRY
+    )
+    return passed, metrics
+
+
+class Track:
+    def __init__(self, track_id, box, frame_index):
+        self.track_id = track_id
+        self.box = box
+        self.last_seen = frame_index
+        self.attempts = 0
+        self.identified = False
+        self.user_id = None
+
+    @property
+    def wants_embedding(self):
+        return not self.identified and self.attempts < TRACK_MAX_ATTEMPTS
+
+
+class IoUTracker:
+    """Associates face boxes across sampled frames by overlap.
+
+    A person walking towards the camera keeps the same track between
+    detections, so they are embedded once instead of on every frame.
+    """
+
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_age=TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks = {}
+        self._ids = itertools.count(1)
+
+    def update(self, boxes, frame_index):
+        unmatched = dict(self.tracks)
+        updated = []
+        pairs = sorted(
+            ((iou(track.box, box), track_id, i) for track_id, track in self.tracks.items() for i, box in enumerate(boxes)),
+            reverse=True,
+        )
+        assigned = set()
+        for overlap, track_id, i in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if track_id not in unmatched or i in assigned:
+                continue
+            track = unmatched.pop(track_id)
+            track.box = boxes[i]
+            track.last_seen = frame_index
+            assigned.add(i)
+            updated.append(track)
+        for i, box in enumerate(boxes):
+            if i not in assigned:
+                track = Track(next(self._ids), box, frame_index)
+                self.tracks[track.track_id] = track
+                updated.append(track)
+        for track_id, track in unmatched.items():
+            if frame_index - track.last_seen > self.max_age:
+                del self.tracks[track_id]
+        return updated
@@ -0,0 +1,539 @@
+import base64
+import json
+import os
+import threading
+
+import numpy as np
+
+from .quantization import VECTOR_QUANTIZATION, RESCORE_FACTOR, get_codec
+
+EMBEDDING_DIM = 512
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "numpy")
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", os.path.join("vector_index", "face-recognition"))
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "face-recognition")
+# NumpyIndex folds its journal into a fresh .npy once dead plus appended rows reach this share of the gallery.
+NUMPY_COMPACT_RATIO = float(os.getenv("NUMPY_COMPACT_RATIO", "0.25"))
+NUMPY_COMPACT_MIN_ROWS = int(os.getenv("NUMPY_COMPACT_MIN_ROWS", "1024"))
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorStore:
+    """Minimal index interface shared by every backend.
+
+    ``query`` returns the same shape as a Pinecone query response,
+    ``{"matches": [{"id": ..., "score": ...}, ...]}``, with cosine similarity
+    as the score, so callers do not care which backend is behind it.
+    """
+
+    def query(self, vector, top_k=10):
+        raise NotImplementedError
+
+    def query_batch(self, vectors, top_k=10):
+        return [self.query(vector, top_k=top_k) for vector in vectors]
+
+    def upsert(self, vectors):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def fetch(self, ids):
+        """Return ``{id: vector}`` for the ids that exist in the index."""
+        raise NotImplementedError
+
+    def ids(self):
+        raise NotImplementedError
+
+    def save(self):
+        pass
+
+    def flush(self):
+        """Persist writes the backend buffers in memory; a no-op for backends that write through."""
+
+
+class RowBuffer:
+    """Rows appended in place into a preallocated array that doubles when full."""
+
+    def __init__(self, shape, dtype):
+        self.data = np.empty((16,) + tuple(shape), dtype=dtype)
+        self.size = 0
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=self.data.dtype)
+        needed = self.size + len(rows)
+        if needed > len(self.data):
+            grown = np.empty((max(needed, 2 * len(self.data)),) + self.data.shape[1:], dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = rows
+        self.size = needed
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class NumpyIndex(VectorStore):
+    """Cosine index over a dense float32 matrix.
+
+    Vectors are kept L2-normalised so a query is a single mat-vec product.
+    The matrix is persisted as ``<path>.npy`` next to ``<path>.ids.json`` and
+    memory-mapped on load, so startup cost does not grow with the gallery.
+
+    Writes never rewrite that file. New rows go into an in-memory tail that
+    grows by doubling and are appended to ``<path>.journal``; a replaced or
+    deleted row is only marked dead. Once dead and tail rows reach
+    NUMPY_COMPACT_RATIO of the gallery, ``compact`` folds everything into a
+    fresh ``.npy`` and truncates the journal, so a write costs O(rows
+    written) amortised.
+
+    With ``quantization`` set (float16, int8 or pq) the scan runs over a
+    compact in-memory copy instead, and only the best ``top_k * RESCORE_FACTOR``
+    candidates are rescored exactly against the float32 rows. Only written
+    rows are encoded; the PQ codebook is fitted once and refitted only by an
+    explicit ``retrain_codebook``.
+    """
+
+    def __init__(self, path=VECTOR_INDEX_PATH, dim=EMBEDDING_DIM, quantization=VECTOR_QUANTIZATION):
+        self.path = path
+        self.dim = dim
+        self.codec = get_codec(quantization)
+        self._lock = threading.RLock()
+        self._reset(np.empty((0, dim), dtype=np.float32), [])
+        self.load()
+
+    @property
+    def _vectors_file(self):
+        return f"{self.path}.npy"
+
+    @property
+    def _ids_file(self):
+        return f"{self.path}.ids.json"
+
+    @property
+    def _journal_file(self):
+        return f"{self.path}.journal"
+
+    @property
+    def _codebook_file(self):
+        return f"{self.path}.pq.npz"
+
+    def _reset(self, base, ids):
+        self._base = base
+        self._tail = RowBuffer((self.dim,), np.float32)
+        self._ids = list(ids)
+        self._positions = {vector_id: i for i, vector_id in enumerate(self._ids)}
+        self._alive = RowBuffer((), bool)
+        self._alive.append(np.ones(len(self._ids), dtype=bool))
+        self._dead = 0
+        self._codes = None
+
+    def load(self):
+        with self._lock:
+            if os.path.exists(self._vectors_file) and os.path.exists(self._ids_file):
+                with open(self._ids_file) as f:
+                    ids = json.load(f)
+                vectors = self._map()
+                if vectors.shape != (len(ids), self.dim):
+                    raise ValueError(f"Corrupt vector index at {self.path}: {vectors.shape} for {len(ids)} ids")
+                self._reset(vectors, ids)
+            self._replay()
+            if self.codec is not None and len(self._positions):
+                self._ensure_codebook()
+                self._encode_all()
+
+    def _replay(self):
+        if not os.path.exists(self._journal_file):
+            return
+        good = 0
+        with open(self._journal_file, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if "put" in entry:
+                    rows = np.frombuffer(base64.b64decode(entry["rows"]), dtype=np.float32).reshape(-1, self.dim)
+                    self._put(entry["put"], rows)
+                else:
+                    self._remove(entry["delete"])
+                good += len(line)
+        # Drop a line torn by a crash mid-write so later appends start on a clean line.
+        if good != os.path.getsize(self._journal_file):
+            with open(self._journal_file, "r+b") as f:
+                f.truncate(good)
+
+    def _journal(self, entry):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self._journal_file, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _encode(self, rows):
+        codes = self.codec.encode(rows)
+        return codes if isinstance(codes, tuple) else (codes,)
+
+    def _encode_all(self):
+        self._codes = tuple(RowBuffer(array.shape[1:], array.dtype) for array in self._encode(self._tail.view()[:0]))
+        self._append_codes(self._base)
+        self._append_codes(self._tail.view())
+
+    def _append_codes(self, rows):
+        if self._codes is not None and len(rows):
+            for buffer, array in zip(self._codes, self._encode(rows)):
+                buffer.append(array)
+
+    def _code_view(self):
+        if self._codes is None:
+            return None
+        views = tuple(buffer.view() for buffer in self._codes)
+        return views if len(views) > 1 else views[0]
+
+    def _put(self, ids, rows):
+        start = len(self._ids)
+        self._ids.extend(ids)
+        self._tail.append(rows)
+        self._alive.append(np.ones(len(ids), dtype=bool))
+        for offset, vector_id in enumerate(ids):
+            self._kill(self._positions.get(vector_id))
+            self._positions[vector_id] = start + offset
+
+    def _remove(self, ids):
+        for vector_id in ids:
+            self._kill(self._positions.pop(vector_id, None))
+
+    def _kill(self, row):
+        if row is not None:
+            self._alive.data[row] = False
+            self._ids[row] = None
+            self._dead += 1
+
+    def _rows(self, rows, base, tail):
+        rows = np.asarray(rows)
+        out = np.empty(rows.shape + (self.dim,), dtype=np.float32)
+        in_base = rows < len(base)
+        out[in_base] = base[rows[in_base]]
+        out[~in_base] = tail[rows[~in_base] - len(base)]
+        return out
+
+    def save(self):
+        self.compact()
+
+    def compact(self):
+        """Rewrite the live rows as a fresh ``.npy`` and drop the journal."""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            alive = self._alive.view()
+            live = np.flatnonzero(alive)
+            vectors = self._rows(live, self._base, self._tail.view())
+            ids = [self._ids[row] for row in live]
+            tmp_vectors = f"{self.path}.tmp.npy"
+            tmp_ids = f"{self.path}.ids.json.tmp"
+            np.save(tmp_vectors, vectors)
+            with open(tmp_ids, "w") as f:
+                json.dump(ids, f)
+            os.replace(tmp_vectors, self._vectors_file)
+            os.replace(tmp_ids, self._ids_file)
+            if os.path.exists(self._journal_file):
+                os.remove(self._journal_file)
+            codes = None if self._codes is None else [buffer.view()[live] for buffer in self._codes]
+            # Re-map the file we just wrote instead of holding a second copy in memory.
+            self._reset(self._map(), ids)
+            if codes is not None:
+                self._codes = tuple(RowBuffer(array.shape[1:], array.dtype) for array in codes)
+                for buffer, array in zip(self._codes, codes):
+                    buffer.append(array)
+
+    def _maybe_compact(self):
+        garbage = self._dead + self._tail.size
+        if garbage >= max(NUMPY_COMPACT_MIN_ROWS, NUMPY_COMPACT_RATIO * len(self._positions)):
+            self.compact()
+
+    def _ensure_codebook(self):
+        if self.codec.name != "pq" or self.codec.codebook is not None:
+            return
+        if os.path.exists(self._codebook_file):
+            self.codec.codebook = np.load(self._codebook_file)["codebook"]
+        else:
+            # First use only; afterwards the codebook changes through retrain_codebook alone.
+            self.retrain_codebook(encode=False)
+
+    def retrain_codebook(self, sample_size=50_000, encode=True):
+        """Refit the PQ codebook on the live rows and re-encode them; an offline step, not run on writes."""
+        if self.codec is None or self.codec.name != "pq":
+            return
+        with self._lock:
+            live = np.flatnonzero(self._alive.view())
+            if len(live) > sample_size:
+                live = np.sort(np.random.default_rng(0).choice(live, sample_size, replace=False))
+            self.codec.fit(self._rows(live, self._base, self._tail.view()))
+            if self.codec.codebook is not None:
+                np.savez(self._codebook_file, codebook=self.codec.codebook, trained_on=len(live))
+            if encode and len(self._ids):
+                self._encode_all()
+
+    def memory_bytes(self):
+        """Bytes scanned per query: the compact codes if quantised, else the float32 rows."""
+        with self._lock:
+            codes = self._code_view()
+            if codes is not None:
+                return self.codec.nbytes(codes)
+            return self._base.nbytes + self._tail.view().nbytes
+
+    def _map(self):
+        try:
+            return np.load(self._vectors_file, mmap_mode="r")
+        except ValueError:
+            # mmap cannot map a zero-length payload, so an empty gallery is loaded eagerly.
+            return np.load(self._vectors_file)
+
+    def query(self, vector, top_k=10):
+        return self.query_batch([vector], top_k=top_k)[0]
+
+    def query_batch(self, vectors, top_k=10):
+        queries = normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            base, tail, alive, ids, codes = self._base, self._tail.view(), self._alive.view(), self._ids, self._code_view()
+            live = len(self._positions)
+        if live == 0:
+            return [{"matches": []} for _ in range(len(queries))]
+        k = min(top_k, live)
+        if codes is None:
+            scores = np.hstack([queries @ base.T, queries @ tail.T])
+            scores[:, ~alive] = -np.inf
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        else:
+            approx = self.codec.scores(codes, queries)
+            approx[:, ~alive] = -np.inf
+            n = min(len(alive), k * RESCORE_FACTOR)
+            candidates = np.argpartition(-approx, n - 1, axis=1)[:, :n]
+            # Exact rescoring only touches the candidate rows of the float32 data.
+            candidate_scores = np.einsum("qd,qnd->qn", queries, self._rows(candidates, base, tail))
+        results = []
+        for row_ids, row_scores in zip(candidates, candidate_scores):
+            matches = []
+            for i in np.argsort(-row_scores):
+                vector_id = ids[row_ids[i]]
+                if alive[row_ids[i]] and vector_id is not None:
+                    matches.append({"id": vector_id, "score": float(row_scores[i])})
+                    if len(matches) == k:
+                        break
+            results.append({"matches": matches})
+        return results
+
+    def upsert(self, vectors):
+        vectors = list(vectors)
+        if not vectors:
+            return
+        ids = [vector_id for vector_id, _ in vectors]
+        rows = normalize(np.stack([np.asarray(values, dtype=np.float32).reshape(self.dim) for _, values in vectors]))
+        with self._lock:
+            self._journal({"put": ids, "rows": base64.b64encode(rows.tobytes()).decode()})
+            self._put(ids, rows)
+            if self.codec is not None:
+                if self._codes is None:
+                    self._ensure_codebook()
+                    self._encode_all()
+                else:
+                    self._append_codes(rows)
+            self._maybe_compact()
+
+    def delete(self, ids):
+        with self._lock:
+            ids = [vector_id for vector_id in ids if vector_id in self._positions]
+            if not ids:
+                return
+            self._journal({"delete": ids})
+            self._remove(ids)
+            self._maybe_compact()
+
+    def fetch(self, ids):
+        with self._lock:
+            found = [vector_id for vector_id in ids if vector_id in self._positions]
+            if not found:
+                return {}
+            rows = self._rows([self._positions[vector_id] for vector_id in found], self._base, self._tail.view())
+        return dict(zip(found, rows))
+
+    def ids(self):
+        with self._lock:
+            return list(self._positions)
+
+
+class HNSWIndex(VectorStore):
+    """Approximate cosine index backed by hnswlib (optional dependency)."""
+
+    def __init__(self, path=VECTOR_INDEX_PATH, dim=EMBEDDING_DIM, max_elements=100_000, ef=64, m=16):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("VECTOR_BACKEND=hnsw requires the 'hnswlib' package") from e
+        self.path = path
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._labels = {}
+        self._ids = {}
+        self._index = hnswlib.Index(space="cosine", dim=dim)
+        if os.path.exists(self._index_file) and os.path.exists(self._ids_file):
+            self._index.load_index(self._index_file, max_elements=max_elements, allow_replace_deleted=True)
+            with open(self._ids_file) as f:
+                self._labels = {vector_id: int(label) for vector_id, label in json.load(f).items()}
+        else:
+            self._index.init_index(max_elements=max_elements, ef_construction=200, M=m, allow_replace_deleted=True)
+        self._ids = {label: vector_id for vector_id, label in self._labels.items()}
+        self._next_label = max(self._ids, default=-1) + 1
+        self._index.set_ef(ef)
+        # hnswlib can only write the whole graph, so writes are saved by ``flush`` rather than one by one.
+        self._dirty = False
+
+    @property
+    def _index_file(self):
+        return f"{self.path}.hnsw"
+
+    @property
+    def _ids_file(self):
+        return f"{self.path}.hnsw.ids.json"
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._index.save_index(self._index_file)
+            with open(self._ids_file, "w") as f:
+                json.dump(self._labels, f)
+            self._dirty = False
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self.save()
+
+    def query(self, vector, top_k=10):
+        with self._lock:
+            count = len(self._labels)
+            if count == 0:
+                return {"matches": []}
+            labels, distances = self._index.knn_query(normalize(vector), k=min(top_k, count))
+        return {"matches": [
+            {"id": self._ids[int(label)], "score": float(1.0 - distance)}
+            for label, distance in zip(labels[0], distances[0])
+        ]}
+
+    def query_batch(self, vectors, top_k=10):
+        with self._lock:
+            count = len(self._labels)
+            if count == 0:
+                return [{"matches": []} for _ in range(len(vectors))]
+            labels, distances = self._index.knn_query(normalize(vectors), k=min(top_k, count))
+        return [
+            {"matches": [{"id": self._ids[int(label)], "score": float(1.0 - distance)} for label, distance in zip(row_labels, row_distances)]}
+            for row_labels, row_distances in zip(labels, distances)
+        ]
+
+    def upsert(self, vectors):
+        # Later entries for the same id win, as they would written one at a time.
+        latest = {vector_id: values for vector_id, values in vectors}
+        if not latest:
+            return
+        with self._lock:
+            for vector_id in latest:
+                label = self._labels.get(vector_id)
+                if label is not None:
+                    self._index.mark_deleted(label)
+                    self._ids.pop(label, None)
+            labels = list(range(self._next_label, self._next_label + len(latest)))
+            self._next_label += len(latest)
+            needed = self._index.get_current_count() + len(latest)
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(max(needed, self._index.get_max_elements() * 2))
+            # One call, so hnswlib inserts the batch on all its threads.
+            self._index.add_items(normalize(np.stack(list(latest.values()))), labels, replace_deleted=True)
+            for vector_id, label in zip(latest, labels):
+                self._labels[vector_id] = label
+                self._ids[label] = vector_id
+            self._dirty = True
+
+    def delete(self, ids):
+        with self._lock:
+            for vector_id in ids:
+                label = self._labels.pop(vector_id, None)
+                if label is not None:
+                    self._index.mark_deleted(label)
+                    self._ids.pop(label, None)
+                    self._dirty = True
+
+    def fetch(self, ids):
+        with self._lock:
+            found = [vector_id for vector_id in ids if vector_id in self._labels]
+            if not found:
+                return {}
+            vectors = self._index.get_items([self._labels[vector_id] for vector_id in found])
+        return {vector_id: normalize(vector) for vector_id, vector in zip(found, vectors)}
+
+    def ids(self):
+        with self._lock:
+            return list(self._labels)
+
+
+class PineconeIndex(VectorStore):
+    """Adapter over a remote Pinecone index."""
+
+    def __init__(self, index_name=PINECONE_INDEX_NAME, api_key=PINECONE_API_KEY, namespace=""):
+        if not api_key:
+            raise ValueError("VECTOR_BACKEND=pinecone requires the PINECONE_API_KEY environment variable")
+        from pinecone import Pinecone
+
+        self._index = Pinecone(api_key=api_key).Index(index_name)
+        self.namespace = namespace
+
+    def query(self, vector, top_k=10):
+        results = self._index.query(vector=np.asarray(vector, dtype=np.float32).tolist(), top_k=top_k, namespace=self.namespace)
+        return {"matches": [{"id": m["id"], "score": m["score"]} for m in results.get("matches", [])]}
+
+    def upsert(self, vectors):
+        self._index.upsert(
+            vectors=[(vector_id, np.asarray(values, dtype=np.float32).tolist()) for vector_id, values in vectors],
+            namespace=self.namespace,
+        )
+
+    def delete(self, ids):
+        self._index.delete(ids=list(ids), namespace=self.namespace)
+
+    def fetch(self, ids):
+        vectors = self._index.fetch(ids=list(ids), namespace=self.namespace).vectors
+        return {vector_id: normalize(vector.values) for vector_id, vector in vectors.items()}
+
+    def ids(self):
+        return [vector_id for page in self._index.list(namespace=self.namespace) for vector_id in page]
+
+
+VECTOR_BACKENDS = {
+    "numpy": NumpyIndex,
+    "hnsw": HNSWIndex,
+    "pinecone": PineconeIndex,
+}
+
+
+def get_vector_store(backend=VECTOR_BACKEND, collection=None):
+    """Open the configured store; ``collection`` selects a separate set of vectors in the same backend."""
+    try:
+        store_cls = VECTOR_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown VECTOR_BACKEND '{backend}', expected one of {sorted(VECTOR_BACKENDS)}")
+    if collection is None:
+        return store_cls()
+    if backend == "pinecone":
+        return store_cls(namespace=collection)
+    return store_cls(path=f"{VECTOR_INDEX_PATH}-{collection}")
@@ -2,13 +2,23 @@ import streamlit as st
 import requests
 import cv2
 import io
+import os
+import base64
 import logging
+import numpy as np
 from PIL import Image
 from datetime import datetime, timedelta
 
 logging.basicConfig(level=logging.INFO)
 
-BACKEND_URL = "http://localhost:8000"
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+KIOSK_CROP_SIZE = 224
+KIOSK_CROP_PADDING = 0.2
+KIOSK_DETECT_MAX_SIDE = 480
+# Frames the camera may still hold from before the click; they are discarded before the capture.
+CAMERA_STALE_FRAMES = 4
+EMBEDDING_MODEL = "Facenet512"
+EMBEDDING_DETECTOR = os.getenv("EMBEDDING_DETECTOR", "opencv")
 
 st.title("Face Recognition System")
 
@@ -20,12 +30,50 @@ if 'access_token' not in st.session_state:
     st.session_state.access_token = None
 if 'role' not in st.session_state:
     st.session_state.role = None
+if 'refresh_token' not in st.session_state:
+    st.session_state.refresh_token = None
+
+@st.cache_resource
+def http_session():
+    """One keep-alive connection pool shared by every request this app makes."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def camera():
+    # Opened once and kept open across reruns; reopening a webcam costs far more than a frame grab.
+    cap = cv2.VideoCapture(0)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+@st.cache_resource
+def face_detector():
+    return cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+@st.cache_resource
+def embedding_model():
+    try:
+        from deepface import DeepFace
+    except ImportError:
+        return None
+    # Built once here; DeepFace.represent then reuses its cached copy.
+    DeepFace.build_model(EMBEDDING_MODEL)
+    return DeepFace
 
 def capture_image():
     try:
-        cap = cv2.VideoCapture(0)
+        cap = camera()
+        if not cap.isOpened():
+            cap.open(0)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # The open camera keeps buffering while the kiosk is idle, and not every backend honours
+        # BUFFERSIZE; drain it so the capture shows whoever is in front of it now, not the last person.
+        for _ in range(CAMERA_STALE_FRAMES):
+            cap.grab()
         ret, frame = cap.read()
-        cap.release()
         if ret:
             return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         else:
@@ -49,6 +97,46 @@ def image_to_file(image):
         logging.error(f"Failed to encode image: {str(e)}")
         return None
 
+def crop_face(image):
+    """Largest face in an RGB frame, padded and scaled so its longest side is KIOSK_CROP_SIZE."""
+    height, width = image.shape[:2]
+    scale = min(1.0, KIOSK_DETECT_MAX_SIDE / max(height, width))
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    faces = face_detector().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+    if len(faces) == 0:
+        return None
+    x, y, w, h = (int(v / scale) for v in max(faces, key=lambda f: f[2] * f[3]))
+    pad_w, pad_h = int(w * KIOSK_CROP_PADDING), int(h * KIOSK_CROP_PADDING)
+    face = image[max(0, y - pad_h):min(height, y + h + pad_h), max(0, x - pad_w):min(width, x + w + pad_w)]
+    factor = KIOSK_CROP_SIZE / max(face.shape[:2])
+    return cv2.resize(face, (max(1, int(face.shape[1] * factor)), max(1, int(face.shape[0] * factor))), interpolation=cv2.INTER_AREA)
+
+def local_embedding(face):
+    """Embed a face crop through the same DeepFace call as the backend, as base64 float16."""
+    DeepFace = embedding_model()
+    result = DeepFace.represent(img_path=face, model_name=EMBEDDING_MODEL, detector_backend=EMBEDDING_DETECTOR, align=True)
+    embedding = np.asarray(result[0]["embedding"], dtype=np.float32)
+    return base64.b64encode(embedding.astype("<f2").tobytes()).decode()
+
+def store_tokens(tokens):
+    st.session_state.access_token = tokens['access_token']
+    st.session_state.refresh_token = tokens.get('refresh_token')
+    st.session_state.role = tokens.get('role', st.session_state.role)
+
+def admin_get(path, **kwargs):
+    """GET an admin endpoint, renewing an expired access token once via the refresh token."""
+    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
+    response = http_session().get(f"{BACKEND_URL}{path}", headers=headers, **kwargs)
+    if response.status_code == 401 and st.session_state.refresh_token:
+        refreshed = http_session().post(f"{BACKEND_URL}/token/refresh", json={"refresh_token": st.session_state.refresh_token})
+        if refreshed.status_code == 200:
+            store_tokens(refreshed.json())
+            headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
+            response = http_session().get(f"{BACKEND_URL}{path}", headers=headers, **kwargs)
+    return response
+
 def login():
     st.subheader("Login")
     username = st.text_input("Username", key="login_username")
@@ -57,12 +145,10 @@ def login():
     if st.button("Login"):
         if username and password:
             with st.spinner("Logging in..."):
-                response = requests.post(f"{BACKEND_URL}/login", data={"username": username, "password": password})
+                response = http_session().post(f"{BACKEND_URL}/login", data={"username": username, "password": password})
                 if response.status_code == 200:
-                    result = response.json()
-                    st.session_state.access_token = result['access_token']
+                    store_tokens(response.json())
                     st.session_state.username = username
-                    st.session_state.role = "admin" if username == "admin" else "user"
                     st.success(f"Logged in as {username}")
                 else:
                     st.error(f"Login failed: {response.json().get('detail', 'Unknown error')}")
@@ -77,12 +163,10 @@ def admin_login():
     if st.sidebar.button("Admin Login"):
         if admin_username and admin_password:
             with st.spinner("Logging in..."):
-                response = requests.post(f"{BACKEND_URL}/login", data={"username": admin_username, "password": admin_password})
+                response = http_session().post(f"{BACKEND_URL}/login", data={"username": admin_username, "password": admin_password})
                 if response.status_code == 200:
-                    result = response.json()
-                    st.session_state.access_token = result['access_token']
+                    store_tokens(response.json())
                     st.session_state.username = admin_username
-                    st.session_state.role = "admin"
                     st.success(f"Logged in as {admin_username}")
                 else:
                     st.error(f"Admin login failed: {response.json().get('detail', 'Unknown error')}")
@@ -95,8 +179,7 @@ def list_users():
         st.warning("You do not have permission to view this page.")
         return
 
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-    response = requests.get(f"{BACKEND_URL}/admin/users/", headers=headers)
+    response = admin_get("/admin/users/")
     if response.status_code == 200:
         users = response.json()
         st.write(users)
@@ -112,8 +195,7 @@ def get_attendance():
     date = st.date_input("Select date")
     if st.button("Get Attendance"):
         date_str = date.strftime("%Y-%m-%d")
-        headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-        response = requests.get(f"{BACKEND_URL}/admin/attendance/{date_str}", headers=headers)
+        response = admin_get(f"/admin/attendance/{date_str}")
         if response.status_code == 200:
             attendance = response.json()
             st.write(attendance)
@@ -126,8 +208,7 @@ def list_attendance_sheets():
         st.warning("You do not have permission to view this page.")
         return
 
-    headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-    response = requests.get(f"{BACKEND_URL}/admin/attendance-sheets/", headers=headers)
+    response = admin_get("/admin/attendance-sheets/")
     if response.status_code == 200:
         attendance_sheets = response.json()
         st.write(attendance_sheets)
@@ -146,8 +227,7 @@ def list_attendance_sheets_range():
         start_date_str = start_date.strftime("%Y-%m-%d")
         end_date_str = end_date.strftime("%Y-%m-%d")
         
-        headers = {"Authorization": f"Bearer {st.session_state.access_token}"}
-        response = requests.get(f"{BACKEND_URL}/admin/attendance-sheets-range", headers=headers, params={"start_date": start_date_str, "end_date": end_date_str})
+        response = admin_get("/admin/attendance-sheets-range", params={"start_date": start_date_str, "end_date": end_date_str})
         if response.status_code == 200:
             attendance_sheets = response.json()
             st.write(attendance_sheets)
@@ -169,7 +249,7 @@ def register():
                     files = {'image_data': ('image.jpg', image_file, 'image/jpeg')}
                     data = {'username': username}
                     with st.spinner("Registering..."):
-                        response = requests.post(f"{BACKEND_URL}/register", files=files, data=data)
+                        response = http_session().post(f"{BACKEND_URL}/register", files=files, data=data)
                     if response.status_code == 200:
                         st.success(response.json()['message'])
                     else:
@@ -181,6 +261,43 @@ def register():
         else:
             st.warning("Please provide a username.")
 
+def show_check_in(response):
+    if response.status_code == 200:
+        result = response.json()
+        if 'user_id' in result:
+            st.session_state.user_id = result['user_id']
+            st.session_state.username = result['username']
+            st.success(f"Attendance marked as {result['username']} (Similarity score: {result['similarity_score']:.2f})")
+        else:
+            st.warning(result['message'])
+    else:
+        st.error(f"Attendance marking failed: {response.json().get('detail', 'Unknown error')}")
+
+def kiosk():
+    """Detect and crop the face locally and upload only the crop (or its embedding)."""
+    st.subheader("Kiosk Check-in")
+    modes = ["Face crop"] + (["Embedding"] if embedding_model() is not None else [])
+    mode = st.radio("Send", modes, horizontal=True)
+
+    if st.button("Check in"):
+        image = capture_image()
+        if image is None:
+            st.error("Failed to capture image. Please make sure your webcam is working and try again.")
+            return
+        face = crop_face(image)
+        if face is None:
+            st.warning("No face found, please look at the camera.")
+            return
+        with st.spinner("Checking in..."):
+            if mode == "Embedding":
+                payload = {"embedding": local_embedding(face), "dtype": "float16", "model": EMBEDDING_MODEL}
+                response = http_session().post(f"{BACKEND_URL}/mark-attendance/embedding", json=payload)
+            else:
+                _, encoded = cv2.imencode(".jpg", cv2.cvtColor(face, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+                files = {'image_data': ('face.jpg', encoded.tobytes(), 'image/jpeg')}
+                response = http_session().post(f"{BACKEND_URL}/mark-attendance/crop", files=files)
+        show_check_in(response)
+
 def mark_attendance():
     if st.button("Mark Attendance"):
         if not img_data:
@@ -192,17 +309,8 @@ def mark_attendance():
             if image_file:
                 files = {'image_data': ('image.jpg', image_file, 'image/jpeg')}
                 with st.spinner("Logging in..."):
-                    response = requests.post(f"{BACKEND_URL}/mark-attendance", files=files)
-                if response.status_code == 200:
-                    result = response.json()
-                    if 'user_id' in result:
-                        st.session_state.user_id = result['user_id']
-                        st.session_state.username = result['username']
-                        st.success(f"Attendance marked as {result['username']} (Similarity score: {result['similarity_score']:.2f})")
-                    else:
-                        st.warning(result['message'])
-                else:
-                    st.error(f"Attendance marking failed: {response.json().get('detail', 'Unknown error')}")
+                    response = http_session().post(f"{BACKEND_URL}/mark-attendance", files=files)
+                show_check_in(response)
             else:
                 st.error("Failed to process image.")
         else:
@@ -212,7 +320,7 @@ if 'access_token' not in st.session_state:
     admin_login()
 else:
     st.sidebar.title("Navigation")
-    choice = st.sidebar.radio("Go to", ["Home", "List Users", "Get Attendance", "List Attendance Sheets", "List Attendance Sheets by Date Range", "Admin Login"])
+    choice = st.sidebar.radio("Go to", ["Home", "Kiosk", "List Users", "Get Attendance", "List Attendance Sheets", "List Attendance Sheets by Date Range", "Admin Login"])
 
     if choice == "Home":
         col1, col2 = st.columns(2)
@@ -225,6 +333,8 @@ else:
                 register()
             elif operation == "Mark Attendance":
                 mark_attendance()
+    elif choice == "Kiosk":
+        kiosk()
     elif choice == "List Users":
         list_users()
     elif choice == "Get Attendance":